@@ -1,163 +1,306 @@
 # -*- coding: utf-8 -*-
+"""
+Clusterização dos alunos (KMeans sobre notas e idade) em lote.
+
+Para cada planilha: escolhe k pela varredura (cotovelo + silhouette), ajusta
+o modelo, projeta os alunos em 2D (PCA) e grava os gráficos e a planilha com
+a coluna Cluster numa pasta própria dentro da pasta de saída. Importar este
+módulo não executa nada; o pipeline roda por `process_file` ou pela linha
+de comando:
+
+    python ML.py "Dados da Escola.xlsx" outras/*.xlsx [--saida resultados] [--processos 4]
+                 [--k 3] [--semente 42] [--forcar]
+
+Arquivos cujo conteúdo (hash) e parâmetros não mudaram desde a última
+execução são pulados; o manifesto `manifesto.json` de cada pasta guarda o
+hash e os parâmetros usados.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
-import pandas as pd
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
-from pandas.core.base import PandasObject
-from pandas.core.interchange.dataframe_protocol import DataFrame
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
-
-def flatten_multilevel_columns(df):
-    """Se df.columns for MultiIndex, achata para strings como “Topo – Sub”."""
-    if isinstance(df.columns, pd.MultiIndex):
-        new_cols = []
-        for top, sub in df.columns:
-            top = str(top).strip()
-            sub = str(sub).strip()
-            if top and sub:
-                new_name = f"{top} - {sub}"
-            elif sub:
-                new_name = sub
-            else:
-                new_name = top
-            new_cols.append(new_name)
-        df.columns = new_cols
-    return df
+import pandas as pd
+
+from cache import fingerprint_bytes
+from charts import SCATTER_MAX_POINTS, cluster_scatter, stratified_sample
+from clustering import fit_model, sweep_k
+from figures import save_figure
+from ingest import find_workbooks, read_path
 
-def read_uploaded_file(uploaded_file: str):
-    """
-    Lê o arquivo (CSV ou Excel com múltiplas planilhas),
-    achata cabeçalhos multilinha e concatena as planilhas.
-    Retorna um DataFrame “plano”.
-    """
-    _, ext = os.path.splitext(uploaded_file.lower())
-    if ext in (".xls", ".xlsx"):
-        # lê todas as planilhas
-        dict_dfs = pd.read_excel(uploaded_file, sheet_name=None, header=[0,1])
-        list_flat = []
-        for sheet_name, df in dict_dfs.items():
-            # flatten colunas multilinha
-            df = flatten_multilevel_columns(df)
-            # opcional: marcar de qual planilha veio
-            df["PLANILHA"] = sheet_name
-            list_flat.append(df)
-        # concatenar todas
-        df_concat = pd.concat(list_flat, ignore_index=True, sort=False)
-        return df_concat.fillna(0)
-    elif ext == ".csv":
-        df = pd.read_csv(uploaded_file)
-        return df.fillna(0)
-    else:
-        raise ValueError(f"Formato de arquivo não suportado: {ext}")
-
-# =========================================
-# 1. Leitura dos dados
-# =========================================
-# Substitua o caminho abaixo pelo seu arquivo
-# df = pd.read_excel("Dados da Escola.xlsx")
-df = read_uploaded_file("Dados da Escola.xlsx")
-
-# Exibe as 5 primeiras linhas para conferir
-#print("Prévia dos dados:")
-#print(df.head())
-
-# =========================================
-# 2. Seleção das colunas numéricas relevantes
-# =========================================
 # Vamos considerar apenas notas e idade para os clusters
 colunas_notas = ['DADOS GERAIS - IDADE', 'NOTAS - LP', 'NOTAS - LI', 'NOTAS - BIO', 'NOTAS - FÍS',
                  'NOTAS - QUÍ', 'NOTAS - MAT', 'NOTAS - GEO', 'NOTAS - HIS', 'NOTAS - FIL', 'NOTAS - SOC']
-df_numerico = df[colunas_notas].dropna()
-
-# =========================================
-# 3. Padronização dos dados (muito importante)
-# =========================================
-scaler = StandardScaler()
-dados_padronizados = scaler.fit_transform(df_numerico)
-
-# =========================================
-# 4. Determinar número ideal de clusters (metodo do cotovelo)
-# =========================================
-inercia = []
-for k in range(1, 10):
-    kmeans = KMeans(n_clusters=k, random_state=42)
-    kmeans.fit(dados_padronizados)
-    inercia.append(kmeans.inertia_)
-
-plt.plot(range(1, 10), inercia, marker='o')
-plt.title('Método do Cotovelo')
-plt.xlabel('Número de Clusters (k)')
-plt.ylabel('Inércia')
-plt.grid(True)
-#plt.show()
-plt.savefig("grafico_inercia.png", dpi=300, bbox_inches='tight')
-print("Gráfico salvo como grafico_clusters.png")
-
-# =========================================
-# 5. Treinar o modelo K-Means
-# =========================================
-# Supondo que você observou o gráfico e escolheu, por exemplo, k=3
-k = 3
-modelo = KMeans(n_clusters=k, random_state=42)
-df['Cluster'] = modelo.fit_predict(dados_padronizados)
-
-# =========================================
-# 6. Redução de dimensão para visualização (PCA)
-# =========================================
-pca = PCA(n_components=2)
-componentes = pca.fit_transform(dados_padronizados)
-
-plt.figure(figsize=(8, 6))
-plt.scatter(componentes[:, 0], componentes[:, 1], c=df['Cluster'], cmap='viridis')
-plt.title('Clusters de alunos (reduzido a 2D pelo PCA)')
-plt.xlabel('Componente Principal 1')
-plt.ylabel('Componente Principal 2')
-plt.colorbar(label='Cluster')
-#plt.show()
-plt.savefig("grafico_clusters.png", dpi=300, bbox_inches='tight')
-print("Gráfico salvo como grafico_clusters.png")
-
-# =========================================
-# 7. Análise dos clusters
-# =========================================
-media_clusters = df.groupby('Cluster')[colunas_notas].mean()
-print("\nMédias por cluster:")
-print(media_clusters)
-
-# =========================================
-# 8. Gráfico de barras das médias
-# =========================================
-plt.figure(figsize=(10, 6))
-media_clusters.T.plot(kind='bar')
-plt.title('Médias das disciplinas por cluster')
-plt.xlabel('Disciplinas')
-plt.ylabel('Média das notas')
-plt.legend(title='Cluster')
-plt.tight_layout()
-plt.savefig("grafico_medias_por_cluster.png", dpi=300, bbox_inches='tight')
-print("Gráfico de médias por cluster salvo como grafico_medias_por_cluster.png")
-
-# =========================================
-# 9. Distribuição de alunos por PERÍODO e Cluster
-# =========================================
-if 'DADOS GERAIS - PERIODO' in df.columns:
-    dist_periodo = pd.crosstab(df['DADOS GERAIS - PERIODO'], df['Cluster'])
-    print("\nDistribuição de alunos por período e cluster:")
-    print(dist_periodo)
-
-    plt.figure(figsize=(8, 6))
-    dist_periodo.plot(kind='bar')
-    plt.title('Número de alunos por período em cada cluster')
-    plt.xlabel('Período')
-    plt.ylabel('Número de alunos')
-    plt.legend(title='Cluster')
-    plt.tight_layout()
-    plt.savefig("grafico_periodo_por_cluster.png", dpi=300, bbox_inches='tight')
-    print("Gráfico de distribuição por período salvo como grafico_periodo_por_cluster.png")
-else:
-    print("\n⚠️ Coluna 'PERIODO' não encontrada no arquivo. Gráfico não gerado.")
-
-# Salvar o resultado
-df.to_csv("dados_com_clusters.csv", index=False)
-print("\nArquivo salvo como dados_com_clusters.csv")
+
+DEFAULT_INPUT = "Dados da Escola.xlsx"
+DEFAULT_OUTPUT_DIR = "resultados"
+MANIFEST = "manifesto.json"
+# Incrementar quando as saídas do pipeline mudarem (invalida os manifestos)
+PIPELINE_VERSION = 1
+
+
+def read_uploaded_file(uploaded_file: str):
+    """
+    Lê o arquivo (CSV ou Excel com múltiplas planilhas) já achatado e
+    concatenado, reaproveitando o snapshot colunar quando existir.
+    """
+    return read_path(uploaded_file)
+
+
+def cluster_students(df, k=None, seed=42, k_values=range(1, 10)):
+    """
+    Clusteriza os alunos de `df` (sem gravar nada). Retorna um dict com o
+    DataFrame com a coluna Cluster (vazia nas linhas com dados ausentes), a
+    varredura de k, o modelo, os rótulos e componentes PCA dos alunos
+    clusterizados e as tabelas por cluster.
+    """
+    # =========================================
+    # 1. Seleção das colunas numéricas relevantes
+    # =========================================
+    df_numerico = df[colunas_notas].dropna()
+
+    # =========================================
+    # 2. Determinar número ideal de clusters (cotovelo + silhouette, k em paralelo)
+    # =========================================
+    # (a varredura padroniza os dados; acima de clustering.STREAMING_ROWS usa uma amostra)
+    # (sem tempo limite: no lote, o k escolhido não pode depender da velocidade da máquina)
+    dados_numericos = df_numerico.to_numpy(dtype="float32")
+    varredura = sweep_k(dados_numericos, k_values, seed=seed, time_budget=float("inf"), standardize=True)
+    if k is None:
+        # k escolhido automaticamente pela varredura (maior silhouette)
+        if not varredura.complete or varredura.best_k is None:
+            raise ValueError(f"varredura de k incompleta (k não avaliados: {varredura.skipped}); "
+                             "informe --k")
+        k = varredura.best_k
+
+    # =========================================
+    # 3. Treinar o modelo K-Means
+    # =========================================
+    # acima de clustering.STREAMING_ROWS alunos o ajuste é incremental (MiniBatchKMeans)
+    modelo = fit_model(dados_numericos, "ML.py", colunas_notas, k, seed=seed)
+    rotulos = modelo.fit_labels(dados_numericos)
+    df = df.assign(Cluster=pd.Series(rotulos, index=df_numerico.index))
+
+    # =========================================
+    # 4. Redução de dimensão para visualização (PCA) e análise dos clusters
+    # =========================================
+    resultado = {
+        "df": df,
+        "varredura": varredura,
+        "modelo": modelo,
+        "rotulos": rotulos,
+        "componentes": modelo.project(dados_numericos),
+        "media_clusters": df.groupby('Cluster')[colunas_notas].mean(),
+        "dist_periodo": None,
+    }
+    if 'DADOS GERAIS - PERIODO' in df.columns:
+        resultado["dist_periodo"] = pd.crosstab(df['DADOS GERAIS - PERIODO'], df['Cluster'])
+    return resultado
+
+
+def write_outputs(resultado, pasta):
+    """Grava gráficos e planilhas do resultado em `pasta`. Retorna os arquivos gerados."""
+    os.makedirs(pasta, exist_ok=True)
+    gerados = []
+
+    def caminho(nome):
+        gerados.append(nome)
+        return os.path.join(pasta, nome)
+
+    # (cada figura é criada explicitamente e fechada ao ser gravada)
+    varredura = resultado["varredura"]
+    fig, ax = plt.subplots()
+    ax.plot(varredura.k, varredura.inertia, marker='o')
+    ax.set_title('Método do Cotovelo')
+    ax.set_xlabel('Número de Clusters (k)')
+    ax.set_ylabel('Inércia')
+    ax.grid(True)
+    save_figure(fig, caminho("grafico_inercia.png"))
+    varredura.to_frame().to_csv(caminho("varredura_k.csv"))
+
+    # acima de SCATTER_MAX_POINTS alunos a imagem usa uma amostra estratificada
+    # por cluster e o gráfico completo vai para um HTML interativo (contagens por célula)
+    componentes = resultado["componentes"]
+    rotulos = resultado["rotulos"]
+    amostra = stratified_sample(rotulos, SCATTER_MAX_POINTS, seed=42)
+    if len(amostra) < len(rotulos):
+        grafico, _ = cluster_scatter(componentes, rotulos, reduction="grade")
+        grafico.save(caminho("grafico_clusters.html"))
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    scatter = ax.scatter(componentes[amostra, 0], componentes[amostra, 1], c=rotulos[amostra], cmap='viridis')
+    ax.set_title('Clusters de alunos (reduzido a 2D pelo PCA)')
+    ax.set_xlabel('Componente Principal 1')
+    ax.set_ylabel('Componente Principal 2')
+    fig.colorbar(scatter, ax=ax, label='Cluster')
+    save_figure(fig, caminho("grafico_clusters.png"))
+
+    # Gráfico de barras das médias
+    media_clusters = resultado["media_clusters"]
+    media_clusters.to_csv(caminho("medias_por_cluster.csv"))
+    fig, ax = plt.subplots(figsize=(10, 6))
+    media_clusters.T.plot(kind='bar', ax=ax)
+    ax.set_title('Médias das disciplinas por cluster')
+    ax.set_xlabel('Disciplinas')
+    ax.set_ylabel('Média das notas')
+    ax.legend(title='Cluster')
+    fig.tight_layout()
+    save_figure(fig, caminho("grafico_medias_por_cluster.png"))
+
+    # Distribuição de alunos por PERÍODO e Cluster
+    dist_periodo = resultado["dist_periodo"]
+    if dist_periodo is not None:
+        fig, ax = plt.subplots(figsize=(8, 6))
+        dist_periodo.plot(kind='bar', ax=ax)
+        ax.set_title('Número de alunos por período em cada cluster')
+        ax.set_xlabel('Período')
+        ax.set_ylabel('Número de alunos')
+        ax.legend(title='Cluster')
+        fig.tight_layout()
+        save_figure(fig, caminho("grafico_periodo_por_cluster.png"))
+
+    # Salvar o resultado
+    resultado["df"].to_csv(caminho("dados_com_clusters.csv"), index=False)
+    return gerados
+
+
+def output_dir(arquivo, saida):
+    """
+    Pasta de saída de um arquivo dentro de `saida`: nome, extensão e um hash
+    curto do caminho absoluto (ex.: escola-xlsx-1a2b3c4d), para que
+    a/escola.xlsx, b/escola.xlsx e escola.csv não gravem na mesma pasta.
+    """
+    caminho = os.path.abspath(arquivo)
+    nome, ext = os.path.splitext(os.path.basename(caminho))
+    sufixo = hashlib.sha256(caminho.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(saida, f"{nome}-{ext.lstrip('.').lower() or 'arquivo'}-{sufixo}")
+
+
+def read_manifest(pasta):
+    try:
+        with open(os.path.join(pasta, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(pasta, arquivo, fingerprint, parametros):
+    """Saídas existentes geradas a partir do mesmo arquivo, conteúdo e parâmetros."""
+    manifesto = read_manifest(pasta)
+    if manifesto is None:
+        return False
+    if (manifesto.get("versao"), manifesto.get("arquivo"), manifesto.get("fingerprint"),
+            manifesto.get("parametros")) != (PIPELINE_VERSION, os.path.abspath(arquivo), fingerprint, parametros):
+        return False
+    return all(os.path.exists(os.path.join(pasta, nome)) for nome in manifesto.get("arquivos", []))
+
+
+def process_file(arquivo, saida=DEFAULT_OUTPUT_DIR, k=None, seed=42, forcar=False):
+    """
+    Roda o pipeline para um arquivo, a menos que as saídas já estejam
+    atualizadas. Retorna (arquivo, status, segundos, k usado ou None).
+    """
+    inicio = time.perf_counter()
+    with open(arquivo, "rb") as f:
+        fingerprint = fingerprint_bytes(f.read())
+    pasta = output_dir(arquivo, saida)
+    parametros = {"k": k, "semente": seed}
+    if not forcar and is_up_to_date(pasta, arquivo, fingerprint, parametros):
+        return arquivo, "atualizado", time.perf_counter() - inicio, read_manifest(pasta).get("k")
+
+    resultado = cluster_students(read_uploaded_file(arquivo), k=k, seed=seed)
+    arquivos = write_outputs(resultado, pasta)
+    k_usado = int(resultado["modelo"].k)
+    manifesto = {"versao": PIPELINE_VERSION, "arquivo": os.path.abspath(arquivo), "fingerprint": fingerprint,
+                 "parametros": parametros, "k": k_usado, "metodo": resultado["modelo"].method,
+                 "arquivos": arquivos, "created": time.time()}
+    # o manifesto é gravado por último: uma execução interrompida não conta como atualizada
+    temporario = os.path.join(pasta, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, os.path.join(pasta, MANIFEST))
+    return arquivo, "processado", time.perf_counter() - inicio, k_usado
+
+
+def _process_safe(arquivo, *args):
+    # falha em um arquivo não interrompe os demais
+    try:
+        return process_file(arquivo, *args)
+    except Exception as erro:  # noqa: BLE001
+        print(f"erro em {arquivo}: {erro}", file=sys.stderr)
+        return arquivo, "falhou", 0.0, None
+
+
+def unique_inputs(arquivos, saida=DEFAULT_OUTPUT_DIR):
+    """
+    Arquivos sem repetições (mesmo caminho absoluto), na ordem recebida.
+    Levanta ValueError se dois arquivos diferentes fossem gravar na mesma pasta.
+    """
+    unicos = []
+    destinos = {}
+    for arquivo in arquivos:
+        caminho = os.path.abspath(arquivo)
+        pasta = output_dir(arquivo, saida)
+        anterior = destinos.get(pasta)
+        if anterior is None:
+            destinos[pasta] = caminho
+            unicos.append(arquivo)
+        elif anterior != caminho:
+            raise ValueError(f"{anterior} e {caminho} gravariam na mesma pasta: {pasta}")
+    return unicos
+
+
+def run_batch(arquivos, saida=DEFAULT_OUTPUT_DIR, k=None, seed=42, forcar=False, processos=1):
+    """
+    Processa os arquivos (em paralelo com `processos` > 1), na ordem recebida;
+    arquivos repetidos são processados uma vez só (ver unique_inputs).
+    """
+    arquivos = unique_inputs(arquivos, saida)
+    argumentos = (saida, k, seed, forcar)
+    if processos <= 1 or len(arquivos) <= 1:
+        return [_process_safe(arquivo, *argumentos) for arquivo in arquivos]
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(processos, len(arquivos)), mp_context=contexto) as pool:
+        futuros = [pool.submit(_process_safe, arquivo, *argumentos) for arquivo in arquivos]
+        return [futuro.result() for futuro in futuros]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clusteriza os alunos de uma ou mais planilhas.")
+    parser.add_argument("entradas", nargs="*", default=[DEFAULT_INPUT],
+                        help=f"arquivos, pastas ou padrões glob (padrão: {DEFAULT_INPUT!r})")
+    parser.add_argument("--saida", default=DEFAULT_OUTPUT_DIR,
+                        help=f"pasta de saída; uma subpasta por arquivo (padrão: {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument("--processos", type=int, default=1, help="arquivos processados em paralelo")
+    parser.add_argument("--k", type=int, default=None, help="número de clusters (padrão: escolha automática)")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--forcar", action="store_true", help="reprocessa mesmo com saídas atualizadas")
+    args = parser.parse_args(argv)
+
+    arquivos = find_workbooks(args.entradas)
+    arquivos = [a for a in arquivos if os.path.isfile(a)]
+    if not arquivos:
+        print("Nenhuma planilha encontrada.", file=sys.stderr)
+        return 1
+    try:
+        arquivos = unique_inputs(arquivos, args.saida)
+    except ValueError as erro:
+        print(erro, file=sys.stderr)
+        return 1
+
+    falhas = 0
+    for arquivo, status, segundos, k in run_batch(arquivos, args.saida, args.k, args.semente, args.forcar,
+                                                  args.processos):
+        falhas += status == "falhou"
+        detalhe = f"k={k}" if k is not None else ""
+        print(f"{status:>10}  {segundos:6.2f}s  {detalhe:>5}  {arquivo}")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Estatísticas agrupadas em uma única passada sobre códigos de grupo.
+
+As linhas são ordenadas uma vez pelo grupo (códigos já fatorizados, como os
+do índice de chaves) e todas as estatísticas saem de reduções segmentadas
+(np.*.reduceat) sobre esse arranjo: contagem, soma, média, máximo, mínimo,
+quantos estão acima/abaixo de um limiar e, opcionalmente, mediana e desvio
+padrão. Aceita uma coluna de valores ou uma matriz (linhas x colunas).
+
+Contagem, soma, mínimo e máximo também podem ser calculados por partes
+(GroupPartial, ex.: uma por aba) e combinados depois, sem rever as linhas.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def group_ids(codes, sizes, mask=None):
+    """
+    Um id por linha a partir dos códigos de cada chave (ordem lexicográfica
+    das chaves); linhas com alguma chave ausente (-1) ou fora de `mask`
+    ficam com -1.
+    """
+    validas = np.ones(len(codes[0]), dtype=bool) if mask is None else mask.copy()
+    for c in codes:
+        validas &= c >= 0
+    gid = np.full(len(validas), -1, dtype=np.int64)
+    gid[validas] = np.ravel_multi_index([c[validas] for c in codes], sizes)
+    return gid
+
+
+def _median_sorted(ordenados, inicios, contagem):
+    """Mediana de cada segmento de um vetor já ordenado dentro dos segmentos."""
+    meio = inicios + (contagem - 1) // 2
+    return (ordenados[meio] + ordenados[meio + (contagem % 2 == 0)]) / 2
+
+
+def grouped_stats(gid, values, threshold=None, median=False, std=False):
+    """
+    Estatísticas de `values` por grupo (`gid` de group_ids; -1 é ignorado).
+
+    Retorna um dict com "groups" (ids presentes, em ordem crescente) e, por
+    grupo: "count", "sum", "mean", "max", "min"; com `threshold`, também
+    "above" (> limiar) e "below" (<= limiar); opcionalmente "median" e "std"
+    (ddof=1, como no pandas). Com `values` 2D, cada estatística vira uma
+    matriz (grupos x colunas).
+    """
+    values = np.asarray(values)
+    manter = gid >= 0
+    ordem = np.flatnonzero(manter)[np.argsort(gid[manter], kind="stable")]
+    g = gid[ordem]
+    v = values[ordem].astype(np.float64, copy=False)
+
+    if len(g) == 0:
+        # sem linhas: mesmas chaves, com zero grupos
+        nomes = ["sum", "mean", "max", "min"] + (["above", "below"] if threshold is not None else [])
+        nomes += (["std"] if std else []) + (["median"] if median else [])
+        resultado = {"groups": g, "count": np.empty(0, dtype=np.int64)}
+        resultado.update({nome: np.empty((0,) + values.shape[1:]) for nome in nomes})
+        return resultado
+
+    inicios = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    contagem = np.diff(np.r_[inicios, len(g)])
+    n = contagem if v.ndim == 1 else contagem[:, None]
+
+    soma = np.add.reduceat(v, inicios, axis=0)
+    resultado = {
+        "groups": g[inicios],
+        "count": contagem,
+        "sum": soma,
+        "mean": soma / n,
+        "max": np.maximum.reduceat(v, inicios, axis=0),
+        "min": np.minimum.reduceat(v, inicios, axis=0),
+    }
+    if threshold is not None:
+        acima = np.add.reduceat((v > threshold).astype(np.int64), inicios, axis=0)
+        resultado["above"] = acima
+        resultado["below"] = n - acima
+    if std:
+        desvios = v - np.repeat(resultado["mean"], contagem, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            resultado["std"] = np.sqrt(np.add.reduceat(desvios ** 2, inicios, axis=0) / (n - 1))
+    if median:
+        if v.ndim == 1:
+            ordenados = v[np.lexsort((v, g))]
+            resultado["median"] = _median_sorted(ordenados, inicios, contagem)
+        else:
+            colunas = [_median_sorted(v[np.lexsort((v[:, j], g)), j], inicios, contagem)
+                       for j in range(v.shape[1])]
+            resultado["median"] = np.column_stack(colunas)
+    return resultado
+
+
+def group_summary(index, cols, values, mask=None, threshold=None, median=False, std=False):
+    """
+    Estatísticas de `values` (1D) por combinação das chaves `cols` do índice,
+    como um DataFrame: as chaves e as colunas de grouped_stats, uma linha por
+    grupo presente, ordenadas pelas chaves.
+    """
+    cols = list(cols)
+    tamanhos = [len(index.labels[col]) for col in cols]
+    gid = group_ids([index.codes[col] for col in cols], tamanhos, mask)
+    stats = grouped_stats(gid, values, threshold=threshold, median=median, std=std)
+    resumo = index.keys_frame(cols, stats.pop("groups"))
+    for nome, valores in stats.items():
+        resumo[nome] = valores
+    return resumo
+
+
+# =========================================
+# Parciais combináveis (ex.: uma por aba da planilha)
+# =========================================
+@dataclass(frozen=True)
+class GroupPartial:
+    """Contagem, soma, mínimo e máximo por grupo, identificados pelos valores das chaves."""
+    keys: pd.DataFrame    # uma linha por grupo (valores das chaves)
+    count: np.ndarray
+    sum: np.ndarray       # (grupos,) ou (grupos x colunas)
+    min: np.ndarray
+    max: np.ndarray
+
+    @property
+    def mean(self):
+        n = self.count if self.sum.ndim == 1 else self.count[:, None]
+        return self.sum / n
+
+
+def partial_stats(index, cols, values, mask=None):
+    """Parcial de `values` por combinação das chaves `cols`, nas linhas de `mask`."""
+    cols = list(cols)
+    tamanhos = [len(index.labels[col]) for col in cols]
+    gid = group_ids([index.codes[col] for col in cols], tamanhos, mask)
+    stats = grouped_stats(gid, values)
+    return GroupPartial(keys=index.keys_frame(cols, stats["groups"]), count=stats["count"],
+                        sum=stats["sum"], min=stats["min"], max=stats["max"])
+
+
+def combine_keys(frames, dtypes=None):
+    """
+    Une as chaves de várias parciais: retorna (id do grupo combinado de cada
+    linha das chaves concatenadas, chaves distintas ordenadas). `dtypes`
+    ({coluna: dtype}) define o tipo das chaves no resultado.
+    """
+    cols = list(frames[0].columns)
+    chaves = pd.concat([f.astype(object) for f in frames], ignore_index=True)
+    gid = chaves.groupby(cols, sort=True).ngroup().to_numpy()
+    keys = chaves.assign(_grupo=gid).drop_duplicates("_grupo").sort_values("_grupo")[cols]
+    keys = keys.reset_index(drop=True)
+    for col, dtype in (dtypes or {}).items():
+        if col in keys:
+            keys[col] = keys[col].astype(dtype)
+    return gid, keys
+
+
+def merge_partials(partials, dtypes=None):
+    """
+    Combina parciais (somas e contagens somadas, mínimo dos mínimos, máximo
+    dos máximos) em uma só, com os grupos ordenados pelos valores das chaves.
+    `dtypes` ({coluna: dtype}) define o tipo das chaves no resultado.
+    """
+    partials = list(partials)
+    gid, keys = combine_keys([p.keys for p in partials], dtypes)
+    n = len(keys)
+
+    def combinar(nome, ufunc, inicial):
+        valores = np.concatenate([getattr(p, nome) for p in partials])
+        saida = np.full((n,) + valores.shape[1:], inicial, dtype=valores.dtype)
+        ufunc.at(saida, gid, valores)
+        return saida
+
+    return GroupPartial(keys=keys, count=combinar("count", np.add, 0), sum=combinar("sum", np.add, 0),
+                        min=combinar("min", np.minimum, np.inf), max=combinar("max", np.maximum, -np.inf))
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark das abas do app, sem servidor: gera planilhas sintéticas
+(synthetic.py) de cada tamanho e mede, separadamente, read_uploaded_file e
+as funções das abas (general_performance, subject_performance, dispersal,
+cluster_analysis e manual_filter) com os widgets nos valores padrão.
+
+As saídas do Streamlit (tabelas, gráficos, textos) são substituídas por
+funções vazias, para medir só o trabalho do app. Cada medição começa com
+os caches vazios (resultados, imagens, modelos, snapshots): o tempo é o
+menor de `--repeticoes` execuções e a memória é o pico do tracemalloc numa
+execução à parte. O relatório sai em JSON (`--json`) e em Markdown; com
+`--comparar relatorio_anterior.json`, cada linha mostra a razão em relação
+à medição anterior e marca as que pioraram além de `--tolerancia`.
+
+    python benchmarks/bench_app.py --alunos 1000 10000 100000 --json atual.json
+    python benchmarks/bench_app.py --alunos 1000 10000 100000 --comparar atual.json
+"""
+import argparse
+import gc
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# pastas temporárias para snapshots e modelos (lidas na importação dos módulos)
+PASTA = tempfile.mkdtemp(prefix="pi-bench-")
+os.environ["PI_SNAPSHOT_DIR"] = os.path.join(PASTA, "snapshots")
+os.environ["PI_MODEL_DIR"] = os.path.join(PASTA, "modelos")
+os.environ["PI_BACKGROUND_JOBS"] = "0"
+
+import matplotlib  # noqa: E402
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import streamlit as st  # noqa: E402
+
+from synthetic import write_students  # noqa: E402
+
+ABAS = ["general_performance", "subject_performance", "dispersal", "cluster_analysis", "manual_filter"]
+# saídas do Streamlit trocadas por funções vazias (widgets e layout ficam no modo bare)
+SAIDAS = ["altair_chart", "bar_chart", "caption", "code", "dataframe", "download_button", "error", "image",
+          "info", "json", "line_chart", "markdown", "metric", "progress", "pyplot", "subheader", "success",
+          "table", "text", "title", "warning", "write"]
+
+
+def stub_streamlit():
+    """Troca as saídas do Streamlit por funções vazias e silencia os avisos do modo bare."""
+    warnings.filterwarnings("ignore")
+    logging.disable(logging.WARNING)
+    for nome in SAIDAS:
+        setattr(st, nome, lambda *args, **kwargs: None)
+
+
+def load_app():
+    """Importa o pi-app.py (o nome tem hífen) como módulo."""
+    spec = importlib.util.spec_from_file_location("pi_app", os.path.join(RAIZ, "pi-app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+class Upload(io.BytesIO):
+    """Arquivo enviado, como o UploadedFile do Streamlit (sem file_id: sempre lido)."""
+
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(caminho)
+        self.file_id = None
+
+
+def reset_caches(app):
+    """Esvazia os caches do processo, para cada medição partir do zero."""
+    app.get_results_cache().clear()
+    app.get_figure_cache().clear()
+    app.get_cluster_engine().models.clear()
+    # datasets sem referências ficam no LRU do armazenamento: a leitura seria um acerto
+    app.get_dataset_store().clear()
+    for pasta in (os.environ["PI_SNAPSHOT_DIR"], os.environ["PI_MODEL_DIR"]):
+        shutil.rmtree(pasta, ignore_errors=True)
+    gc.collect()
+
+
+def measure(app, func, repeticoes):
+    """(menor tempo em s, pico de memória em MB), com os caches vazios antes de cada execução."""
+    tempos = []
+    for _ in range(repeticoes):
+        reset_caches(app)
+        inicio = time.perf_counter()
+        func()
+        tempos.append(time.perf_counter() - inicio)
+    reset_caches(app)
+    tracemalloc.start()
+    try:
+        func()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(tempos), pico / 1024 ** 2
+
+
+def bench_size(app, caminho, n_alunos, repeticoes):
+    """Medições de um arquivo: leitura e cada aba sobre o dataset lido."""
+    upload = Upload(caminho)
+
+    def ler():
+        # devolve o handle no fim: o dataset vai para o LRU, que reset_caches esvazia
+        try:
+            return app.read_uploaded_file(upload)
+        finally:
+            app.release_session_dataset()
+
+    linhas = []
+    segundos, pico = measure(app, ler, repeticoes)
+    linhas.append({"função": "read_uploaded_file", "alunos": n_alunos, "segundos": segundos, "pico (MB)": pico})
+
+    app.release_session_dataset()
+    dataset = app.load_uploaded_dataset(upload, streaming=False)
+    for nome in ABAS:
+        aba = getattr(app, nome)
+        segundos, pico = measure(app, lambda: aba(dataset), repeticoes)
+        linhas.append({"função": nome, "alunos": n_alunos, "segundos": segundos, "pico (MB)": pico})
+    app.release_session_dataset()
+    return linhas
+
+
+def environment():
+    return {
+        "data": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "streamlit": st.__version__,
+        "cpus": os.cpu_count(),
+        "plataforma": platform.platform(),
+    }
+
+
+def compare(linhas, anterior, tolerancia):
+    """Acrescenta a razão em relação ao relatório anterior e marca as regressões."""
+    base = {(r["função"], r["alunos"]): r for r in anterior["resultados"]}
+    for linha in linhas:
+        ref = base.get((linha["função"], linha["alunos"]))
+        if ref is None:
+            continue
+        linha["razão tempo"] = linha["segundos"] / ref["segundos"] if ref["segundos"] else float("nan")
+        linha["razão memória"] = linha["pico (MB)"] / ref["pico (MB)"] if ref["pico (MB)"] else float("nan")
+        linha["regressão"] = bool(linha["razão tempo"] > tolerancia or linha["razão memória"] > tolerancia)
+    return linhas
+
+
+def markdown(relatorio):
+    parametros = relatorio["parâmetros"]
+    texto = [f"Benchmark das abas — {relatorio['ambiente']['data']} "
+             f"(Python {relatorio['ambiente']['python']}, pandas {relatorio['ambiente']['pandas']}, "
+             f"{relatorio['ambiente']['cpus']} CPUs; {parametros['formato']}, {parametros['abas']} abas)", ""]
+    comparado = any("razão tempo" in r for r in relatorio["resultados"])
+    cabecalho = ["função", "alunos", "tempo (ms)", "pico (MB)"]
+    if comparado:
+        cabecalho += ["razão tempo", "razão memória", ""]
+    texto.append("| " + " | ".join(cabecalho) + " |")
+    texto.append("|" + "---|" * len(cabecalho))
+    for r in relatorio["resultados"]:
+        celulas = [r["função"], str(r["alunos"]), f"{r['segundos'] * 1000:.1f}", f"{r['pico (MB)']:.1f}"]
+        if comparado:
+            if "razão tempo" in r:
+                celulas += [f"{r['razão tempo']:.2f}x", f"{r['razão memória']:.2f}x",
+                            "⚠ regressão" if r["regressão"] else ""]
+            else:
+                celulas += ["—", "—", ""]
+        texto.append("| " + " | ".join(celulas) + " |")
+    return "\n".join(texto)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alunos", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="tamanhos (total de alunos), ex.: 1000 10000 100000 1000000")
+    parser.add_argument("--abas", type=int, default=10, help="abas (escolas/anos) de cada planilha")
+    parser.add_argument("--formato", choices=["xlsx", "csv"], default="xlsx")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--dados", default=None,
+                        help="pasta das planilhas geradas (reaproveitadas entre execuções)")
+    parser.add_argument("--json", default=None, help="grava o relatório em JSON")
+    parser.add_argument("--markdown", default=None, help="grava a tabela em Markdown")
+    parser.add_argument("--comparar", default=None, help="relatório JSON anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=1.25,
+                        help="razão (tempo ou memória) a partir da qual a linha é marcada como regressão")
+    args = parser.parse_args(argv)
+
+    stub_streamlit()
+    app = load_app()
+    dados = args.dados or os.path.join(PASTA, "dados")
+    os.makedirs(dados, exist_ok=True)
+
+    linhas = []
+    try:
+        for n in args.alunos:
+            caminho = os.path.join(dados, f"sintetico_{n}_{args.abas}.{args.formato}")
+            if not os.path.exists(caminho):
+                write_students(caminho, n, args.abas)
+            for linha in bench_size(app, caminho, n, args.repeticoes):
+                print(f"{linha['função']:>20} {n:>8} {linha['segundos'] * 1000:>10.1f} ms "
+                      f"{linha['pico (MB)']:>8.1f} MB", file=sys.stderr)
+                linhas.append(linha)
+    finally:
+        shutil.rmtree(PASTA, ignore_errors=True)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            compare(linhas, json.load(f), args.tolerancia)
+    relatorio = {
+        "ambiente": environment(),
+        "parâmetros": {"formato": args.formato, "abas": args.abas, "repetições": args.repeticoes},
+        "resultados": linhas,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    tabela = markdown(relatorio)
+    if args.markdown:
+        with open(args.markdown, "w", encoding="utf-8") as f:
+            f.write(tabela + "\n")
+    print(tabela)
+    return 1 if any(r.get("regressão") for r in linhas) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do resumo da aba Desempenho Geral: implementação anterior (groupby
++ dois filtros/groupbys + dois merges + groupby da série anual) contra o
+kernel de uma passada sobre os códigos (aggregates.group_summary).
+
+    python benchmarks/bench_group_stats.py --alunos 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+from aggregates import group_summary  # noqa: E402
+from dataset import build_dataset  # noqa: E402
+from grades_core import COL_ANO, COL_SERIE, COL_TURMA  # noqa: E402
+from ingest import flatten_multilevel_columns  # noqa: E402
+from schema import apply_schema  # noqa: E402
+from synthetic import make_school_frame  # noqa: E402
+
+CHAVES = [COL_TURMA, COL_SERIE, COL_ANO]
+ANOS = 5
+
+
+def make_dataset(n_alunos):
+    partes = [flatten_multilevel_columns(make_school_frame(n_alunos // ANOS, ano=2020 + i, seed=i))
+              for i in range(ANOS)]
+    return build_dataset(apply_schema(pd.concat(partes, ignore_index=True)), "bench")
+
+
+def resumo_anterior(dataset):
+    """Como a aba calculava antes (groupby, filtros, merges e groupby anual)."""
+    df_notas = dataset.df[CHAVES].assign(**{"MÉDIA GERAL": dataset.core.means})[dataset.core.valid]
+    agrupado = df_notas.groupby(CHAVES, observed=True)["MÉDIA GERAL"].agg(
+        ["mean", "max", "min", "count"]).reset_index()
+    media_global = df_notas["MÉDIA GERAL"].mean()
+    acima = df_notas[df_notas["MÉDIA GERAL"] > media_global].groupby(
+        CHAVES, observed=True).size().reset_index(name="Acima da média")
+    abaixo = df_notas[df_notas["MÉDIA GERAL"] <= media_global].groupby(
+        CHAVES, observed=True).size().reset_index(name="Abaixo da média")
+    resumo = agrupado.merge(acima, on=CHAVES, how="left").merge(abaixo, on=CHAVES, how="left")
+    resumo = resumo.sort_values(by=CHAVES).reset_index(drop=True)
+    df_notas["TURMA_SÉRIE"] = df_notas[COL_TURMA].astype(str) + " - " + df_notas[COL_SERIE].astype(str)
+    serie = df_notas.groupby([COL_ANO, "TURMA_SÉRIE"])["MÉDIA GERAL"].mean().reset_index()
+    return resumo, serie
+
+
+def resumo_kernel(dataset):
+    """Uma passada: estatísticas por grupo e série anual derivada das somas."""
+    core = dataset.core
+    stats = group_summary(dataset.index, CHAVES, core.means, mask=core.valid,
+                          threshold=core.means[core.valid].mean())
+    serie = pd.DataFrame({
+        COL_ANO: stats[COL_ANO],
+        "TURMA_SÉRIE": stats[COL_TURMA].astype(str) + " - " + stats[COL_SERIE].astype(str),
+        "sum": stats["sum"], "count": stats["count"],
+    }).groupby([COL_ANO, "TURMA_SÉRIE"]).sum().reset_index()
+    serie["MÉDIA GERAL"] = serie.pop("sum") / serie.pop("count")
+    return stats, serie
+
+
+def medir(func, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = func()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alunos", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'alunos':>8} {'anterior (ms)':>14} {'kernel (ms)':>12} {'speedup':>8}")
+    for n in args.alunos:
+        dataset = make_dataset(n)
+        t_ant, (resumo, serie_ant) = medir(lambda: resumo_anterior(dataset), args.repeticoes)
+        t_ker, (stats, serie_ker) = medir(lambda: resumo_kernel(dataset), args.repeticoes)
+        # mesmos grupos, médias e contagens nas duas implementações
+        pd.testing.assert_series_equal(resumo["mean"], stats["mean"], check_names=False)
+        pd.testing.assert_series_equal(resumo["Acima da média"], stats["above"], check_names=False,
+                                       check_dtype=False)
+        pd.testing.assert_series_equal(serie_ant["MÉDIA GERAL"], serie_ker["MÉDIA GERAL"])
+        print(f"{len(dataset.df):>8} {t_ant * 1000:>14.1f} {t_ker * 1000:>12.1f} {t_ant / t_ker:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark dos outliers por turma da aba Dispersão: laço por disciplina e
+turma com quantis do pandas (referência) contra os limites vetorizados
+(outliers.find_outliers com group_codes). Os alunos de menor média ficam
+sem TURMA: devem ser comparados aos limites de todos os alunos, e não aos
+de um pseudo-grupo só com eles (que esconderia as notas baixas).
+
+    python benchmarks/bench_outliers.py --alunos 10000 100000 --sem-turma 0.05
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from bench_group_stats import make_dataset, medir  # noqa: E402
+from dataset import build_dataset  # noqa: E402
+from grades_core import COL_TURMA  # noqa: E402
+from outliers import WHISKER, find_outliers  # noqa: E402
+
+
+def outliers_referencia(df, matriz, disciplinas, grupos):
+    """Disciplina a disciplina e grupo a grupo; sem grupo (NaN) usa os limites de todos."""
+    linhas = []
+    for j, disciplina in enumerate(disciplinas):
+        notas = pd.Series(matriz[:, j])
+        conjuntos = [(grupos.isna().to_numpy(), notas)]
+        for g in grupos.dropna().unique():
+            mascara = (grupos == g).to_numpy()
+            conjuntos.append((mascara, notas[mascara]))
+        for mascara, base in conjuntos:
+            q1, q3 = base.quantile([0.25, 0.75])
+            iqr = q3 - q1
+            valores = notas[mascara]
+            fora = valores[(valores < q1 - WHISKER * iqr) | (valores > q3 + WHISKER * iqr)]
+            for i, nota in fora.items():
+                linhas.append((disciplina, i, nota))
+    return sorted(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alunos", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--sem-turma", type=float, default=0.05,
+                        help="fração dos alunos (os de menor média) sem TURMA")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'alunos':>8} {'sem turma':>9} {'outliers':>8} {'referência (ms)':>16} {'vetorizado (ms)':>16} "
+          f"{'speedup':>8}")
+    for n in args.alunos:
+        dataset = make_dataset(n)
+        df = dataset.df.copy()
+        medias = np.where(dataset.core.valid, dataset.core.means, np.inf)
+        sem_turma = medias <= np.quantile(medias, args.sem_turma)
+        df.loc[sem_turma, COL_TURMA] = np.nan
+        core = build_dataset(df, "bench").core
+        matriz = core.matrix[core.valid]
+        info = df[core.valid].reset_index(drop=True).assign(linha=lambda d: d.index)
+        grupos = info[COL_TURMA]
+        t_ref, ref = medir(lambda: outliers_referencia(info, matriz, core.subjects, grupos), args.repeticoes)
+        t_vet, tabela = medir(lambda: find_outliers(info, matriz, core.subjects, ["linha"],
+                                                    group_codes=core.codes[COL_TURMA][core.valid]),
+                              args.repeticoes)
+        # mesmos (disciplina, aluno, nota), inclusive os alunos sem turma
+        vetorizado = sorted(zip(tabela["Disciplina"], tabela["linha"], tabela["Nota"].astype(float)))
+        assert [(d, i) for d, i, _ in vetorizado] == [(d, i) for d, i, _ in ref]
+        assert np.allclose([v for *_, v in vetorizado], [v for *_, v in ref])
+        print(f"{n:>8} {int(sem_turma.sum()):>9} {len(tabela):>8} {t_ref * 1000:>16.1f} "
+              f"{t_vet * 1000:>16.1f} {t_ref / t_vet:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark da leitura paralela por aba (ingest.parse_sheets) em função da
+quantidade de abas da planilha.
+
+    python benchmarks/bench_parallel_sheets.py --abas 1 2 4 8 16 --alunos 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import ingest  # noqa: E402
+from synthetic import write_workbook  # noqa: E402
+
+
+def medir(func, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = func()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--abas", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--alunos", type=int, default=2000, help="alunos por aba")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"processos: {ingest.PARALLEL_WORKERS} | alunos por aba: {args.alunos}")
+    print(f"{'abas':>5} {'linhas':>8} {'sequencial (s)':>15} {'paralelo (s)':>13} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as pasta:
+        # aquece o pool para não medir a criação dos processos
+        ingest._get_pool().submit(int).result()
+        for n_abas in args.abas:
+            caminho = write_workbook(os.path.join(pasta, f"bench_{n_abas}.xlsx"), n_abas, args.alunos)
+            with open(caminho, "rb") as f:
+                data = f.read()
+            t_seq, seq = medir(lambda: pd.concat(ingest.parse_sheets(data, parallel=False),
+                                                 ignore_index=True), args.repeticoes)
+            t_par, par = medir(lambda: pd.concat(ingest.parse_sheets(data, parallel=True),
+                                                 ignore_index=True), args.repeticoes)
+            # o resultado (ordem das abas e PLANILHA) tem que ser idêntico
+            pd.testing.assert_frame_equal(seq, par)
+            print(f"{n_abas:>5} {len(seq):>8} {t_seq:>15.2f} {t_par:>13.2f} {t_seq / t_par:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
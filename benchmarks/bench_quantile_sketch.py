@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark dos quartis/limites do IQR da aba Dispersão: quantis exatos sobre
+a matriz de notas da seleção (np.nanquantile) contra o esboço montado na
+leitura (sketches.QuantileSketch), com o maior erro observado.
+
+    python benchmarks/bench_quantile_sketch.py --alunos 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from bench_group_stats import make_dataset, medir  # noqa: E402
+from grades_core import COL_SERIE  # noqa: E402
+from outliers import iqr_fences  # noqa: E402
+from sketches import grades_sketch  # noqa: E402
+
+
+def quartis_exatos(dataset, selecao):
+    return iqr_fences(dataset.core.matrix[selecao])
+
+
+def quartis_esboco(dataset, filtros):
+    return dataset.sketch.fences(dataset.sketch.groups(filtros))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alunos", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'alunos':>8} {'seleção':>8} {'montagem (ms)':>13} {'exato (ms)':>11} {'esboço (ms)':>12} "
+          f"{'speedup':>8} {'erro máx':>9}")
+    for n in args.alunos:
+        dataset = make_dataset(n)
+        inicio = time.perf_counter()
+        grades_sketch(dataset.index, dataset.core)
+        montagem = time.perf_counter() - inicio
+        n_disc = len(dataset.core.subjects)
+        for filtros in ({}, {COL_SERIE: dataset.index.values(COL_SERIE)[0]}):
+            selecao = dataset.index.mask(filtros)
+            t_exato, exato = medir(lambda: quartis_exatos(dataset, selecao), args.repeticoes)
+            t_esboco, esboco = medir(lambda: quartis_esboco(dataset, filtros), args.repeticoes)
+            erro = max(np.abs(e[:n_disc] - x).max() for e, x in zip(esboco, exato))
+            print(f"{n:>8} {int(selecao.sum()):>8} {montagem * 1000:>13.1f} {t_exato * 1000:>11.1f} "
+                  f"{t_esboco * 1000:>12.1f} {t_exato / t_esboco:>7.1f}x {erro:>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do ajuste incremental (MiniBatchKMeans por blocos) contra o KMeans
+exato: tempo, pico de memória, inércia relativa e concordância dos clusters (ARI).
+
+    python benchmarks/bench_streaming_kmeans.py --alunos 10000 100000 500000 --k 3
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from sklearn.metrics import adjusted_rand_score  # noqa: E402
+
+from clustering import fit_model  # noqa: E402
+from grades_core import GRADE_COLUMNS  # noqa: E402
+from ingest import flatten_multilevel_columns  # noqa: E402
+from synthetic import make_school_frame  # noqa: E402
+
+
+def grade_matrix(n_alunos, seed=0):
+    df = flatten_multilevel_columns(make_school_frame(n_alunos, seed=seed))
+    return np.ascontiguousarray(df[GRADE_COLUMNS].to_numpy(dtype=np.float32))
+
+
+def medir(X, k, method):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    modelo = fit_model(X, "bench", GRADE_COLUMNS, k, seed=42, method=method)
+    rotulos = modelo.fit_labels(X)
+    segundos = time.perf_counter() - inicio
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return modelo, rotulos, segundos, pico / 1024 ** 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alunos", type=int, nargs="+", default=[10000, 100000, 500000])
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'alunos':>8} {'exato (s)':>10} {'mini (s)':>9} {'exato (MB)':>11} {'mini (MB)':>10} "
+          f"{'inércia mini/exato':>19} {'ARI':>6}")
+    for n in args.alunos:
+        X = grade_matrix(n)
+        exato, rot_exato, t_exato, mem_exato = medir(X, args.k, "kmeans")
+        mini, rot_mini, t_mini, mem_mini = medir(X, args.k, "minibatch")
+        razao = mini.inertia / exato.inertia
+        ari = adjusted_rand_score(rot_exato, rot_mini)
+        print(f"{n:>8} {t_exato:>10.2f} {t_mini:>9.2f} {mem_exato:>11.1f} {mem_mini:>10.1f} "
+              f"{razao:>19.4f} {ari:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
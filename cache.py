@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def fingerprint_bytes(data: bytes) -> str:
+    """Hash do conteúdo (SHA-256) usado como chave dos caches."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprint_file(f, chunk_size=1024 ** 2) -> str:
+    """Mesmo hash de fingerprint_bytes, lendo o arquivo aberto por blocos (volta ao início)."""
+    h = hashlib.sha256()
+    f.seek(0)
+    for bloco in iter(lambda: f.read(chunk_size), b""):
+        h.update(bloco)
+    f.seek(0)
+    return h.hexdigest()
+
+
+def estimate_nbytes(value) -> int:
+    """Estimativa do espaço ocupado por um valor guardado em cache."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, (int, np.integer)):
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Cache LRU limitado pelo total de bytes das entradas.
+    Quando o limite é ultrapassado, descarta as entradas usadas há mais tempo.
+    Seguro para uso entre sessões do Streamlit (protegido por lock).
+    """
+
+    def __init__(self, max_bytes: int, sizeof=estimate_nbytes):
+        self.max_bytes = int(max_bytes)
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        nbytes = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._data.pop(key)[1]
+            # entradas maiores que o limite não são guardadas
+            if nbytes > self.max_bytes:
+                return value
+            self._data[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute, keep=None):
+        """
+        Retorna o valor em cache ou calcula com `compute()` e guarda (com
+        `keep`, só se `keep(valor)` for verdadeiro, ex.: resultados parciais).
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            if keep is None or keep(value):
+                self.put(key, value)
+        return value
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._data:
+            _, (_, nbytes) = self._data.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._data),
+                "memória (MB)": self.current_bytes / 1024 ** 2,
+                "limite (MB)": self.max_bytes / 1024 ** 2,
+                "acertos": self.hits,
+                "falhas": self.misses,
+                "descartes": self.evictions,
+                "taxa de acerto (%)": 100 * self.hits / total if total else 0.0,
+            }
+
+
+_MISSING = object()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Gráfico de dispersão dos clusters renderizado no navegador (Altair/Vega).
+
+Acima de SCATTER_MAX_POINTS pontos, o gráfico não recebe todos os alunos:
+ou uma amostra estratificada por cluster (cada cluster mantém sua proporção
+do total), ou uma grade 2D com a contagem exata de alunos de cada cluster
+por célula (tamanho do ponto = quantidade). Em ambos os casos as cores e as
+proporções por cluster continuam corretas.
+"""
+import os
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+# acima disso o gráfico de dispersão é reduzido (amostra ou grade)
+SCATTER_MAX_POINTS = int(os.environ.get("PI_SCATTER_MAX_POINTS", "20000"))
+GRID_BINS = 80
+
+REDUCTIONS = ("amostra", "grade")
+
+
+def stratified_sample(labels, max_points, seed=0):
+    """
+    Posições de uma amostra de até `max_points` linhas em que cada rótulo
+    aparece na mesma proporção do total (maiores restos; ao menos 1 por rótulo).
+    Retorna todas as posições se já couberem no limite.
+    """
+    labels = np.asarray(labels)
+    if len(labels) <= max_points:
+        return np.arange(len(labels))
+    valores, inversos, contagem = np.unique(labels, return_inverse=True, return_counts=True)
+    cota = contagem * max_points / len(labels)
+    alocado = np.maximum(np.floor(cota).astype(np.int64), 1)
+    sobra = max_points - alocado.sum()
+    if sobra > 0:
+        alocado[np.argsort(-(cota - np.floor(cota)), kind="stable")[:sobra]] += 1
+    alocado = np.minimum(alocado, contagem)
+
+    rng = np.random.default_rng(seed)
+    posicoes = [rng.choice(np.flatnonzero(inversos == i), size=n, replace=False)
+                for i, n in enumerate(alocado)]
+    return np.sort(np.concatenate(posicoes))
+
+
+def binned_counts(x, y, labels, bins=GRID_BINS):
+    """
+    Grade bins x bins sobre (x, y): uma linha por (célula, rótulo) com o
+    centro da célula e a quantidade exata de pontos daquele rótulo nela.
+    """
+    x, y, labels = np.asarray(x), np.asarray(y), np.asarray(labels)
+    valores, rotulo = np.unique(labels, return_inverse=True)
+    bordas_x = np.linspace(x.min(), x.max(), bins + 1)
+    bordas_y = np.linspace(y.min(), y.max(), bins + 1)
+    ix = np.clip(np.searchsorted(bordas_x, x, side="right") - 1, 0, bins - 1)
+    iy = np.clip(np.searchsorted(bordas_y, y, side="right") - 1, 0, bins - 1)
+    chave = np.ravel_multi_index((rotulo, ix, iy), (len(valores), bins, bins))
+    celulas, contagem = np.unique(chave, return_counts=True)
+    r, cx, cy = np.unravel_index(celulas, (len(valores), bins, bins))
+    return pd.DataFrame({
+        "x": (bordas_x[cx] + bordas_x[cx + 1]) / 2,
+        "y": (bordas_y[cy] + bordas_y[cy + 1]) / 2,
+        "Cluster": valores[r],
+        "Alunos": contagem,
+    })
+
+
+def cluster_scatter(componentes, labels, max_points=SCATTER_MAX_POINTS, reduction="amostra",
+                    title="Clusters de Alunos (PCA - 2D)", seed=0):
+    """
+    Gráfico Altair dos dois primeiros componentes coloridos pelo cluster.
+    Retorna (gráfico, descrição de quantos pontos/células foram enviados).
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Redução desconhecida: {reduction!r} (use {', '.join(REDUCTIONS)})")
+    labels = np.asarray(labels)
+    total = len(labels)
+    cor = alt.Color("Cluster:N", scale=alt.Scale(scheme="viridis"))
+    eixos = dict(x=alt.X("x:Q", title="Componente Principal 1"),
+                 y=alt.Y("y:Q", title="Componente Principal 2"))
+
+    if total > max_points and reduction == "grade":
+        dados = binned_counts(componentes[:, 0], componentes[:, 1], labels)
+        grafico = alt.Chart(dados).mark_circle(opacity=0.6).encode(
+            **eixos, color=cor, size=alt.Size("Alunos:Q", title="Alunos"),
+            tooltip=["Cluster:N", "Alunos:Q"])
+        descricao = f"{len(dados)} células com a contagem de {total} alunos (grade {GRID_BINS}x{GRID_BINS})"
+    else:
+        posicoes = stratified_sample(labels, max_points, seed)
+        dados = pd.DataFrame({"x": componentes[posicoes, 0], "y": componentes[posicoes, 1],
+                              "Cluster": labels[posicoes]})
+        grafico = alt.Chart(dados).mark_circle(size=30, opacity=0.7).encode(
+            **eixos, color=cor, tooltip=["Cluster:N", "x:Q", "y:Q"])
+        descricao = f"{len(dados)} de {total} alunos"
+        if len(dados) < total:
+            descricao += " (amostra estratificada por cluster)"
+    return grafico.properties(title=title).interactive(), descricao
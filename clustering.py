@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de clusterização com modelos memorizados.
+
+Padronização (StandardScaler), KMeans e PCA ajustados para um dataset são
+identificados pelo hash do dataset + parâmetros (k, colunas, semente),
+reaproveitados entre reruns/sessões (cache em memória) e gravados em disco
+na pasta de modelos. Uploads seguintes podem usar um modelo salvo para
+atribuir alunos aos clusters existentes com `predict`, sem reajustar.
+
+Acima de STREAMING_ROWS linhas (ex.: todas as escolas de uma diretoria) o
+ajuste é incremental: StandardScaler, MiniBatchKMeans e IncrementalPCA são
+treinados com partial_fit sobre blocos da matriz de notas, sem materializar
+a matriz padronizada inteira. A varredura de k, nesse caso, ajusta cada k
+numa amostra fixa de SWEEP_SAMPLE linhas, padronizada com o scaler
+incremental.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError, as_completed, wait
+from dataclasses import dataclass, field
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
+from sklearn.preprocessing import StandardScaler
+
+from cache import LRUCache
+
+# Pasta dos modelos salvos; pode ser ajustada pela variável de ambiente
+MODEL_DIR = os.environ.get("PI_MODEL_DIR", ".modelos")
+# Incrementar quando o formato do ClusterModel mudar
+MODEL_VERSION = 2
+
+# Ajuste incremental (mini-batch): a partir de quantas linhas, tamanho dos
+# blocos e quantas passadas sobre os dados
+STREAMING_ROWS = int(os.environ.get("PI_STREAMING_ROWS", "200000"))
+STREAMING_CHUNK = 20000
+STREAMING_EPOCHS = 3
+
+# Varredura de k: tempo máximo (s), amostra do silhouette e do warm start
+SWEEP_TIME_BUDGET = float(os.environ.get("PI_KSWEEP_BUDGET", "10"))
+SILHOUETTE_SAMPLE = 5000
+WARM_START_SAMPLE = 20000
+# Linhas da amostra usada na varredura a partir de STREAMING_ROWS linhas
+SWEEP_SAMPLE = int(os.environ.get("PI_KSWEEP_SAMPLE", "50000"))
+
+# KMeans exato em etapas de KMEANS_STEP_ITER iterações (até KMEANS_MAX_ITER):
+# entre as etapas, o ajuste pode ser interrompido (tempo limite, cancelamento)
+KMEANS_STEP_ITER = 10
+KMEANS_MAX_ITER = 300
+
+
+@dataclass
+class ClusterModel:
+    key: str
+    fingerprint: str      # hash do dataset usado no ajuste
+    features: tuple       # colunas usadas, na ordem da matriz
+    k: int
+    seed: int
+    n_samples: int
+    scaler: StandardScaler
+    kmeans: KMeans            # ou MiniBatchKMeans no modo incremental
+    pca: PCA                  # ou IncrementalPCA no modo incremental
+    method: str = "kmeans"    # "kmeans" (exato) ou "minibatch"
+    inertia: float = np.nan
+
+    def predict(self, X):
+        """Atribui as linhas de X (mesmas colunas de `features`) aos clusters."""
+        return np.concatenate([self.kmeans.predict(self.scaler.transform(b)) for b in _chunks(X)])
+
+    def project(self, X):
+        """Componentes principais (2D) das linhas de X."""
+        return np.concatenate([self.pca.transform(self.scaler.transform(b)) for b in _chunks(X)])
+
+    def fit_labels(self, X):
+        """Rótulos das linhas usadas no próprio ajuste (X = matriz do ajuste)."""
+        if self.method == "kmeans":
+            return self.kmeans.labels_
+        return self.predict(X)
+
+    def metadata(self):
+        return {
+            "key": self.key,
+            "fingerprint": self.fingerprint,
+            "features": list(self.features),
+            "k": self.k,
+            "seed": self.seed,
+            "n_samples": self.n_samples,
+            "method": self.method,
+            "inertia": float(self.inertia),
+        }
+
+    @property
+    def nbytes(self):
+        return int(self.kmeans.cluster_centers_.nbytes + self.pca.components_.nbytes
+                   + self.scaler.mean_.nbytes + self.scaler.scale_.nbytes)
+
+
+def model_key(fingerprint, features, k, seed, method="kmeans"):
+    """Chave do modelo: hash do dataset + parâmetros do ajuste."""
+    chave = json.dumps([MODEL_VERSION, fingerprint, list(features), int(k), int(seed), method],
+                       ensure_ascii=False)
+    return hashlib.sha256(chave.encode("utf-8")).hexdigest()[:32]
+
+
+def _chunks(X, chunk_size=STREAMING_CHUNK):
+    """Blocos de linhas de X (views, sem cópia)."""
+    for inicio in range(0, len(X), chunk_size):
+        yield X[inicio:inicio + chunk_size]
+
+
+def choose_method(n_rows, method="auto"):
+    """"kmeans" (exato) ou "minibatch"; no modo auto decide pelo tamanho."""
+    if method == "auto":
+        return "minibatch" if n_rows >= STREAMING_ROWS else "kmeans"
+    return method
+
+
+def _fit_kmeans(X, k, seed, init=None, check=None, step=KMEANS_STEP_ITER, max_iter=KMEANS_MAX_ITER):
+    """
+    KMeans exato em etapas de até `step` iterações, cada uma partindo dos
+    centros da anterior (sem `init`, a primeira usa o k-means++). Entre as
+    etapas chama `check(iterações feitas)`, que pode interromper o ajuste
+    levantando uma exceção.
+    """
+    if init is None:
+        modelo = KMeans(n_clusters=k, random_state=seed, max_iter=min(step, max_iter)).fit(X)
+    else:
+        modelo = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed,
+                        max_iter=min(step, max_iter)).fit(X)
+    feitas = modelo.n_iter_
+    # menos iterações que o pedido: convergiu
+    while modelo.n_iter_ >= step and feitas < max_iter:
+        if check is not None:
+            check(feitas)
+        modelo = KMeans(n_clusters=k, init=modelo.cluster_centers_, n_init=1, random_state=seed,
+                        max_iter=min(step, max_iter - feitas)).fit(X)
+        feitas += modelo.n_iter_
+    return modelo
+
+
+def _fit_exact(X, k, seed, progress=None):
+    """Ajuste exato; `progress(fração, mensagem)` entre as etapas do KMeans (ver _fit_kmeans)."""
+    check = None
+    if progress is not None:
+        def check(iteracoes):
+            progress(0.1 + 0.7 * iteracoes / KMEANS_MAX_ITER, f"KMeans: {iteracoes} iterações")
+        progress(0.0, "padronizando")
+    scaler = StandardScaler()
+    dados_padronizados = scaler.fit_transform(X)
+    kmeans = _fit_kmeans(dados_padronizados, k, seed, check=check)
+    if progress is not None:
+        progress(0.8, "PCA")
+    pca = PCA(n_components=2).fit(dados_padronizados)
+    return scaler, kmeans, pca, float(kmeans.inertia_)
+
+
+def _fit_scaler(X, chunk_size=STREAMING_CHUNK):
+    """StandardScaler ajustado com partial_fit por blocos (sem padronizar X inteiro)."""
+    scaler = StandardScaler()
+    for bloco in _chunks(X, chunk_size):
+        scaler.partial_fit(bloco)
+    return scaler
+
+
+def _fit_streaming(X, k, seed, chunk_size=STREAMING_CHUNK, epochs=STREAMING_EPOCHS, progress=None):
+    """Ajuste incremental por blocos: memória proporcional ao bloco, não a X."""
+    scaler = _fit_scaler(X, chunk_size)
+
+    # blocos de tamanhos parecidos (o primeiro partial_fit precisa de >= k linhas)
+    limites = np.linspace(0, len(X), max(1, -(-len(X) // chunk_size)) + 1).astype(int)
+    blocos = list(zip(limites[:-1], limites[1:]))
+    kmeans = MiniBatchKMeans(n_clusters=k, random_state=seed, batch_size=chunk_size, n_init=3)
+    pca = IncrementalPCA(n_components=2)
+    rng = np.random.default_rng(seed)
+    for epoca in range(epochs):
+        for i in rng.permutation(len(blocos)):
+            inicio, fim = blocos[i]
+            bloco = scaler.transform(X[inicio:fim])
+            kmeans.partial_fit(bloco)
+            if epoca == 0:
+                pca.partial_fit(bloco)
+        if progress is not None:
+            progress((epoca + 1) / (epochs + 1), f"passada {epoca + 1} de {epochs}")
+
+    # inércia sobre todos os dados (comparável à do KMeans exato)
+    inercia = 0.0
+    for bloco in _chunks(X, chunk_size):
+        inercia += -kmeans.score(scaler.transform(bloco))
+    return scaler, kmeans, pca, float(inercia)
+
+
+def fit_model(X, fingerprint, features, k=3, seed=42, method="auto", progress=None):
+    """
+    Ajusta padronização, KMeans e PCA (2 componentes) sobre X. Com
+    method="auto", usa o ajuste incremental acima de STREAMING_ROWS linhas.
+    `progress(fração, mensagem)` é chamado a cada passada sobre os dados (ou
+    etapa do KMeans exato) e pode interromper o ajuste levantando uma exceção.
+    """
+    method = choose_method(len(X), method)
+    if method == "minibatch":
+        scaler, kmeans, pca, inercia = _fit_streaming(X, k, seed, progress=progress)
+    else:
+        scaler, kmeans, pca, inercia = _fit_exact(X, k, seed, progress=progress)
+    return ClusterModel(
+        key=model_key(fingerprint, features, k, seed, method),
+        fingerprint=fingerprint,
+        features=tuple(features),
+        k=int(k),
+        seed=int(seed),
+        n_samples=len(X),
+        scaler=scaler,
+        kmeans=kmeans,
+        pca=pca,
+        method=method,
+        inertia=inercia,
+    )
+
+
+class ClusterEngine:
+    """Busca modelos em memória, depois em disco, e só então ajusta."""
+
+    def __init__(self, model_dir=None, max_bytes=64 * 1024 ** 2):
+        self.model_dir = model_dir or MODEL_DIR
+        self.models = LRUCache(max_bytes=max_bytes)
+        self.fits = 0
+        self.disk_loads = 0
+
+    def _path(self, key, ext):
+        return os.path.join(self.model_dir, f"{key}.{ext}")
+
+    def get_model(self, X, fingerprint, features, k=3, seed=42, method="auto", progress=None):
+        """Modelo para (dataset, colunas, k, semente), ajustando só se necessário."""
+        method = choose_method(len(X), method)
+        key = model_key(fingerprint, features, k, seed, method)
+        modelo = self.models.get(key)
+        if modelo is None:
+            modelo = self.load(key)
+        if modelo is None:
+            modelo = fit_model(X, fingerprint, features, k, seed, method, progress)
+            self.fits += 1
+            self.save(modelo)
+        return self.models.put(key, modelo)
+
+    def load(self, key):
+        """Carrega um modelo salvo (ou None). Só carregue modelos gerados por este app."""
+        caminho = self._path(key, "joblib")
+        if not os.path.exists(caminho):
+            return None
+        try:
+            modelo = joblib.load(caminho)
+        except (OSError, EOFError, ValueError, AttributeError, ImportError):
+            # modelo corrompido ou de outra versão do scikit-learn: reajusta
+            return None
+        self.disk_loads += 1
+        return self.models.put(key, modelo)
+
+    def save(self, modelo):
+        """Grava o modelo e seus metadados na pasta de modelos."""
+        os.makedirs(self.model_dir, exist_ok=True)
+        caminho = self._path(modelo.key, "joblib")
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        joblib.dump(modelo, temporario)
+        os.replace(temporario, caminho)
+        metadados = dict(modelo.metadata(), created=time.time())
+        with open(self._path(modelo.key, "json"), "w", encoding="utf-8") as f:
+            json.dump(metadados, f, ensure_ascii=False, indent=2)
+
+    def list_models(self, features=None):
+        """Metadados dos modelos salvos (opcionalmente com as mesmas colunas)."""
+        if not os.path.isdir(self.model_dir):
+            return []
+        modelos = []
+        for nome in sorted(os.listdir(self.model_dir)):
+            if not nome.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.model_dir, nome), encoding="utf-8") as f:
+                    metadados = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if features is None or metadados.get("features") == list(features):
+                modelos.append(metadados)
+        return sorted(modelos, key=lambda m: m.get("created", 0), reverse=True)
+
+    def stats(self):
+        return dict(self.models.stats(), ajustes=self.fits, carregados_do_disco=self.disk_loads)
+
+
+def assign_clusters(modelo, X):
+    """Atribui X a clusters existentes: (rótulos, componentes PCA)."""
+    X = np.asarray(X)
+    return modelo.predict(X), modelo.project(X)
+
+
+# =========================================
+# Escolha automática de k
+# =========================================
+@dataclass
+class KSweep:
+    k: list
+    inertia: list
+    silhouette: list
+    calinski_harabasz: list
+    best_k: int
+    criterion: str
+    complete: bool            # False se o tempo limite cortou parte dos k
+    elapsed: float
+    skipped: list = field(default_factory=list)
+    sample_rows: int = None   # linhas da amostra usada (None: todas)
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "k": self.k,
+            "Inércia": self.inertia,
+            "Silhouette": self.silhouette,
+            "Calinski-Harabasz": self.calinski_harabasz,
+        }).set_index("k")
+
+
+def _fit_k(X, k, seed, sample_idx, silhouette_sample, check=None):
+    """
+    Ajusta KMeans para um k e calcula as métricas (executado em paralelo);
+    `check` é chamado entre as etapas do ajuste (ver _fit_kmeans).
+    """
+    if sample_idx is not None and k > 1:
+        # warm start: centros ajustados numa amostra iniciam o ajuste completo
+        centros = _fit_kmeans(X[sample_idx], k, seed, check=check).cluster_centers_
+        modelo = _fit_kmeans(X, k, seed, init=centros, check=check)
+    else:
+        modelo = _fit_kmeans(X, k, seed, check=check)
+    if check is not None:
+        check(modelo.n_iter_)
+    silhouette = calinski = np.nan
+    if 1 < k < len(X):
+        amostra = min(silhouette_sample, len(X)) if len(X) > silhouette_sample else None
+        silhouette = silhouette_score(X, modelo.labels_, sample_size=amostra, random_state=seed)
+        calinski = calinski_harabasz_score(X, modelo.labels_)
+    return k, float(modelo.inertia_), float(silhouette), float(calinski)
+
+
+def elbow_k(k_values, inertia):
+    """Cotovelo: ponto da curva mais distante da reta entre as pontas."""
+    if len(k_values) < 3:
+        return k_values[-1]
+    x = np.asarray(k_values, dtype=float)
+    y = np.asarray(inertia, dtype=float)
+    x = (x - x[0]) / (x[-1] - x[0])
+    y = (y - y[-1]) / ((y[0] - y[-1]) or 1.0)
+    return int(k_values[int(np.argmax(np.abs(1 - x - y)))])
+
+
+def sweep_k(X, k_values=range(1, 10), seed=42, criterion="silhouette", n_jobs=None,
+            time_budget=None, silhouette_sample=SILHOUETTE_SAMPLE, warm_start_sample=WARM_START_SAMPLE,
+            standardize=False, progress=None, sweep_sample=SWEEP_SAMPLE):
+    """
+    Avalia KMeans para vários k em paralelo (threads: o KMeans do scikit-learn
+    libera o GIL) e escolhe k por `criterion` ("silhouette",
+    "calinski_harabasz" ou "elbow"). Os k que não terminarem dentro de
+    `time_budget` segundos ficam de fora (complete=False) e a escolha usa os
+    demais; `time_budget=float("inf")` espera todos os k. Os ajustes ainda em
+    andamento param na etapa seguinte (KMEANS_STEP_ITER iterações), liberando
+    as threads logo depois do tempo limite.
+    Com `standardize=True`, X é padronizado antes (como no ajuste do modelo).
+    A partir de STREAMING_ROWS linhas, os k são ajustados numa amostra fixa
+    de `sweep_sample` linhas (padronizada com o scaler incremental) e a
+    inércia é reescalada para o total de linhas.
+    `progress(fração, mensagem)` é chamado a cada k concluído; se levantar
+    uma exceção, a varredura para e os k pendentes são descartados.
+    """
+    X = np.asarray(X)
+    n_linhas = len(X)
+    sample_rows = None
+    if n_linhas >= STREAMING_ROWS and n_linhas > sweep_sample:
+        # só a amostra é padronizada e copiada; o scaler vê todas as linhas, por blocos
+        scaler = _fit_scaler(X) if standardize else None
+        sample_rows = sweep_sample
+        X = X[np.sort(np.random.default_rng(seed).choice(n_linhas, sweep_sample, replace=False))]
+        if scaler is not None:
+            X = scaler.transform(X)
+    elif standardize:
+        X = StandardScaler().fit_transform(X)
+    X = np.asarray(X, dtype=np.float32)
+    k_values = [int(k) for k in k_values if 1 <= k < len(X)]
+    time_budget = SWEEP_TIME_BUDGET if time_budget is None else time_budget
+    # wait()/as_completed() não aceitam timeout infinito: None espera sem limite
+    time_budget = None if np.isinf(time_budget) else time_budget
+    sample_idx = None
+    if len(X) > warm_start_sample:
+        sample_idx = np.random.default_rng(seed).choice(len(X), warm_start_sample, replace=False)
+
+    parar = threading.Event()
+
+    def interromper(_iteracoes=None):
+        if parar.is_set():
+            raise CancelledError()
+
+    inicio = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=n_jobs or min(len(k_values), os.cpu_count() or 1) or 1)
+    futuros = [executor.submit(_fit_k, X, k, seed, sample_idx, silhouette_sample, interromper)
+               for k in k_values]
+    try:
+        if progress is None:
+            prontos, pendentes = wait(futuros, timeout=time_budget)
+        else:
+            prontos, pendentes = set(), set(futuros)
+            try:
+                for futuro in as_completed(futuros, timeout=time_budget):
+                    prontos.add(futuro)
+                    pendentes.discard(futuro)
+                    progress(len(prontos) / len(futuros), f"k avaliados: {len(prontos)} de {len(futuros)}")
+            except TimeoutError:
+                pass
+    finally:
+        # não bloqueia a interface: os k pendentes são descartados e os em
+        # andamento param na próxima etapa do ajuste
+        parar.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    resultados = sorted(f.result() for f in prontos)
+    ks = [r[0] for r in resultados]
+    # inércia da amostra reescalada para o total (mesma ordem de grandeza do modelo)
+    inertia = [r[1] * n_linhas / len(X) for r in resultados]
+    silhouette = [r[2] for r in resultados]
+    calinski = [r[3] for r in resultados]
+
+    best_k = None
+    if criterion in ("silhouette", "calinski_harabasz"):
+        valores = silhouette if criterion == "silhouette" else calinski
+        if not np.all(np.isnan(valores)):
+            best_k = ks[int(np.nanargmax(valores))]
+    if best_k is None and ks:
+        criterion = "elbow"
+        best_k = elbow_k(ks, inertia)
+
+    return KSweep(
+        k=ks,
+        inertia=inertia,
+        silhouette=silhouette,
+        calinski_harabasz=calinski,
+        best_k=best_k,
+        criterion=criterion,
+        complete=not pendentes,
+        elapsed=time.perf_counter() - inicio,
+        skipped=sorted(k for k, f in zip(k_values, futuros) if f in pendentes),
+        sample_rows=sample_rows,
+    )
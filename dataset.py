@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Dataset carregado: o DataFrame tipado, os dados derivados das notas, o
+índice das chaves de agrupamento e o esboço de quantis das notas, calculados
+uma vez na leitura. É o objeto guardado no cache de leitura e entregue às abas.
+"""
+from dataclasses import dataclass
+
+import pandas as pd
+
+from grades_core import GradesCore, build_grades_core
+from ingest import read_bytes, sheet_fingerprints
+from key_index import KeyIndex, build_key_index
+from profiling import stage
+from sketches import QuantileSketch, grades_sketch
+
+
+@dataclass(frozen=True)
+class Dataset:
+    fingerprint: str
+    df: pd.DataFrame
+    core: GradesCore
+    index: KeyIndex
+    sheets: tuple = ()   # ((aba, hash da aba), ...) de um .xlsx; vazio para outros formatos
+    sketch: QuantileSketch = None   # notas e média do aluno por TURMA / SÉRIE / ANO
+
+    @property
+    def nbytes(self):
+        esboco = self.sketch.nbytes if self.sketch is not None else 0
+        return int(self.df.memory_usage(deep=True).sum()) + self.core.nbytes + self.index.nbytes + esboco
+
+
+def build_dataset(df, fingerprint, sheets=()):
+    with stage("notas, índice e esboços", rows=len(df)):
+        core = build_grades_core(df)
+        index = build_key_index(df, core)
+        return Dataset(fingerprint=fingerprint, df=df, core=core, index=index, sheets=tuple(sheets),
+                       sketch=grades_sketch(index, core))
+
+
+def load_dataset(data, ext, fingerprint, **kwargs):
+    """Lê o conteúdo (snapshot ou parse) e monta o Dataset."""
+    df = read_bytes(data, ext, fingerprint, **kwargs)
+    sheets = (sheet_fingerprints(data) or ()) if ext == ".xlsx" else ()
+    return build_dataset(df, fingerprint, sheets)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação do resultado da Filtragem Manual (CSV, Parquet e XLSX).
+
+O arquivo só é gerado quando o usuário clica em baixar (st.download_button
+com uma função em `data`) e é escrito em disco por blocos de
+EXPORT_CHUNK_ROWS linhas: CSV com to_csv por bloco, Parquet com um row group
+por bloco (pyarrow.parquet.ParquetWriter) e XLSX com o modo write_only do
+openpyxl. Assim não se monta o texto/planilha inteiro em memória ao lado do
+DataFrame. A entrega, porém, é do Streamlit: o download_button converte o
+que a função devolve em bytes e os guarda na memória do servidor (não há
+entrega direta do disco). Durante o download, o arquivo inteiro fica na
+memória ao lado do DataFrame; a aba avisa disso junto ao botão.
+
+Os arquivos gerados ficam em EXPORT_DIR, por (hash do dataset, filtro,
+formato), com limite de EXPORT_CACHE_MB em disco: outro clique com o mesmo
+filtro, de qualquer sessão, reaproveita o arquivo. Arquivos deixados na
+pasta por processos anteriores são apagados quando o cache é criado.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from openpyxl import Workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # exportação em Parquet fica indisponível sem pyarrow
+    pa = None
+    pq = None
+
+# Linhas por bloco escrito e pasta/limite (MB) dos arquivos gerados
+EXPORT_CHUNK_ROWS = int(os.environ.get("PI_EXPORT_CHUNK_ROWS", "50000"))
+EXPORT_DIR = os.environ.get("PI_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "pi-exportacoes"))
+EXPORT_CACHE_MB = int(os.environ.get("PI_EXPORT_CACHE_MB", "1024"))
+
+# Linhas por aba do Excel (o limite é 1.048.576, incluindo o cabeçalho)
+XLSX_MAX_ROWS = 1048575
+
+# Nome dos arquivos do cache (hash + extensão) e dos temporários da gravação
+_EXPORT_FILE = re.compile(r"^[0-9a-f]{32}\.(csv|parquet|xlsx)(\.\d+\.\d+\.tmp)?$")
+
+# nome exibido -> (extensão, tipo MIME)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Excel (XLSX)": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def available_formats():
+    return [f for f in EXPORT_FORMATS if f != "Parquet" or pq is not None]
+
+
+def _chunks(df, chunk_rows):
+    for inicio in range(0, len(df), chunk_rows):
+        yield df.iloc[inicio:inicio + chunk_rows]
+
+
+def write_csv(df, path, chunk_rows=None):
+    """CSV com BOM (abre acentuado no Excel), escrito por blocos."""
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        if df.empty:
+            df.to_csv(f, index=False)
+        for i, bloco in enumerate(_chunks(df, chunk_rows)):
+            bloco.to_csv(f, index=False, header=i == 0)
+    return path
+
+
+def write_parquet(df, path, chunk_rows=None):
+    """Parquet com um row group por bloco (o esquema sai do primeiro bloco)."""
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    with pq.ParquetWriter(path, schema) as escritor:
+        for bloco in _chunks(df, chunk_rows):
+            escritor.write_table(pa.Table.from_pandas(bloco, schema=schema, preserve_index=False))
+    return path
+
+
+def _xlsx_rows(bloco):
+    """Linhas do bloco com valores do Python (ausentes viram células vazias)."""
+    valores = bloco.astype(object)
+    valores = valores.where(bloco.notna(), None)
+    return valores.itertuples(index=False, name=None)
+
+
+def write_xlsx(df, path, chunk_rows=None, sheet_title="Filtragem"):
+    """XLSX no modo write_only (linhas vão direto para o arquivo); abas extras acima do limite do Excel."""
+    chunk_rows = min(chunk_rows or EXPORT_CHUNK_ROWS, XLSX_MAX_ROWS)
+    cabecalho = [str(c) for c in df.columns]
+    wb = Workbook(write_only=True)
+    ws = None
+    linhas_na_aba = XLSX_MAX_ROWS
+    for bloco in _chunks(df, chunk_rows):
+        for linha in _xlsx_rows(bloco):
+            if linhas_na_aba >= XLSX_MAX_ROWS:
+                ws = wb.create_sheet(sheet_title if ws is None else f"{sheet_title} ({len(wb.worksheets) + 1})")
+                ws.append(cabecalho)
+                linhas_na_aba = 0
+            ws.append(linha)
+            linhas_na_aba += 1
+    if ws is None:
+        wb.create_sheet(sheet_title).append(cabecalho)
+    wb.save(path)
+    return path
+
+
+WRITERS = {".csv": write_csv, ".parquet": write_parquet, ".xlsx": write_xlsx}
+
+
+def write_export(df, formato, path, chunk_rows=None):
+    """Grava `df` no formato (nome de EXPORT_FORMATS) em `path`."""
+    extensao, _ = EXPORT_FORMATS[formato]
+    return WRITERS[extensao](df, path, chunk_rows)
+
+
+class ExportCache:
+    """
+    Arquivos exportados por chave, em disco, limitados pelo total de bytes
+    (os usados há mais tempo são apagados, exceto os que estão sendo lidos).
+    Gerações simultâneas da mesma chave esperam a primeira.
+    """
+
+    def __init__(self, directory=None, max_bytes=EXPORT_CACHE_MB * 1024 ** 2):
+        self.directory = directory or EXPORT_DIR
+        self.max_bytes = int(max_bytes)
+        self._files = OrderedDict()   # chave -> (caminho, bytes)
+        self._writing = {}            # chave -> lock da geração em andamento
+        self._reading = {}            # chave -> leituras em andamento (não são apagadas)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.writes = 0
+        self.hits = 0
+        self.swept = self._sweep()
+
+    def _sweep(self):
+        """Apaga os arquivos de exportação deixados na pasta (por processos anteriores)."""
+        try:
+            nomes = os.listdir(self.directory)
+        except OSError:
+            return 0
+        apagados = 0
+        for nome in nomes:
+            if _EXPORT_FILE.match(nome):
+                try:
+                    os.remove(os.path.join(self.directory, nome))
+                    apagados += 1
+                except OSError:
+                    pass
+        return apagados
+
+    def _path(self, key, extensao):
+        nome = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{nome}{extensao}")
+
+    def _cached(self, key):
+        # chamado com o lock: reserva o arquivo para leitura (ver _pin)
+        entrada = self._files.get(key)
+        if entrada is not None and os.path.exists(entrada[0]):
+            self._files.move_to_end(key)
+            self.hits += 1
+            self._pin(key)
+            return entrada[0]
+        return None
+
+    def _pin(self, key):
+        # chamado com o lock: enquanto reservado, o descarte não apaga o arquivo
+        self._reading[key] = self._reading.get(key, 0) + 1
+
+    def _unpin(self, key):
+        with self._lock:
+            self._reading[key] -= 1
+            if self._reading[key] <= 0:
+                del self._reading[key]
+                self._evict()
+
+    def _acquire_path(self, key, df, formato):
+        """Caminho do arquivo de `key`, já reservado; grava `df` no formato se ainda não existir."""
+        with self._lock:
+            caminho = self._cached(key)
+            if caminho is not None:
+                return caminho
+            gravando = self._writing.setdefault(key, threading.Lock())
+        with gravando:
+            with self._lock:
+                caminho = self._cached(key)
+                if caminho is not None:
+                    return caminho
+            os.makedirs(self.directory, exist_ok=True)
+            caminho = self._path(key, EXPORT_FORMATS[formato][0])
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                write_export(df, formato, temporario)
+                os.replace(temporario, caminho)
+                with self._lock:
+                    self._pin(key)
+                    self._store(key, caminho)
+                    self.writes += 1
+            finally:
+                if os.path.exists(temporario):
+                    os.remove(temporario)
+                with self._lock:
+                    self._writing.pop(key, None)
+            return caminho
+
+    def read(self, key, df, formato):
+        """
+        Bytes do arquivo exportado (para o st.download_button, que só aceita
+        o conteúdo inteiro). O arquivo não é apagado enquanto é lido.
+        """
+        caminho = self._acquire_path(key, df, formato)
+        try:
+            with open(caminho, "rb") as f:
+                return f.read()
+        finally:
+            self._unpin(key)
+
+    def _store(self, key, caminho):
+        # chamado com o lock
+        if key in self._files:
+            self.current_bytes -= self._files.pop(key)[1]
+        tamanho = os.path.getsize(caminho)
+        self._files[key] = (caminho, tamanho)
+        self.current_bytes += tamanho
+        self._evict()
+
+    def _evict(self):
+        # chamado com o lock: os mais antigos primeiro, pulando os reservados
+        for chave in list(self._files):
+            if self.current_bytes <= self.max_bytes or len(self._files) <= 1:
+                break
+            if chave in self._reading:
+                continue
+            antigo, bytes_antigo = self._files.pop(chave)
+            self.current_bytes -= bytes_antigo
+            try:
+                os.remove(antigo)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "arquivos": len(self._files),
+                "disco (MB)": self.current_bytes / 1024 ** 2,
+                "gerados": self.writes,
+                "reaproveitados": self.hits,
+                "restos apagados": self.swept,
+            }
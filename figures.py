@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Renderização dos gráficos matplotlib com cache das imagens.
+
+Cada gráfico é desenhado por uma função que devolve a figura; a figura é
+renderizada uma vez em PNG (mesmas opções do st.pyplot) e fechada logo em
+seguida, para não acumular figuras abertas no pyplot a cada rerun. O PNG
+fica num LRUCache limitado em bytes, com chave (hash do dataset, gráfico,
+parâmetros): se os dados e os parâmetros não mudaram, nada é desenhado.
+
+O pyplot não é seguro entre threads (figura atual, registro de figuras
+abertas) e os gráficos também são desenhados no pool de trabalhos: todo uso
+do pyplot passa por PYPLOT_LOCK, e `get_png` desenha e renderiza com ele.
+"""
+import io
+import threading
+import time
+
+import matplotlib.pyplot as plt
+
+from cache import LRUCache
+
+# mesmas opções que o st.pyplot usa ao salvar a figura
+SAVEFIG_OPTIONS = {"format": "png", "dpi": 200, "bbox_inches": "tight"}
+
+# um uso do pyplot por vez no processo (reentrante: render_png dentro de get_png)
+PYPLOT_LOCK = threading.RLock()
+
+
+def render_png(fig, **options):
+    """Renderiza a figura em PNG e a fecha (mesmo se a renderização falhar)."""
+    with PYPLOT_LOCK:
+        try:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, **{**SAVEFIG_OPTIONS, **options})
+            return buffer.getvalue()
+        finally:
+            plt.close(fig)
+
+
+def save_figure(fig, path, **options):
+    """Grava a figura em arquivo e a fecha (mesmo se a gravação falhar)."""
+    with PYPLOT_LOCK:
+        try:
+            fig.savefig(path, **{"dpi": 300, "bbox_inches": "tight", **options})
+        finally:
+            plt.close(fig)
+
+
+def open_figures():
+    """Quantidade de figuras abertas no pyplot (deveria ficar em 0 entre reruns)."""
+    with PYPLOT_LOCK:
+        return len(plt.get_fignums())
+
+
+def _no_progress(fraction, message=None):
+    pass
+
+
+class FigureCache:
+    """PNGs dos gráficos por chave, com contadores de renderização."""
+
+    def __init__(self, max_bytes):
+        self.images = LRUCache(max_bytes=max_bytes)
+        self.renders = 0
+        self.render_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get_png(self, key, draw, progress=None):
+        """
+        PNG do gráfico `key`; em falha, chama `draw()` (que devolve a figura,
+        desenhada com o pyplot) e renderiza, com PYPLOT_LOCK do começo ao fim.
+        `progress(fração, mensagem)` é chamado antes do desenho e antes da
+        renderização; se levantar uma exceção (cancelamento), a figura é fechada.
+        """
+        progress = progress or _no_progress
+
+        def renderizar():
+            inicio = time.perf_counter()
+            progress(0.0, "aguardando o pyplot")
+            with PYPLOT_LOCK:
+                progress(0.1, "desenhando")
+                fig = draw()
+                try:
+                    progress(0.6, "renderizando")
+                except BaseException:
+                    plt.close(fig)
+                    raise
+                png = render_png(fig)
+            with self._lock:
+                self.renders += 1
+                self.render_seconds += time.perf_counter() - inicio
+            return png
+        return self.images.get_or_compute(key, renderizar)
+
+    def clear(self):
+        self.images.clear()
+
+    def stats(self):
+        stats = self.images.stats()
+        stats["renderizações"] = self.renders
+        stats["tempo de renderização (s)"] = self.render_seconds
+        stats["figuras abertas"] = open_figures()
+        return stats
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Filtragem da aba “Filtragem Manual” compilada em uma única máscara.
+
+Todas as condições escolhidas na tela (turma, série, ano, matérias e média
+geral) viram um `FilterSpec` imutável; `filter_mask` avalia o spec em uma
+passada vetorizada sobre os bitmaps do índice de chaves e a matriz de
+notas do GradesCore, e `apply_filter` devolve só as colunas pedidas das linhas
+selecionadas, sem cópias intermediárias do DataFrame. Por ser hashable, o
+spec serve de chave para memoizar o resultado.
+"""
+import operator
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from grades_core import COL_ANO, COL_SERIE, COL_TURMA
+
+COL_MEDIA = "MÉDIA_GERAL"
+
+OPERATORS = {
+    "<": operator.lt,
+    "≤": operator.le,
+    ">": operator.gt,
+    "≥": operator.ge,
+    "=": operator.eq,
+}
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    turmas: tuple = ()
+    series: tuple = ()
+    anos: tuple = ()
+    conditions: tuple = ()   # ((coluna, operador, valor), ...), operadores de OPERATORS
+    columns: tuple = ()      # colunas do resultado, na ordem de exibição
+
+
+def column_values(dataset, col):
+    """
+    Valores numéricos da coluna, alinhados às linhas do dataset: notas saem
+    da matriz do core, MÉDIA_GERAL das médias já calculadas e as demais
+    colunas do DataFrame (convertidas com to_numeric se não forem numéricas).
+    """
+    core = dataset.core
+    if col in core.columns:
+        return core.matrix[:, core.columns.index(col)]
+    if col == COL_MEDIA and col not in dataset.df.columns:
+        return core.means
+    serie = dataset.df[col]
+    if not pd.api.types.is_numeric_dtype(serie.dtype):
+        serie = pd.to_numeric(serie, errors="coerce")
+    return serie.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def comparable_value(valores, val):
+    """Converte o valor digitado para o tipo da coluna (ex.: float32), para que
+    “=” e “≤” comparem exatamente com as notas armazenadas."""
+    if np.issubdtype(valores.dtype, np.floating):
+        return valores.dtype.type(val)
+    return val
+
+
+def filter_mask(dataset, spec):
+    """Máscara booleana (uma posição por aluno) com todas as condições do spec."""
+    # chaves de agrupamento: combinação dos bitmaps do índice, sem varrer o DataFrame
+    grupos = {COL_TURMA: spec.turmas, COL_SERIE: spec.series, COL_ANO: spec.anos}
+    mask = dataset.index.mask({col: v for col, v in grupos.items() if v and col in dataset.index})
+    for col, selecionados in grupos.items():
+        if selecionados and col not in dataset.index:
+            mask &= dataset.df[col].isin(selecionados).to_numpy()
+    with np.errstate(invalid="ignore"):
+        for col, op, val in spec.conditions:
+            valores = column_values(dataset, col)
+            mask &= OPERATORS[op](valores, comparable_value(valores, val))
+    return mask
+
+
+def _sort_positions(dataset, posicoes):
+    """Ordena as posições por TURMA, SÉRIE e ANO (ausentes por último), de forma estável."""
+    index = dataset.index
+    if not all(col in index for col in (COL_TURMA, COL_SERIE, COL_ANO)):
+        return posicoes
+    chaves = []
+    for col in (COL_ANO, COL_SERIE, COL_TURMA):  # lexsort: última chave é a principal
+        codigos = index.codes[col][posicoes]
+        chaves.append(np.where(codigos < 0, np.iinfo(np.int32).max, codigos))
+    return posicoes[np.lexsort(chaves)]
+
+
+def apply_filter(dataset, spec):
+    """
+    Linhas que passam no filtro, ordenadas por TURMA/SÉRIE/ANO, com apenas
+    as colunas de `spec.columns` (mantém o índice original das linhas).
+    """
+    df = dataset.df
+    posicoes = _sort_positions(dataset, np.flatnonzero(filter_mask(dataset, spec)))
+    colunas = [c for c in spec.columns if c in df.columns]
+    resultado = df[colunas].iloc[posicoes] if colunas else df.iloc[posicoes, :0]
+    if COL_MEDIA in spec.columns and COL_MEDIA not in df.columns:
+        resultado = resultado.assign(**{COL_MEDIA: dataset.core.means[posicoes]})
+    return resultado[[c for c in spec.columns if c in resultado.columns]]
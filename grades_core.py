@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Dados derivados das notas, calculados uma vez por dataset e lidos por todas
+as abas: matriz de notas contígua, média por aluno, máscaras de aprovação e
+códigos dos grupos (TURMA / SERIE_ANO / ANO).
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+GRADE_COLUMNS = [
+    "NOTAS - LP", "NOTAS - LI", "NOTAS - BIO", "NOTAS - FÍS", "NOTAS - QUÍ",
+    "NOTAS - MAT", "NOTAS - GEO", "NOTAS - HIS", "NOTAS - FIL", "NOTAS - SOC"
+]
+GRADE_PREFIX = "NOTAS - "
+PASS_THRESHOLD = 5.0
+
+COL_TURMA = "DADOS GERAIS - TURMA"
+COL_SERIE = "DADOS GERAIS - SERIE_ANO"
+COL_ANO = "DADOS GERAIS - ANO"
+GROUP_COLUMNS = (COL_TURMA, COL_SERIE, COL_ANO)
+
+
+@dataclass(frozen=True)
+class GradesCore:
+    columns: list            # colunas de notas, na ordem de GRADE_COLUMNS
+    matrix: np.ndarray       # (alunos x disciplinas), float32, C-contígua
+    valid: np.ndarray        # alunos sem nenhuma nota ausente
+    means: np.ndarray        # média geral de cada aluno
+    pass_mask: np.ndarray    # nota >= PASS_THRESHOLD, por disciplina
+    mean_pass: np.ndarray    # média geral >= PASS_THRESHOLD
+    codes: dict              # coluna de grupo -> códigos (-1 = ausente)
+    labels: dict             # coluna de grupo -> lista (ordenada) dos valores dos códigos
+
+    @property
+    def subjects(self):
+        """Nome das disciplinas sem o prefixo “NOTAS - ”."""
+        return [c.replace(GRADE_PREFIX, "") for c in self.columns]
+
+    @property
+    def global_mean(self):
+        """Média geral de todos os alunos válidos (inclusive os sem TURMA/SÉRIE/ANO)."""
+        if not self.valid.any():
+            return np.nan
+        return float(self.means[self.valid].mean(dtype=np.float64))
+
+    @property
+    def nbytes(self):
+        arrays = [self.matrix, self.valid, self.means, self.pass_mask, self.mean_pass]
+        arrays += list(self.codes.values())
+        return sum(a.nbytes for a in arrays)
+
+
+def grade_columns(df):
+    """Colunas de notas presentes: as conhecidas primeiro, depois as extras."""
+    conhecidas = [c for c in GRADE_COLUMNS if c in df.columns]
+    extras = [c for c in df.columns if str(c).startswith(GRADE_PREFIX) and c not in conhecidas]
+    return conhecidas + extras
+
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+
+def build_grades_core(df):
+    """Calcula os dados derivados das notas de um DataFrame já tipado."""
+    colunas = grade_columns(df)
+    if colunas:
+        matrix = np.ascontiguousarray(df[colunas].to_numpy(dtype=np.float32, na_value=np.nan))
+    else:
+        matrix = np.empty((len(df), 0), dtype=np.float32)
+    valid = ~np.isnan(matrix).any(axis=1)
+    with np.errstate(invalid="ignore"):
+        means = matrix.mean(axis=1, dtype=np.float64) if colunas else np.full(len(df), np.nan)
+        pass_mask = matrix >= PASS_THRESHOLD
+        mean_pass = means >= PASS_THRESHOLD
+
+    codes, labels = {}, {}
+    for col in GROUP_COLUMNS:
+        if col in df.columns:
+            # sort=True: códigos seguem a ordem usada nos seletores das abas
+            codigos, valores = pd.factorize(df[col], sort=True)
+            codes[col] = _readonly(codigos.astype(np.int32))
+            labels[col] = list(valores)
+
+    return GradesCore(
+        columns=colunas,
+        matrix=_readonly(matrix),
+        valid=_readonly(valid),
+        means=_readonly(means),
+        pass_mask=_readonly(pass_mask),
+        mean_pass=_readonly(mean_pass),
+        codes=codes,
+        labels=labels,
+    )
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+Leitura das planilhas enviadas e snapshots colunares em disco.
+
+O parse via openpyxl é a etapa mais lenta da leitura; por isso o DataFrame
+já achatado (com a coluna PLANILHA) é gravado em formato Feather (Arrow IPC,
+sem compressão) na pasta de snapshots, identificado pelo hash do conteúdo.
+Leituras seguintes do mesmo arquivo mapeiam o snapshot em memória e pulam o
+parse do Excel.
+
+Cada aba de um .xlsx também tem seu snapshot, identificado pelo hash da
+própria aba (células + textos compartilhados que ela usa). Quando a mesma
+pasta de trabalho volta com uma aba nova (ex.: a cada bimestre), só as abas
+novas ou alteradas passam pelo parse.
+
+Uso pela linha de comando (pré-conversão de uma pasta de planilhas):
+
+    python ingest.py pasta/com/planilhas [--destino .snapshots] [--forcar]
+"""
+import argparse
+import glob
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+import pandas as pd
+
+from cache import fingerprint_bytes
+from profiling import stage
+from schema import apply_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # snapshots ficam desativados sem pyarrow
+    pa = None
+    feather = None
+
+# Pasta dos snapshots; pode ser ajustada pela variável de ambiente
+SNAPSHOT_DIR = os.environ.get("PI_SNAPSHOT_DIR", ".snapshots")
+# Incrementar quando o formato do DataFrame normalizado mudar
+SNAPSHOT_VERSION = 2
+SUPPORTED_EXTENSIONS = (".xls", ".xlsx", ".csv")
+
+# Leitura paralela das abas: "auto" (só para arquivos grandes com várias
+# abas), "on" ou "off"; e quantidade máxima de processos
+PARALLEL_SHEETS = os.environ.get("PI_PARALLEL_SHEETS", "auto")
+PARALLEL_WORKERS = int(os.environ.get("PI_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+PARALLEL_MIN_BYTES = 1024 ** 2
+# Snapshots por aba (.xlsx): reaproveita as abas que não mudaram
+INCREMENTAL_SHEETS = os.environ.get("PI_INCREMENTAL_SHEETS", "on") != "off"
+
+
+def flatten_multilevel_columns(df):
+    """Se df.columns for MultiIndex, achata para strings como “Topo – Sub”."""
+    if isinstance(df.columns, pd.MultiIndex):
+        new_cols = []
+        for top, sub in df.columns:
+            top = str(top).strip()
+            sub = str(sub).strip()
+            if top and sub:
+                new_name = f"{top} - {sub}"
+            elif sub:
+                new_name = sub
+            else:
+                new_name = top
+            new_cols.append(new_name)
+        df.columns = new_cols
+    return df
+
+
+def _flatten_sheet(df, sheet_name):
+    # flatten colunas multilinha
+    df = flatten_multilevel_columns(df)
+    # opcional: marcar de qual planilha veio
+    df["PLANILHA"] = sheet_name
+    return df
+
+
+def _parse_sheet(data, sheet_name):
+    """Lê uma única aba (executado nos processos do pool)."""
+    df = pd.read_excel(io.BytesIO(data), sheet_name=sheet_name, header=[0, 1])
+    return _flatten_sheet(df, sheet_name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Pool de processos reaproveitado entre leituras (criado sob demanda)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn": o processo do Streamlit tem várias threads, fork não é seguro
+            _pool = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def list_sheet_names(data):
+    """Nomes das abas na ordem do arquivo, sem ler as células."""
+    with pd.ExcelFile(io.BytesIO(data)) as xls:
+        return xls.sheet_names
+
+
+def use_parallel_sheets(data, n_sheets, parallel=None):
+    modo = PARALLEL_SHEETS if parallel is None else ("on" if parallel else "off")
+    if modo == "auto":
+        return n_sheets > 1 and PARALLEL_WORKERS > 1 and len(data) >= PARALLEL_MIN_BYTES
+    return modo == "on" and n_sheets > 1
+
+
+def parse_sheets(data, parallel=None):
+    """
+    Lê as abas de um Excel em bytes. No modo paralelo cada aba é lida em um
+    processo separado; a ordem das abas do arquivo é sempre preservada.
+    """
+    sheet_names = list_sheet_names(data)
+    if use_parallel_sheets(data, len(sheet_names), parallel):
+        # map devolve na ordem de submissão: PLANILHA e concat determinísticos
+        pool = _get_pool()
+        return list(pool.map(_parse_sheet, [data] * len(sheet_names), sheet_names))
+    # lê todas as planilhas
+    dict_dfs = pd.read_excel(io.BytesIO(data), sheet_name=None, header=[0, 1])
+    return [_flatten_sheet(df, sheet_name) for sheet_name, df in dict_dfs.items()]
+
+
+# =========================================
+# Hash por aba (.xlsx)
+# =========================================
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_SHEET_DATA = re.compile(rb"<(?:\w+:)?sheetData\b.*?(?:</(?:\w+:)?sheetData>|/>)", re.S)
+_SHARED_REF = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+_SHARED_ITEM = re.compile(rb"<(?:\w+:)?si\b.*?(?:</(?:\w+:)?si>|/>)", re.S)
+
+
+def _sheet_parts(xlsx):
+    """(nome da aba, caminho da parte no zip) na ordem do arquivo."""
+    workbook = ElementTree.fromstring(xlsx.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(xlsx.read("xl/_rels/workbook.xml.rels"))
+    alvos = {r.get("Id"): r.get("Target") for r in rels.iter(f"{_NS_PKG_REL}Relationship")}
+    partes = []
+    for aba in workbook.iter(f"{_NS_MAIN}sheet"):
+        alvo = alvos[aba.get(f"{_NS_REL}id")]
+        partes.append((aba.get("name"), alvo.lstrip("/") if alvo.startswith("/") else f"xl/{alvo}"))
+    return partes
+
+
+def sheet_fingerprints(data):
+    """
+    Hash de cada aba de um .xlsx, na ordem do arquivo: [(nome, hash)].
+    O hash cobre o nome, as células (sheetData) e os textos compartilhados
+    referenciados por elas; formatação e seleção/visualização não contam.
+    Retorna None se o conteúdo não for um .xlsx legível.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as xlsx:
+            nomes = set(xlsx.namelist())
+            textos = []
+            if "xl/sharedStrings.xml" in nomes:
+                textos = _SHARED_ITEM.findall(xlsx.read("xl/sharedStrings.xml"))
+            resultado = []
+            for nome, parte in _sheet_parts(xlsx):
+                xml = xlsx.read(parte)
+                celulas = b"" if (m := _SHEET_DATA.search(xml)) is None else m.group(0)
+                h = hashlib.sha256(nome.encode("utf-8") + b"\0" + celulas + b"\0")
+                for indice in _SHARED_REF.findall(celulas):
+                    h.update(textos[int(indice)])
+                resultado.append((nome, h.hexdigest()))
+            return resultado
+    except (zipfile.BadZipFile, KeyError, IndexError, ValueError, ElementTree.ParseError):
+        return None
+
+
+def sheet_snapshot_key(sheet_fingerprint):
+    """Identificador do snapshot de uma aba (na mesma pasta dos snapshots)."""
+    return f"aba-{sheet_fingerprint}"
+
+
+def parse_sheets_incremental(data, snapshot_dir=None, parallel=None):
+    """
+    Abas de um .xlsx já tipadas (apply_schema por aba), reaproveitando os
+    snapshots das abas que não mudaram; só as novas/alteradas passam pelo
+    parse (e ganham snapshot). Retorna (abas na ordem do arquivo, quantidade
+    de abas lidas) ou None se não for possível trabalhar por aba.
+    """
+    abas = sheet_fingerprints(data)
+    if abas is None or not snapshots_enabled():
+        return None
+    partes, faltando = {}, []
+    for nome, fingerprint in abas:
+        df = load_snapshot(sheet_snapshot_key(fingerprint), snapshot_dir)
+        if df is None:
+            faltando.append(nome)
+        else:
+            partes[nome] = df
+    if faltando:
+        if use_parallel_sheets(data, len(faltando), parallel):
+            lidas = _get_pool().map(_parse_sheet, [data] * len(faltando), faltando)
+        else:
+            dict_dfs = pd.read_excel(io.BytesIO(data), sheet_name=faltando, header=[0, 1])
+            lidas = [_flatten_sheet(dict_dfs[nome], nome) for nome in faltando]
+        hashes = dict(abas)
+        for nome, df in zip(faltando, lidas):
+            partes[nome] = apply_schema(df)
+            save_snapshot(partes[nome], sheet_snapshot_key(hashes[nome]), snapshot_dir)
+    return [partes[nome] for nome, _ in abas], len(faltando)
+
+
+def parse_source(source, ext, parallel=None):
+    """
+    Lê o arquivo (CSV ou Excel com múltiplas planilhas),
+    achata cabeçalhos multilinha e concatena as planilhas.
+    Retorna um DataFrame “plano”. `source` pode ser caminho ou bytes.
+    """
+    if ext in (".xls", ".xlsx"):
+        if not isinstance(source, (bytes, bytearray)):
+            with open(source, "rb") as f:
+                source = f.read()
+        list_flat = parse_sheets(bytes(source), parallel)
+        # concatenar todas
+        df_concat = pd.concat(list_flat, ignore_index=True, sort=False)
+        return apply_schema(df_concat)
+    elif ext == ".csv":
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        df = pd.read_csv(source)
+        return apply_schema(df)
+    else:
+        raise ValueError(f"Formato de arquivo não suportado: {ext}")
+
+
+# =========================================
+# Snapshots colunares
+# =========================================
+def snapshots_enabled():
+    return feather is not None
+
+
+def snapshot_path(fingerprint, snapshot_dir=None):
+    pasta = snapshot_dir or SNAPSHOT_DIR
+    return os.path.join(pasta, f"{fingerprint}-v{SNAPSHOT_VERSION}.feather")
+
+
+def load_snapshot(fingerprint, snapshot_dir=None):
+    """Carrega (memory-map) o snapshot do arquivo, ou None se não existir."""
+    if not snapshots_enabled():
+        return None
+    caminho = snapshot_path(fingerprint, snapshot_dir)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        tabela = feather.read_table(caminho, memory_map=True)
+    except (OSError, pa.ArrowInvalid):
+        # snapshot corrompido/incompleto: ignora e refaz a partir do original
+        return None
+    return tabela.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def save_snapshot(df, fingerprint, snapshot_dir=None):
+    """Grava o snapshot de forma atômica. Retorna o caminho ou None."""
+    if not snapshots_enabled():
+        return None
+    caminho = snapshot_path(fingerprint, snapshot_dir)
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        feather.write_feather(df, temporario, compression="uncompressed")
+        os.replace(temporario, caminho)
+    except (OSError, pa.ArrowException):
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        return None
+    return caminho
+
+
+def read_bytes(data, ext, fingerprint=None, use_snapshot=True, snapshot_dir=None,
+               parallel=None):
+    """Lê o conteúdo de um arquivo, usando/gerando o snapshot quando possível."""
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Formato de arquivo não suportado: {ext}")
+    if not use_snapshot:
+        return parse_source(data, ext, parallel)
+    fingerprint = fingerprint or fingerprint_bytes(data)
+    with stage("snapshot"):
+        df = load_snapshot(fingerprint, snapshot_dir)
+    if df is None:
+        with stage(f"parse {ext}") as etapa:
+            df = parse_incremental(data, ext, snapshot_dir, parallel)
+            if df is None:
+                df = parse_source(data, ext, parallel)
+            etapa.rows = len(df)
+        with stage("gravação do snapshot"):
+            save_snapshot(df, fingerprint, snapshot_dir)
+    return df
+
+
+def parse_incremental(data, ext, snapshot_dir=None, parallel=None):
+    """Como parse_source, mas lendo só as abas novas/alteradas; None se não se aplicar."""
+    if ext != ".xlsx" or not INCREMENTAL_SHEETS:
+        return None
+    resultado = parse_sheets_incremental(data, snapshot_dir, parallel)
+    if resultado is None:
+        return None
+    abas, _ = resultado
+    # o esquema é reaplicado no conjunto: une as categorias e preenche colunas
+    # que só existem em algumas abas, como no parse do arquivo inteiro
+    return apply_schema(pd.concat(abas, ignore_index=True, sort=False))
+
+
+def read_path(path, use_snapshot=True, snapshot_dir=None, parallel=None):
+    """Lê um arquivo do disco (CSV ou Excel), usando o snapshot quando houver."""
+    _, ext = os.path.splitext(path.lower())
+    with open(path, "rb") as f:
+        data = f.read()
+    return read_bytes(data, ext, use_snapshot=use_snapshot, snapshot_dir=snapshot_dir,
+                      parallel=parallel)
+
+
+# =========================================
+# Pré-conversão pela linha de comando
+# =========================================
+def find_workbooks(entradas):
+    """Expande pastas e padrões glob em uma lista ordenada de arquivos."""
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            for ext in SUPPORTED_EXTENSIONS:
+                arquivos += glob.glob(os.path.join(entrada, "**", f"*{ext}"), recursive=True)
+        else:
+            arquivos += glob.glob(entrada) or [entrada]
+    # ignora arquivos temporários do Excel (~$arquivo.xlsx)
+    return sorted({a for a in arquivos if not os.path.basename(a).startswith("~$")})
+
+
+def convert_workbooks(arquivos, snapshot_dir=None, forcar=False):
+    """Gera os snapshots dos arquivos. Retorna lista de (arquivo, status, segundos)."""
+    resultado = []
+    for arquivo in arquivos:
+        inicio = time.perf_counter()
+        _, ext = os.path.splitext(arquivo.lower())
+        with open(arquivo, "rb") as f:
+            data = f.read()
+        fingerprint = fingerprint_bytes(data)
+        if not forcar and os.path.exists(snapshot_path(fingerprint, snapshot_dir)):
+            status = "atualizado"
+        else:
+            df = None if forcar else parse_incremental(data, ext, snapshot_dir)
+            if df is None:
+                df = parse_source(data, ext)
+            status = "convertido" if save_snapshot(df, fingerprint, snapshot_dir) else "falhou"
+        resultado.append((arquivo, status, time.perf_counter() - inicio))
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Pré-converte planilhas (.xlsx/.csv) em snapshots colunares.")
+    parser.add_argument("entradas", nargs="+", help="arquivos, pastas ou padrões glob")
+    parser.add_argument("--destino", default=None,
+                        help=f"pasta dos snapshots (padrão: {SNAPSHOT_DIR})")
+    parser.add_argument("--forcar", action="store_true",
+                        help="regera snapshots já existentes")
+    args = parser.parse_args(argv)
+
+    if not snapshots_enabled():
+        print("pyarrow não está instalado; não é possível gerar snapshots.", file=sys.stderr)
+        return 1
+
+    arquivos = find_workbooks(args.entradas)
+    if not arquivos:
+        print("Nenhuma planilha encontrada.", file=sys.stderr)
+        return 1
+
+    falhas = 0
+    for arquivo, status, segundos in convert_workbooks(arquivos, args.destino, args.forcar):
+        falhas += status == "falhou"
+        print(f"{status:>10}  {segundos:6.2f}s  {arquivo}")
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
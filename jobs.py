@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Execução das análises pesadas em segundo plano.
+
+Clusterização, varredura de k e os boxplots da Dispersão rodam num pool de
+threads do processo, fora da thread do script do Streamlit: a aba mostra o
+progresso e, quando o trabalho termina, o resultado é entregue no próximo
+rerun (pelo cache de resultados). As threads compartilham os datasets do
+DatasetStore sem cópia; KMeans e silhouette passam a maior parte do tempo
+fora do GIL. Os gráficos usam o pyplot, que não é seguro entre threads: são
+desenhados um de cada vez (figures.PYPLOT_LOCK).
+
+Trabalhos são identificados por chave (hash do dataset, análise, entradas):
+pedidos iguais, de qualquer sessão, recebem um JobTicket para o mesmo
+trabalho em andamento. O ticket é devolvido quando as entradas da aba mudam
+ou a sessão termina (weakref.finalize, como os handles do DatasetStore);
+sem nenhum ticket, o trabalho ainda não concluído é cancelado. O
+cancelamento é cooperativo: `job.report()` levanta JobCancelled no próximo
+ponto de progresso.
+"""
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+# Análises em segundo plano (0 desliga: tudo roda na thread do script)
+BACKGROUND_JOBS = os.environ.get("PI_BACKGROUND_JOBS", "1") != "0"
+# Trabalhos simultâneos no pool e intervalo de atualização do progresso (s)
+JOB_WORKERS = int(os.environ.get("PI_JOB_WORKERS", str(min(4, os.cpu_count() or 1))))
+JOB_POLL_SECONDS = float(os.environ.get("PI_JOB_POLL_SECONDS", "0.5"))
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDO = "concluído"
+FALHOU = "falhou"
+CANCELADO = "cancelado"
+
+
+class JobCancelled(Exception):
+    """Levantada dentro do trabalho quando ele foi cancelado."""
+
+
+class Job:
+    """Um trabalho do pool: estado, progresso (0 a 1) e resultado ou erro."""
+
+    def __init__(self, key, description=""):
+        self.key = key
+        self.description = description
+        self.status = PENDENTE
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in (CONCLUIDO, FALHOU, CANCELADO)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def report(self, fraction, message=None):
+        """Atualiza o progresso; levanta JobCancelled se o trabalho foi cancelado."""
+        if self._cancel.is_set():
+            raise JobCancelled(self.key)
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+
+    def cancel(self):
+        self._cancel.set()
+
+
+class JobTicket:
+    """Interesse de uma sessão num trabalho; `release()` o devolve (uma vez só)."""
+
+    def __init__(self, manager, job):
+        self.job = job
+        self._finalizer = weakref.finalize(self, manager._release, job)
+
+    @property
+    def alive(self):
+        return self._finalizer.alive
+
+    def release(self):
+        self._finalizer()
+
+
+class JobManager:
+    """
+    Pool de trabalhos com deduplicação por chave. `submit(chave, fn)` executa
+    `fn(job)` uma vez por chave enquanto houver tickets para ela; `fn` informa
+    o progresso com `job.report(fração, mensagem)`.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="pi-job")
+        self._jobs = {}       # chave -> [job, tickets]
+        # reentrante: um ticket pode ser coletado (finalize) com o lock já tomado
+        self._lock = threading.RLock()
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def get(self, key):
+        with self._lock:
+            entrada = self._jobs.get(key)
+            return entrada[0] if entrada else None
+
+    def submit(self, key, fn, description=""):
+        """Ticket para o trabalho `key`; inicia `fn(job)` se não houver um ativo com a mesma chave."""
+        with self._lock:
+            entrada = self._jobs.get(key)
+            if entrada is not None and not entrada[0].cancelled and entrada[0].status != FALHOU:
+                entrada[1] += 1
+                self.deduplicated += 1
+                return JobTicket(self, entrada[0])
+            job = Job(key, description)
+            self._jobs[key] = [job, 1]
+            self.submitted += 1
+        self._executor.submit(self._run, job, fn)
+        return JobTicket(self, job)
+
+    def _run(self, job, fn):
+        if job.cancelled:
+            self._finish(job, CANCELADO)
+            return
+        job.status = EXECUTANDO
+        job.started = time.time()
+        try:
+            job.result = fn(job)
+        except JobCancelled:
+            self._finish(job, CANCELADO)
+        except Exception as erro:  # noqa: BLE001 — o erro é exibido na aba
+            job.error = erro
+            self._finish(job, FALHOU)
+        else:
+            job.progress = 1.0
+            self._finish(job, CONCLUIDO)
+
+    def _finish(self, job, status):
+        with self._lock:
+            job.finished = time.time()
+            job.status = status
+            self.completed += status == CONCLUIDO
+            self.failed += status == FALHOU
+            self.cancelled += status == CANCELADO
+            entrada = self._jobs.get(job.key)
+            if entrada is not None and entrada[0] is job and entrada[1] <= 0:
+                # ninguém mais espera o resultado
+                del self._jobs[job.key]
+
+    def _release(self, job):
+        with self._lock:
+            entrada = self._jobs.get(job.key)
+            if entrada is None or entrada[0] is not job:
+                return
+            entrada[1] -= 1
+            if entrada[1] > 0:
+                return
+            if job.done:
+                del self._jobs[job.key]
+            else:
+                # entradas mudaram em todas as sessões: o resultado não serve mais
+                job.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            ativos = [e[0] for e in self._jobs.values() if not e[0].done]
+            return {
+                "em andamento": sum(j.status == EXECUTANDO for j in ativos),
+                "na fila": sum(j.status == PENDENTE for j in ativos),
+                "enviados": self.submitted,
+                "reaproveitados": self.deduplicated,
+                "concluídos": self.completed,
+                "falhas": self.failed,
+                "cancelados": self.cancelled,
+            }
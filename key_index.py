@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de bitmaps das chaves de agrupamento (TURMA, SERIE_ANO, ANO e PLANILHA).
+
+Montado uma vez na leitura: para cada valor de cada chave guarda as linhas
+que o contêm como um bitmap compactado (np.packbits, 1 bit por aluno).
+Seleções por igualdade/isin viram OR dos bitmaps dos valores escolhidos e
+AND entre chaves, sem percorrer nem copiar o DataFrame.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from grades_core import COL_ANO, COL_SERIE, COL_TURMA
+
+COL_PLANILHA = "PLANILHA"
+INDEXED_COLUMNS = (COL_TURMA, COL_SERIE, COL_ANO, COL_PLANILHA)
+
+
+@dataclass(frozen=True)
+class KeyIndex:
+    n_rows: int
+    codes: dict      # coluna -> códigos int32 por linha (-1 = ausente)
+    labels: dict     # coluna -> lista ordenada dos valores
+    dtypes: dict     # coluna -> dtype original (para montar resultados com o mesmo tipo)
+    bitmaps: dict    # coluna -> matriz (valores x bytes) de bitmaps compactados
+
+    def __contains__(self, col):
+        return col in self.codes
+
+    @property
+    def nbytes(self):
+        return sum(b.nbytes for b in self.bitmaps.values())
+
+    def values(self, col):
+        """Valores distintos da chave, ordenados (lista vazia se não indexada)."""
+        return list(self.labels.get(col, []))
+
+    def bitmap(self, selection):
+        """
+        Bitmap compactado das linhas que atendem a seleção
+        {coluna: valor ou lista de valores}. Lista vazia não filtra.
+        """
+        bits = np.full((self.n_rows + 7) // 8, 0xFF, dtype=np.uint8)
+        for col, valores in selection.items():
+            if isinstance(valores, (list, tuple, set, frozenset)):
+                if not valores:
+                    continue
+            else:
+                valores = [valores]
+            labels = self.labels[col]
+            linhas = [labels.index(v) for v in valores if v in labels]
+            bits &= np.bitwise_or.reduce(self.bitmaps[col][linhas], axis=0) if linhas else 0
+        return bits
+
+    def mask(self, selection):
+        """Máscara booleana (uma posição por linha) da seleção."""
+        return np.unpackbits(self.bitmap(selection), count=self.n_rows).astype(bool)
+
+    def positions(self, selection):
+        """Posições (iloc) das linhas da seleção, em ordem crescente."""
+        return np.flatnonzero(self.mask(selection))
+
+    def count(self, selection):
+        """Quantidade de linhas da seleção (popcount do bitmap)."""
+        return int(np.unpackbits(self.bitmap(selection), count=self.n_rows).sum())
+
+    def group_counts(self, cols, mask=None, name="Quantidade"):
+        """
+        Linhas por combinação de valores das chaves `cols` (só as combinações
+        presentes, ordenadas), como um groupby(...).size() com observed=True.
+        """
+        cols = list(cols)
+        sel = np.ones(self.n_rows, dtype=bool) if mask is None else mask
+        for col in cols:
+            sel = sel & (self.codes[col] >= 0)
+        tamanhos = [len(self.labels[col]) for col in cols]
+        chave = np.ravel_multi_index([self.codes[col][sel] for col in cols], tamanhos)
+        contagem = np.bincount(chave, minlength=int(np.prod(tamanhos)))
+        presentes = np.flatnonzero(contagem)
+        resultado = self.keys_frame(cols, presentes)
+        resultado[name] = contagem[presentes]
+        return resultado
+
+    def keys_frame(self, cols, groups):
+        """
+        Valores das chaves `cols` (com o tipo original) para ids de grupo
+        combinados (np.ravel_multi_index dos códigos, na ordem de `cols`).
+        """
+        tamanhos = [len(self.labels[col]) for col in cols]
+        chaves = {}
+        for col, codigos in zip(cols, np.unravel_index(groups, tamanhos)):
+            valores = pd.Series(np.asarray(self.labels[col], dtype=object)[codigos])
+            chaves[col] = valores.astype(self.dtypes[col])
+        return pd.DataFrame(chaves)
+
+def build_key_index(df, core=None):
+    """Monta o índice das chaves presentes em `df` (reaproveita os códigos do core)."""
+    codes, labels, dtypes, bitmaps = {}, {}, {}, {}
+    for col in INDEXED_COLUMNS:
+        if col not in df.columns:
+            continue
+        if core is not None and col in core.codes:
+            codigos, valores = core.codes[col], core.labels[col]
+        else:
+            codigos, uniques = pd.factorize(df[col], sort=True)
+            codigos, valores = codigos.astype(np.int32), list(uniques)
+        codes[col] = codigos
+        labels[col] = valores
+        dtypes[col] = df[col].dtype
+        # um valor por vez: evita a matriz booleana (valores x linhas) inteira
+        bits = np.vstack([np.packbits(codigos == c) for c in range(len(valores))]) if valores else \
+            np.empty((0, (len(df) + 7) // 8), dtype=np.uint8)
+        bits.flags.writeable = False
+        bitmaps[col] = bits
+    return KeyIndex(n_rows=len(df), codes=codes, labels=labels, dtypes=dtypes, bitmaps=bitmaps)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Detecção vetorizada de outliers pela regra do IQR (Q1 - 1.5·IQR, Q3 + 1.5·IQR).
+
+Os quartis de todas as disciplinas saem de uma única passada sobre a matriz
+larga de notas (alunos x disciplinas); os outliers são uma máscara booleana
+e a tabela final é montada por indexação, sem iterar linha a linha.
+Opcionalmente os limites são calculados por grupo (ex.: por turma ou série)
+ou chegam prontos (ex.: dos esboços de quantis, em sketches.py).
+"""
+import numpy as np
+import pandas as pd
+
+WHISKER = 1.5
+
+
+def iqr_fences(matrix, whisker=WHISKER):
+    """Q1, Q3 e limites inferior/superior de cada coluna (ignora NaN)."""
+    valores = np.asarray(matrix, dtype=np.float64)
+    if len(valores) == 0:
+        vazio = np.full(valores.shape[1], np.nan)
+        return vazio, vazio, vazio, vazio
+    q1, q3 = np.nanquantile(valores, [0.25, 0.75], axis=0)
+    iqr = q3 - q1
+    return q1, q3, q1 - whisker * iqr, q3 + whisker * iqr
+
+
+def grouped_iqr_fences(matrix, codes, whisker=WHISKER):
+    """
+    Limites por grupo: retorna (lower, upper) com uma linha por aluno
+    (os limites do grupo do aluno), prontos para comparar com `matrix`.
+    Alunos sem grupo (código -1: chave ausente) não formam um grupo próprio:
+    recebem os limites de todas as linhas.
+    """
+    valores = np.asarray(matrix, dtype=np.float64)
+    codes = np.asarray(codes)
+    com_grupo = codes >= 0
+    if not com_grupo.any():
+        _, _, lower, upper = iqr_fences(valores, whisker)
+        return np.tile(lower, (len(codes), 1)), np.tile(upper, (len(codes), 1))
+    quartis = pd.DataFrame(valores[com_grupo]).groupby(codes[com_grupo]).quantile([0.25, 0.75])
+    q1 = quartis.xs(0.25, level=1)
+    q3 = quartis.xs(0.75, level=1)
+    iqr = q3 - q1
+    # código -1 não está nos quartis: a linha sai NaN e é preenchida abaixo
+    lower = (q1 - whisker * iqr).reindex(codes).to_numpy(copy=True)
+    upper = (q3 + whisker * iqr).reindex(codes).to_numpy(copy=True)
+    if not com_grupo.all():
+        _, _, lower_geral, upper_geral = iqr_fences(valores, whisker)
+        lower[~com_grupo] = lower_geral
+        upper[~com_grupo] = upper_geral
+    return lower, upper
+
+
+def outlier_mask(matrix, lower, upper):
+    """Máscara (alunos x disciplinas): nota abaixo/acima dos limites. NaN nunca é outlier."""
+    with np.errstate(invalid="ignore"):
+        abaixo = matrix < lower
+        acima = matrix > upper
+    return abaixo, acima
+
+
+def outlier_table(df, matrix, subjects, lower, upper, info_cols):
+    """
+    Tabela dos outliers, uma linha por (aluno, disciplina), na ordem
+    disciplina → aluno. `df` são as linhas (alinhadas a `matrix`) com as
+    colunas `info_cols` usadas para identificar o aluno.
+    """
+    abaixo, acima = outlier_mask(matrix, lower, upper)
+    fora = abaixo | acima
+    # transposta: percorre disciplina a disciplina, como na tabela original
+    disciplinas, linhas = np.nonzero(fora.T)
+    tabela = {"Disciplina": np.asarray(subjects, dtype=object)[disciplinas]}
+    for col in info_cols:
+        tabela[col] = df[col].to_numpy()[linhas]
+    tabela["Nota"] = matrix[linhas, disciplinas]
+    tabela["Tipo"] = np.where(acima[linhas, disciplinas], "Acima", "Abaixo")
+    return pd.DataFrame(tabela)
+
+
+def _fences_by_subject(matrix, subjects, fences, progress):
+    """`fences(colunas)` disciplina a disciplina, com `progress(fração, mensagem)` entre elas."""
+    partes = []
+    for j, disciplina in enumerate(subjects):
+        progress(j / len(subjects), f"limites do IQR: {disciplina}")
+        partes.append(fences(matrix[:, j:j + 1]))
+    return tuple(np.concatenate(limites, axis=-1) for limites in zip(*partes))
+
+
+def find_outliers(df, matrix, subjects, info_cols, group_codes=None, whisker=WHISKER, fences=None,
+                  progress=None):
+    """
+    Outliers de todas as disciplinas de uma vez. Sem `group_codes` os limites
+    valem para todas as linhas; com eles, cada grupo tem os seus limites.
+    `fences` ((lower, upper), por disciplina ou por linha) dispensa o cálculo.
+    Com `progress(fração, mensagem)`, os limites são calculados disciplina a
+    disciplina, informando o andamento entre elas (e permitindo interromper).
+    """
+    def calcular(colunas):
+        if group_codes is None:
+            return iqr_fences(colunas, whisker)[2:]
+        return grouped_iqr_fences(colunas, group_codes, whisker)
+
+    if fences is not None:
+        lower, upper = fences
+    elif progress is None or not subjects:
+        lower, upper = calcular(matrix)
+    else:
+        lower, upper = _fences_by_subject(matrix, subjects, calcular, progress)
+    return outlier_table(df, matrix, subjects, lower, upper, info_cols)
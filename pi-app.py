@@ -2,252 +2,549 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
+import uuid
+from collections import deque
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
 import seaborn as sns
+from cache import LRUCache, fingerprint_bytes, fingerprint_file
+from dataset import load_dataset
+from grades_core import COL_ANO, COL_SERIE, COL_TURMA
+from schema import memory_report
+from clustering import ClusterEngine, assign_clusters, sweep_k
+from outliers import find_outliers
+from filters import COL_MEDIA, FilterSpec, apply_filter
+from key_index import COL_PLANILHA
+from aggregates import group_summary, merge_partials, partial_stats
+from figures import FigureCache
+from store import DatasetStore
+from charts import SCATTER_MAX_POINTS, cluster_scatter
+from streaming import StreamedDataset, stream_csv, use_streaming
+from sketches import COL_MEDIA_ALUNO, SKETCH_MIN_ROWS, use_sketch
+from jobs import BACKGROUND_JOBS, CONCLUIDO, FALHOU, JOB_POLL_SECONDS, JobManager
+from exports import EXPORT_FORMATS, ExportCache, available_formats
+from profiling import PROFILE_HISTORY, PROFILE_LOG, append_log, stage, to_chrome_trace, to_json_lines, trace_rerun
 sns.set_theme(style="whitegrid")
 
-def flatten_multilevel_columns(df):
-    """Se df.columns for MultiIndex, achata para strings como “Topo – Sub”."""
-    if isinstance(df.columns, pd.MultiIndex):
-        new_cols = []
-        for top, sub in df.columns:
-            top = str(top).strip()
-            sub = str(sub).strip()
-            if top and sub:
-                new_name = f"{top} - {sub}"
-            elif sub:
-                new_name = sub
-            else:
-                new_name = top
-            new_cols.append(new_name)
-        df.columns = new_cols
-    return df
+# Limite (MB) dos datasets lidos que nenhuma sessão usa mais (LRU do DatasetStore)
+INGEST_CACHE_MB = int(os.environ.get("PI_INGEST_CACHE_MB", "512"))
+# Limite (MB) do cache de resultados das análises
+RESULTS_CACHE_MB = int(os.environ.get("PI_RESULTS_CACHE_MB", "256"))
+# Limite (MB) do cache de imagens dos gráficos
+FIGURE_CACHE_MB = int(os.environ.get("PI_FIGURE_CACHE_MB", "128"))
 
-def read_uploaded_file(uploaded_file):
+@st.cache_resource
+def get_dataset_store():
+    """Datasets lidos, compartilhados por todas as sessões do processo (um por conteúdo)."""
+    return DatasetStore(max_bytes=INGEST_CACHE_MB * 1024 ** 2)
+
+@st.cache_resource
+def get_results_cache():
+    """Resultados das análises por (dataset, análise, entradas), entre reruns."""
+    return LRUCache(max_bytes=RESULTS_CACHE_MB * 1024 ** 2)
+
+def cached_analysis(dataset, nome, entradas, compute, keep=None):
+    """
+    Resultado da análise `nome` para o dataset e as entradas (tupla) dadas.
+    Só é recalculado quando o dataset (hash) ou as próprias entradas mudam;
+    o resultado é compartilhado e não deve ser alterado por quem o lê.
+    Com `keep`, só resultados em que `keep(resultado)` é verdadeiro vão para o cache.
+    """
+    chave = (dataset.fingerprint, nome, entradas)
+    with stage(f"análise {nome}", rows=dataset_rows(dataset)):
+        return get_results_cache().get_or_compute(chave, compute, keep)
+
+def dataset_rows(dataset):
+    """Alunos do dataset (ou do CSV lido em blocos)."""
+    return dataset.n_rows if isinstance(dataset, StreamedDataset) else len(dataset.df)
+
+@st.cache_resource
+def get_figure_cache():
+    """Imagens (PNG) dos gráficos por (dataset, gráfico, parâmetros), entre reruns."""
+    return FigureCache(max_bytes=FIGURE_CACHE_MB * 1024 ** 2)
+
+def show_figure(dataset, nome, parametros, draw, background=False):
+    """
+    Exibe o gráfico `nome`: `draw()` desenha e devolve a figura matplotlib,
+    que é renderizada em PNG e fechada; só é redesenhado quando o dataset
+    (hash) ou os parâmetros (tupla) mudam. Com `background`, a renderização
+    roda no pool de trabalhos e a aba mostra o progresso até a imagem ficar pronta.
     """
-    Lê o arquivo (CSV ou Excel com múltiplas planilhas),
-    achata cabeçalhos multilinha e concatena as planilhas.
-    Retorna um DataFrame “plano”.
+    figuras = get_figure_cache()
+    chave = (dataset.fingerprint, nome, parametros)
+    with stage(f"gráfico {nome}"):
+        if background and run_in_background():
+            png = background_result(f"figura:{nome}", chave, lambda: figuras.images.get(chave, JOB_PENDING),
+                                    lambda progress: figuras.get_png(chave, draw, progress), f"Gráfico {nome}")
+            if png is JOB_PENDING:
+                return
+        else:
+            png = figuras.get_png(chave, draw)
+        st.image(png, width="stretch")
+
+@st.cache_resource
+def get_export_cache():
+    """Arquivos exportados da Filtragem Manual por (dataset, filtro, formato), em disco."""
+    return ExportCache()
+
+@st.cache_resource
+def get_job_manager():
+    """Pool das análises em segundo plano, compartilhado pelas sessões."""
+    return JobManager()
+
+# resultado ainda em cálculo no pool de trabalhos
+JOB_PENDING = object()
+
+def run_in_background():
+    """Só com o servidor do Streamlit (sem ele, ex.: em scripts, tudo roda na hora)."""
+    return BACKGROUND_JOBS and st.runtime.exists()
+
+def _no_progress(fraction, message=None):
+    pass
+
+def background_analysis(dataset, nome, entradas, compute, descricao, keep=None):
+    """
+    Como cached_analysis, mas `compute(progress)` roda no pool de trabalhos
+    (`progress(fração, mensagem)` informa o andamento). Devolve o resultado
+    se já estiver pronto; senão mostra o progresso e devolve JOB_PENDING — a
+    aba é refeita quando o trabalho termina. Resultados recusados por `keep`
+    ficam só com o trabalho (enquanto a sessão mantiver as mesmas entradas).
+    """
+    cache = get_results_cache()
+    chave = (dataset.fingerprint, nome, entradas)
+
+    def calcular(progress):
+        resultado = compute(progress)
+        if keep is None or keep(resultado):
+            cache.put(chave, resultado)
+        return resultado
+
+    with stage(f"análise {nome}", rows=dataset_rows(dataset)):
+        if not run_in_background():
+            return cache.get_or_compute(chave, lambda: compute(_no_progress), keep)
+        return background_result(nome, chave, lambda: cache.get(chave, JOB_PENDING), calcular, descricao)
+
+def background_result(slot, chave, lookup, compute, descricao):
+    """
+    Resultado do trabalho `chave` (ou JOB_PENDING). A sessão tem um ticket por
+    `slot`: quando a chave muda, o ticket anterior é devolvido e o trabalho
+    obsoleto é cancelado, a menos que outra sessão ainda o espere.
+    """
+    tickets = st.session_state.setdefault("job_tickets", {})
+    cancelados = st.session_state.setdefault("job_cancelados", {})
+    ticket = tickets.get(slot)
+    resultado = lookup()
+    if resultado is not JOB_PENDING:
+        if ticket is not None:
+            tickets.pop(slot).release()
+        return resultado
+
+    if cancelados.get(slot) == chave:
+        st.info(f"{descricao}: cálculo cancelado.")
+        if st.button("Calcular", key=f"job_retomar:{slot}"):
+            cancelados.pop(slot)
+            st.rerun()
+        return JOB_PENDING
+    cancelados.pop(slot, None)
+
+    if ticket is None or ticket.job.key != chave or ticket.job.cancelled:
+        if ticket is not None:
+            # entradas mudaram: o trabalho anterior ficou obsoleto
+            tickets.pop(slot).release()
+        ticket = tickets[slot] = get_job_manager().submit(chave, lambda job: compute(job.report), descricao)
+
+    job = ticket.job
+    if job.status == CONCLUIDO:
+        # resultado maior que o cache: entregue pelo próprio trabalho
+        return job.result
+    if job.status == FALHOU:
+        st.error(f"{descricao}: falha no cálculo — {job.error}")
+        if st.button("Tentar novamente", key=f"job_repetir:{slot}"):
+            tickets.pop(slot).release()
+            st.rerun()
+        return JOB_PENDING
+
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def acompanhar():
+        if job.done:
+            # pronto: refaz a página, que encontra o resultado no cache
+            st.rerun(scope="app")
+        texto = f"{descricao}: {job.message or job.status} ({job.elapsed:.1f} s)"
+        st.progress(job.progress, text=texto)
+
+    acompanhar()
+    if st.button("Cancelar", key=f"job_cancelar:{slot}",
+                 help="O cálculo para no próximo ponto de progresso e libera o processamento."):
+        cancelados[slot] = chave
+        tickets.pop(slot).release()
+        st.rerun()
+    return JOB_PENDING
+
+def load_uploaded_dataset(uploaded_file, streaming=True):
+    """
+    Dataset do arquivo carregado (DataFrame tipado + dados derivados das
+    notas), vindo do armazenamento do processo: sessões que enviam o mesmo
+    conteúdo (hash) recebem o mesmo objeto, lido uma única vez (do snapshot
+    colunar em disco, se houver). A sessão mantém a referência até trocar de
+    arquivo ou terminar. As abas não devem alterar o DataFrame recebido.
+    CSVs grandes são lidos em blocos e viram um StreamedDataset (só os
+    resumos, sem os alunos), a não ser com `streaming=False`.
     """
     _, ext = os.path.splitext(uploaded_file.name.lower())
-    if ext in (".xls", ".xlsx"):
-        # lê todas as planilhas
-        dict_dfs = pd.read_excel(uploaded_file, sheet_name=None, header=[0,1])
-        list_flat = []
-        for sheet_name, df in dict_dfs.items():
-            # flatten colunas multilinha
-            df = flatten_multilevel_columns(df)
-            # opcional: marcar de qual planilha veio
-            df["PLANILHA"] = sheet_name
-            list_flat.append(df)
-        # concatenar todas
-        df_concat = pd.concat(list_flat, ignore_index=True, sort=False)
-        return df_concat.fillna(0)
-    elif ext == ".csv":
-        df = pd.read_csv(uploaded_file)
-        return df.fillna(0)
+    # mesmo envio (file_id) da sessão: nem relê nem recalcula o hash do conteúdo
+    envio = (getattr(uploaded_file, "file_id", None), streaming)
+    handle = st.session_state.get("dataset_handle")
+    if handle is not None and handle.alive and envio[0] is not None and handle.source == envio:
+        return handle.dataset
+
+    em_blocos = streaming and use_streaming(upload_size(uploaded_file), ext)
+    if em_blocos:
+        # hash e leitura por blocos direto do arquivo enviado, sem uma cópia em bytes
+        data = None
+        fingerprint = fingerprint_file(uploaded_file)
     else:
-        raise ValueError(f"Formato de arquivo não suportado: {ext}")
-
-def general_review(df):
+        data = uploaded_file.getvalue()
+        fingerprint = fingerprint_bytes(data)
+    chave = (fingerprint, ext, em_blocos)
+    if handle is not None and handle.alive and handle.key == chave:
+        handle.source = envio
+        return handle.dataset
+
+    def ler():
+        if em_blocos:
+            # None quando o CSV não tem as chaves/notas: leitura completa
+            resumo = stream_csv(uploaded_file, fingerprint)
+            if resumo is not None:
+                return resumo
+        return load_dataset(uploaded_file.getvalue() if data is None else data, ext, fingerprint)
+
+    novo = get_dataset_store().acquire(chave, ler, source=envio)
+    release_session_dataset()
+    st.session_state["dataset_handle"] = novo
+    return novo.dataset
+
+def upload_size(uploaded_file):
+    """Tamanho (bytes) do arquivo enviado, sem ler o conteúdo."""
+    tamanho = getattr(uploaded_file, "size", None)
+    if tamanho is None:
+        uploaded_file.seek(0, os.SEEK_END)
+        tamanho = uploaded_file.tell()
+        uploaded_file.seek(0)
+    return tamanho
+
+def release_session_dataset():
+    """Devolve ao armazenamento o dataset referenciado por esta sessão (se houver)."""
+    handle = st.session_state.pop("dataset_handle", None)
+    if handle is not None:
+        handle.release()
 
-    df_proc = df.copy()
+def read_uploaded_file(uploaded_file):
+    """Lê o arquivo carregado (via armazenamento compartilhado) e retorna o DataFrame “plano”."""
+    return load_uploaded_dataset(uploaded_file, streaming=False).df
+
+def dataset_store_panel():
+    """Painel lateral com os datasets do processo: em uso, no LRU e acertos/falhas."""
+    store = get_dataset_store()
+    with st.sidebar.expander("Datasets em memória"):
+        limite = st.number_input("Limite sem referências (MB)", min_value=0, step=64,
+                                 value=int(store.max_bytes / 1024 ** 2), key="ingest_cache_mb")
+        if limite * 1024 ** 2 != store.max_bytes:
+            store.resize(limite * 1024 ** 2)
+        stats = store.stats()
+        st.write(f"- Em uso: **{stats['residentes']}** (**{stats['memória (MB)']:.1f} MB**), "
+                 f"sessões com referência: **{stats['referências']}**")
+        st.write(f"- Sem referências: **{stats['sem referências']}** "
+                 f"(**{stats['sem referências (MB)']:.1f} / {stats['limite (MB)']:.0f} MB**)")
+        st.write(f"- Acertos / falhas: **{stats['acertos']} / {stats['falhas']}** "
+                 f"({stats['taxa de acerto (%)']:.0f}%)")
+        st.write(f"- Descartes (LRU): **{stats['descartes']}**")
+        if st.button("Limpar sem referências", key="ingest_cache_clear"):
+            store.clear()
+
+def job_panel():
+    """Painel lateral com os trabalhos em segundo plano do processo."""
+    with st.sidebar.expander("Análises em segundo plano"):
+        if not run_in_background():
+            st.write("Desativadas: as análises rodam durante o rerun.")
+            return
+        stats = get_job_manager().stats()
+        st.write(f"- Em andamento / na fila: **{stats['em andamento']} / {stats['na fila']}**")
+        st.write(f"- Enviados / reaproveitados: **{stats['enviados']} / {stats['reaproveitados']}**")
+        st.write(f"- Concluídos / falhas / cancelados: "
+                 f"**{stats['concluídos']} / {stats['falhas']} / {stats['cancelados']}**")
+
+def figure_cache_panel():
+    """Painel lateral com as figuras abertas e o cache de imagens dos gráficos."""
+    figuras = get_figure_cache()
+    with st.sidebar.expander("Gráficos"):
+        stats = figuras.stats()
+        st.write(f"- Figuras abertas: **{stats['figuras abertas']}**")
+        st.write(f"- Imagens em cache: **{stats['entradas']}** "
+                 f"(**{stats['memória (MB)']:.1f} / {stats['limite (MB)']:.0f} MB**)")
+        st.write(f"- Renderizações: **{stats['renderizações']}** "
+                 f"({stats['tempo de renderização (s)']:.1f} s)")
+        st.write(f"- Acertos / falhas: **{stats['acertos']} / {stats['falhas']}** "
+                 f"({stats['taxa de acerto (%)']:.0f}%)")
+        if st.button("Limpar imagens", key="figure_cache_clear"):
+            figuras.clear()
+
+def general_review(dataset):
+
+    df = dataset.df
+    index = dataset.index
 
     st.subheader("Visão Geral")
 
-    # Garantir que a coluna da planilha exista
-    if "PLANILHA" not in df_proc.columns:
-        df_proc["PLANILHA"] = "Único"
-
-    planilhas = ["Todos"] + sorted(df_proc["PLANILHA"].dropna().unique().tolist())
+    # Planilhas disponíveis (sem a coluna, os dados formam uma planilha “Único”)
+    planilhas = ["Todos"] + (index.values(COL_PLANILHA) if COL_PLANILHA in index else ["Único"])
     planilha_selecionada = st.selectbox("Escolha a planilha", planilhas)
 
-    if planilha_selecionada != "Todos":
-        df_info = df_proc[df_proc["PLANILHA"] == planilha_selecionada]
-    else:
-        df_info = df_proc
+    # seleção pelo índice de bitmaps (sem filtrar/copiar o DataFrame)
+    selecao = None
+    if planilha_selecionada != "Todos" and COL_PLANILHA in index:
+        selecao = index.mask({COL_PLANILHA: planilha_selecionada})
 
     col_ano = "DADOS GERAIS - SERIE_ANO"
     col_turma = "DADOS GERAIS - TURMA"
-    missing_cols = [c for c in (col_ano, col_turma) if c not in df_info.columns]
+    missing_cols = [c for c in (col_ano, col_turma) if c not in index]
 
     if missing_cols:
         st.error(f"As seguintes colunas não foram encontradas: {missing_cols}")
     else:
         # Total
-        st.markdown(f"**Total de alunos:** {len(df_info)}")
+        total = len(df) if selecao is None else int(selecao.sum())
+        st.markdown(f"**Total de alunos:** {total}")
 
         # Quantidade de alunos por ano
         st.markdown("**Quantidade de alunos por ano do ensino médio:**")
-        alunos_por_ano = df_info.groupby(col_ano).size().reset_index(name="Quantidade de alunos")
-        st.dataframe(alunos_por_ano, use_container_width=True)
+        alunos_por_ano = index.group_counts([col_ano], selecao, name="Quantidade de alunos")
+        st.dataframe(alunos_por_ano, width="stretch")
 
         # Quantidade de alunos por turma e ano
         st.markdown("**Quantidade de alunos por turma e ano:**")
-        alunos_por_turma_ano = df_info.groupby([col_ano, col_turma]).size().reset_index(name="Quantidade de alunos")
-        st.dataframe(alunos_por_turma_ano, use_container_width=True)
+        alunos_por_turma_ano = index.group_counts([col_ano, col_turma], selecao, name="Quantidade de alunos")
+        st.dataframe(alunos_por_turma_ano, width="stretch")
 
     st.markdown(f"**Total de colunas:** {len(df.columns)}")
-    st.dataframe(pd.DataFrame(df.columns, columns=["Colunas"]), use_container_width=True)
-
-def general_performance(df):
+    st.dataframe(pd.DataFrame(df.columns, columns=["Colunas"]), width="stretch")
+
+    # Memória ocupada por coluna: tipos do esquema x tipos genéricos
+    with st.expander("Memória por coluna"):
+        relatorio = memory_report(df)
+        antes, depois = relatorio["Antes (KB)"].sum(), relatorio["Depois (KB)"].sum()
+        st.markdown(f"**Total:** {antes / 1024:.2f} MB → {depois / 1024:.2f} MB "
+                    f"({antes / depois:.1f}x menor)")
+        st.dataframe(relatorio, width="stretch")
+
+def streamed_review(dataset):
+    """Visão Geral de um CSV lido em blocos: contagens combinadas na leitura."""
+    st.subheader("Visão Geral")
+    st.info(f"Arquivo grande lido em {dataset.chunks} blocos: só as abas de resumo estão disponíveis.")
+
+    contagens = dataset.counts
+    if COL_PLANILHA in contagens:
+        planilhas = ["Todos"] + contagens[COL_PLANILHA].cat.categories.tolist()
+        planilha_selecionada = st.selectbox("Escolha a planilha", planilhas)
+        if planilha_selecionada != "Todos":
+            contagens = contagens[contagens[COL_PLANILHA] == planilha_selecionada]
+
+    nome = "Quantidade de alunos"
+    st.markdown(f"**Total de alunos:** {int(contagens[nome].sum())}")
+    st.markdown("**Quantidade de alunos por ano do ensino médio:**")
+    st.dataframe(contagens.groupby(COL_SERIE, observed=True)[nome].sum().reset_index(),
+                 width="stretch")
+    st.markdown("**Quantidade de alunos por turma e ano:**")
+    st.dataframe(contagens.groupby([COL_SERIE, COL_TURMA], observed=True)[nome].sum().reset_index(),
+                 width="stretch")
+
+    st.markdown(f"**Total de colunas:** {len(dataset.columns)}")
+    st.dataframe(pd.DataFrame(dataset.columns, columns=["Colunas"]), width="stretch")
+
+def sheet_partials(dataset, nome, cols, values, mask):
+    """
+    Estatísticas por grupo (GroupPartial) das linhas de `mask`, combinadas a
+    partir de uma parcial por aba da planilha. Cada parcial fica em cache
+    pelo hash da aba (não do arquivo): quando a mesma pasta de trabalho volta
+    com uma aba nova, só a aba nova é calculada e o resto só é combinado.
+    `values()` devolve os valores (alinhados às linhas do dataset).
+    """
+    index = dataset.index
+    abas = [aba for aba, _ in dataset.sheets]
+    if not abas or COL_PLANILHA not in index or set(abas) != set(index.values(COL_PLANILHA)):
+        return partial_stats(index, cols, values(), mask)
+    calculados = []
+
+    def valores():
+        # calculados no máximo uma vez, e só se alguma aba não estiver em cache
+        if not calculados:
+            calculados.append(values())
+        return calculados[0]
+
+    cache = get_results_cache()
+    partes = []
+    for aba, hash_aba in dataset.sheets:
+        chave = (hash_aba, nome, tuple(cols), tuple(dataset.core.columns))
+        partes.append(cache.get_or_compute(chave, lambda aba=aba: partial_stats(
+            index, cols, valores(), mask & index.mask({COL_PLANILHA: aba}))))
+    return merge_partials(partes, index.dtypes)
+
+def partial_summary(parcial, acima, chaves):
+    """
+    Estatísticas (mean/max/min/count/sum/above/below) por grupo a partir de
+    uma parcial e das contagens de alunos acima da média global (`acima`).
+    """
+    estatisticas = parcial.keys.assign(mean=parcial.mean, max=parcial.max, min=parcial.min,
+                                       count=parcial.count, sum=parcial.sum)
+    estatisticas = estatisticas.merge(acima, on=chaves, how="left")
+    estatisticas["above"] = estatisticas["above"].fillna(0).astype(np.int64)
+    estatisticas["below"] = estatisticas["count"] - estatisticas["above"]
+    return estatisticas
+
+def general_performance_summary(dataset, extras=False):
+    """
+    Resumo por Turma / Série / Ano e média por ano de cada turma-série.
+    Com `extras`, o resumo inclui também a mediana e o desvio padrão.
+    """
+    chaves = [COL_TURMA, COL_SERIE, COL_ANO]
+
+    # Estatísticas por (turma, série, ano) da média do aluno (já calculada na
+    # leitura), apenas das linhas válidas (sem notas ausentes); já sai
+    # ordenado: Turma → Série → Ano
+    if isinstance(dataset, StreamedDataset):
+        # CSV lido em blocos: parciais e contagens já combinadas na leitura
+        # (sem os valores de cada aluno, não há mediana/desvio)
+        estatisticas = partial_summary(dataset.general, dataset.above, chaves)
+        extras = False
+    elif extras:
+        core = dataset.core
+        # mediana/desvio precisam de todos os valores: uma passada sobre os códigos
+        media_global = core.global_mean
+        estatisticas = group_summary(dataset.index, chaves, core.means, mask=core.valid,
+                                     threshold=media_global, median=True, std=True)
+    else:
+        core = dataset.core
+        # média/máx/mín/contagem combinadas das parciais de cada aba
+        parcial = sheet_partials(dataset, "resumo_turma_serie_ano", chaves, lambda: core.means, core.valid)
+        # média de todos os alunos válidos, não só dos que têm as três chaves
+        media_global = core.global_mean
+        # acima/abaixo dependem da média global: contagem direta pelo índice
+        acima = dataset.index.group_counts(chaves, core.valid & (core.means > media_global), name="above")
+        estatisticas = partial_summary(parcial, acima, chaves)
+
+    colunas = ["mean", "max", "min", "count", "above", "below"] + (["median", "std"] if extras else [])
+    resumo = estatisticas[chaves + colunas].rename(
+        columns={"above": "Acima da média", "below": "Abaixo da média"})
+
+    # Média por ano de cada turma-série, derivada das somas/contagens do resumo
+    serie_media = pd.DataFrame({
+        COL_ANO: estatisticas[COL_ANO],
+        "TURMA_SÉRIE": estatisticas[COL_TURMA].astype(str) + " - " + estatisticas[COL_SERIE].astype(str),
+        "sum": estatisticas["sum"],
+        "count": estatisticas["count"],
+    }).groupby([COL_ANO, "TURMA_SÉRIE"]).sum().reset_index()
+    serie_media["MÉDIA GERAL"] = serie_media.pop("sum") / serie_media.pop("count")
+    return resumo, serie_media
+
+def general_performance(dataset):
     st.subheader("Desempenho Geral")
 
-    # Selecionar colunas de notas
-    col_notas = [
-        "NOTAS - LP", "NOTAS - LI", "NOTAS - BIO", "NOTAS - FÍS", "NOTAS - QUÍ",
-        "NOTAS - MAT", "NOTAS - GEO", "NOTAS - HIS", "NOTAS - FIL", "NOTAS - SOC"
-    ]
-
-    # Filtrar somente linhas válidas
-    df_notas = df.dropna(subset=col_notas).copy()
-
-    # Calcular média do aluno
-    df_notas["MÉDIA GERAL"] = df_notas[col_notas].mean(axis=1)
-
-    # Agrupar por turma, série e ano
-    agrupado = (
-        df_notas.groupby(
-            ["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"]
-        )["MÉDIA GERAL"]
-        .agg(["mean", "max", "min", "count"])
-        .reset_index()
-    )
-
-    # Adicionar quantidade de alunos acima e abaixo da média geral
-    media_global = df_notas["MÉDIA GERAL"].mean()
-    acima_media = (
-        df_notas[df_notas["MÉDIA GERAL"] > media_global]
-        .groupby(["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"])
-        .size()
-        .reset_index(name="Acima da média")
-    )
-    abaixo_media = (
-        df_notas[df_notas["MÉDIA GERAL"] <= media_global]
-        .groupby(["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"])
-        .size()
-        .reset_index(name="Abaixo da média")
-    )
-
-    # Combinar tudo
-    resumo = (
-        agrupado
-        .merge(acima_media, on=["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"], how="left")
-        .merge(abaixo_media, on=["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"], how="left")
-    )
-
-    # Ordenar conforme solicitado: Turma → Série → Ano
-    resumo = resumo.sort_values(
-        by=["DADOS GERAIS - TURMA", "DADOS GERAIS - SERIE_ANO", "DADOS GERAIS - ANO"],
-        ascending=[True, True, True]
-    ).reset_index(drop=True)
+    # lido em blocos, não há os valores de cada aluno para mediana/desvio
+    streaming = isinstance(dataset, StreamedDataset)
+    extras = st.checkbox("Incluir mediana e desvio padrão", value=False, disabled=streaming,
+                         help="Indisponível para arquivos lidos em blocos." if streaming else None)
+    resumo, serie_media = cached_analysis(dataset, "desempenho_geral", (extras,),
+                                          lambda: general_performance_summary(dataset, extras))
 
     st.markdown("### Estatísticas por Turma / Série / Ano")
-    st.dataframe(resumo, use_container_width=True)
+    st.dataframe(resumo, width="stretch")
 
     # --- Gráfico de linha: média por turma e série ao longo dos anos ---
     st.markdown("### Evolução da Média por Turma e Série ao Longo dos Anos")
 
-    # Criar coluna combinando turma e série para identificar cada linha
-    df_notas["TURMA_SÉRIE"] = df_notas["DADOS GERAIS - TURMA"].astype(str) + " - " + df_notas[
-        "DADOS GERAIS - SERIE_ANO"].astype(str)
-
-    serie_media = (
-        df_notas.groupby(["DADOS GERAIS - ANO", "TURMA_SÉRIE"])["MÉDIA GERAL"]
-        .mean()
-        .reset_index()
-        .sort_values(["DADOS GERAIS - ANO", "TURMA_SÉRIE"])
-    )
-
-    fig, ax = plt.subplots(figsize=(12, 6))
-    for turma_serie, dados in serie_media.groupby("TURMA_SÉRIE"):
-        ax.plot(
-            dados["DADOS GERAIS - ANO"],
-            dados["MÉDIA GERAL"],
-            marker="o",
-            label=turma_serie
-        )
-
-    ax.set_xlabel("Ano do Calendário")
-    ax.set_ylabel("Média Geral")
-    ax.set_title("Evolução das Médias por Turma e Série")
-    ax.legend(title="Turma - Série", bbox_to_anchor=(1.05, 1), loc='upper left')
-    st.pyplot(fig)
-
-def subject_performance(df):
+    def desenhar():
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for turma_serie, dados in serie_media.groupby("TURMA_SÉRIE"):
+            ax.plot(
+                dados["DADOS GERAIS - ANO"],
+                dados["MÉDIA GERAL"],
+                marker="o",
+                label=turma_serie
+            )
+
+        ax.set_xlabel("Ano do Calendário")
+        ax.set_ylabel("Média Geral")
+        ax.set_title("Evolução das Médias por Turma e Série")
+        ax.legend(title="Turma - Série", bbox_to_anchor=(1.05, 1), loc='upper left')
+        return fig
+    show_figure(dataset, "evolucao_medias", (), desenhar)
+
+def subject_performance_stats(dataset):
+    """
+    Média e taxa de aprovação de cada disciplina em cada série, numa única
+    tabela (Série, Disciplina, Média, Aprovação (%)), com as disciplinas de
+    cada série ordenadas da maior para a menor média.
+    """
+    # --- Agrupado por série (alunos sem notas ausentes), combinando as abas ---
+    # notas e aprovação (nota >= 5.0) lado a lado: as médias das colunas de
+    # aprovação são as taxas de aprovação
+    if isinstance(dataset, StreamedDataset):
+        disciplinas, parcial = dataset.subjects, dataset.by_series
+    else:
+        core = dataset.core
+        disciplinas = core.subjects
+        parcial = sheet_partials(dataset, "disciplinas_por_serie", [COL_SERIE],
+                                 lambda: np.hstack([core.matrix, core.pass_mask]), core.valid)
+    n_disc = len(disciplinas)
+    medias = parcial.mean[:, :n_disc]
+    aprovacao = parcial.mean[:, n_disc:] * 100  # percentual de alunos com nota >= 5.0
+
+    series = parcial.keys[COL_SERIE].to_numpy(dtype=object)
+    tabela = pd.DataFrame({
+        "Série": np.repeat(series, n_disc),
+        "Disciplina": np.tile(np.asarray(disciplinas, dtype=object), len(series)),
+        "Média": medias.ravel(),
+        "Aprovação (%)": aprovacao.ravel(),
+    }, index=np.tile(np.arange(n_disc), len(series)))
+    ordem = np.lexsort((-tabela["Média"].to_numpy(), np.repeat(np.arange(len(series)), n_disc)))
+    return tabela.iloc[ordem]
+
+def subject_performance(dataset):
     st.subheader("Desempenho por Disciplina")
 
-    # --- Colunas de notas ---
-    col_notas = [
-        "NOTAS - LP", "NOTAS - LI", "NOTAS - BIO", "NOTAS - FÍS", "NOTAS - QUÍ",
-        "NOTAS - MAT", "NOTAS - GEO", "NOTAS - HIS", "NOTAS - FIL", "NOTAS - SOC"
-    ]
-
-    # --- Limpeza e preparação ---
-    df_notas = df.dropna(subset=col_notas).copy()
-
-    # Converter notas para numérico (caso venham como texto)
-    for c in col_notas:
-        df_notas[c] = pd.to_numeric(df_notas[c], errors="coerce")
-
-    # --- Cálculo da média e taxa de aprovação por disciplina e série ---
-    lista_series = sorted(df_notas["DADOS GERAIS - SERIE_ANO"].dropna().unique().tolist())
+    tabela = cached_analysis(dataset, "desempenho_disciplina", (),
+                             lambda: subject_performance_stats(dataset))
 
-    for serie in lista_series:
+    # a renderização só lê a tabela já calculada, série a série
+    for serie, df_estat in tabela.groupby("Série", sort=False):
+        df_estat = df_estat.drop(columns="Série")
         st.markdown(f"### 🏫 {serie}")
 
-        df_serie = df_notas[df_notas["DADOS GERAIS - SERIE_ANO"] == serie].copy()
-
-        estatisticas = []
-        for col in col_notas:
-            media = df_serie[col].mean()
-            taxa_aprov = (df_serie[col] >= 5.0).mean() * 100  # percentual de alunos com nota >= 50
-            estatisticas.append({"Disciplina": col.replace("NOTAS - ", ""), "Média": media, "Aprovação (%)": taxa_aprov})
-
-        df_estat = pd.DataFrame(estatisticas).sort_values(by="Média", ascending=False)
-
         # --- Exibir tabela resumida ---
-        st.dataframe(df_estat, use_container_width=True)
+        st.dataframe(df_estat, width="stretch")
 
         # --- Gráfico de barras horizontais ---
-        fig, ax1 = plt.subplots(figsize=(10, 5))
-        ax1.barh(df_estat["Disciplina"], df_estat["Média"], color="steelblue")
-        ax1.set_xlabel("Média das Notas")
-        ax1.set_ylabel("Disciplina")
-        ax1.set_title(f"Média das Notas - {serie}")
-        ax1.invert_yaxis()  # maior média no topo
-        st.pyplot(fig)
+        def desenhar_medias(df_estat=df_estat, serie=serie):
+            fig, ax1 = plt.subplots(figsize=(10, 5))
+            ax1.barh(df_estat["Disciplina"], df_estat["Média"], color="steelblue")
+            ax1.set_xlabel("Média das Notas")
+            ax1.set_ylabel("Disciplina")
+            ax1.set_title(f"Média das Notas - {serie}")
+            ax1.invert_yaxis()  # maior média no topo
+            return fig
+        show_figure(dataset, "medias_disciplina", (serie,), desenhar_medias)
 
         # --- Gráfico extra: taxa de aprovação ---
-        fig2, ax2 = plt.subplots(figsize=(10, 5))
-        ax2.barh(df_estat["Disciplina"], df_estat["Aprovação (%)"], color="seagreen")
-        ax2.set_xlabel("Taxa de Aprovação (%)")
-        ax2.set_ylabel("Disciplina")
-        ax2.set_title(f"Taxa de Aprovação - {serie}")
-        ax2.invert_yaxis()
-        st.pyplot(fig2)
-
-def dispersal(df):
-    st.subheader("Dispersão de Notas e Outliers")
-
-    # --- Colunas de notas ---
-    col_notas = [
-        "NOTAS - LP", "NOTAS - LI", "NOTAS - BIO", "NOTAS - FÍS", "NOTAS - QUÍ",
-        "NOTAS - MAT", "NOTAS - GEO", "NOTAS - HIS", "NOTAS - FIL", "NOTAS - SOC"
-    ]
-
-    # Verificar existência das colunas de nota
-    faltantes = [c for c in col_notas if c not in df.columns]
-    if len(faltantes) == len(col_notas):
-        st.error("Nenhuma das colunas de NOTAS foi encontrada no DataFrame. Verifique os nomes das colunas.")
-        return
-    # manter apenas colunas existentes
-    col_notas = [c for c in col_notas if c in df.columns]
-
-    # --- Identificador do aluno (coluna potencial) ---
+        def desenhar_aprovacao(df_estat=df_estat, serie=serie):
+            fig2, ax2 = plt.subplots(figsize=(10, 5))
+            ax2.barh(df_estat["Disciplina"], df_estat["Aprovação (%)"], color="seagreen")
+            ax2.set_xlabel("Taxa de Aprovação (%)")
+            ax2.set_ylabel("Disciplina")
+            ax2.set_title(f"Taxa de Aprovação - {serie}")
+            ax2.invert_yaxis()
+            return fig2
+        show_figure(dataset, "aprovacao_disciplina", (serie,), desenhar_aprovacao)
+
+def student_id_column(df):
+    """Coluna que identifica o aluno, ou None se não houver nenhuma conhecida."""
     possible_id_cols = [
         "DADOS GERAIS - CD_ALUNO_ANONIMIZADO",
         "DADOS GERAIS - Nº CHAMADA",
@@ -258,121 +555,229 @@ def dispersal(df):
         "ALUNO",
         "DADOS GERAIS - ALUNO"
     ]
-    id_col = None
     for c in possible_id_cols:
         if c in df.columns:
-            id_col = c
-            break
+            return c
+    return None
+
+# opções do seletor de quantis da aba Dispersão -> modo de sketches.use_sketch
+QUANTILE_OPTIONS = {"Automático": "auto", "Exatos": "exato", "Aproximados (esboço)": "esboço"}
+
+def draw_boxplot_stats(ax, estatisticas, palette=False):
+    """
+    Boxplots horizontais (primeiro no topo) a partir de estatísticas prontas,
+    no estilo do sns.boxplot (`palette`: uma cor por caixa, como nos dados largos).
+    """
+    linhas = {"color": "#3f3f3f", "linewidth": 1}
+    caixas = ax.bxp(estatisticas, orientation="horizontal", patch_artist=True, showfliers=True, widths=0.8,
+                    boxprops=linhas, whiskerprops=linhas, capprops=linhas, medianprops=linhas,
+                    flierprops={"markeredgecolor": "#3f3f3f"})
+    cores = sns.color_palette(n_colors=len(estatisticas)) if palette else [sns.color_palette()[0]]
+    for i, caixa in enumerate(caixas["boxes"]):
+        caixa.set_facecolor(cores[i % len(cores)])
+    ax.invert_yaxis()
+
+def sketch_selection(dataset, filtros, selecao, limites, progress=_no_progress):
+    """
+    Parte da seleção da aba Dispersão que sai do esboço de quantis: limites
+    do IQR (por disciplina ou, por turma/série, por aluno) e estatísticas dos
+    boxplots das notas e das médias por turma, sem ordenar as notas.
+    """
+    core = dataset.core
+    esboco = dataset.sketch
+    n_disc = len(core.subjects)
+    grupos = esboco.groups(filtros)
+
+    coluna = {"Por turma": COL_TURMA, "Por série": COL_SERIE}.get(limites)
+    if coluna is None:
+        _, _, lower, upper = esboco.fences(grupos)
+        limites_iqr = (lower[:n_disc], upper[:n_disc])
+    else:
+        # limites do grupo de cada aluno da seleção (alunos sem o grupo: sem limites)
+        valores, lower, upper = esboco.fences_by(coluna, grupos)
+        posicao = pd.Index(valores).get_indexer(core.labels[coluna])
+        codigos = core.codes[coluna][selecao]
+        linha = np.where(codigos >= 0, posicao[codigos], -1)
+        com_grupo = linha >= 0
+        limites_iqr = tuple(np.where(com_grupo[:, None], limite[linha, :n_disc], np.nan)
+                            for limite in (lower, upper))
+
+    return (limites_iqr,) + sketch_boxplots(esboco, grupos, progress)
+
+def sketch_boxplots(esboco, grupos, progress=_no_progress):
+    """
+    Estatísticas (Axes.bxp) dos boxplots das notas e das médias por turma nos
+    grupos do esboço; `progress(fração, mensagem)` é chamado a cada turma.
+    """
+    disciplinas = [c for c in esboco.columns if c != COL_MEDIA_ALUNO]
+    caixas_notas = esboco.boxplot_stats(grupos, columns=disciplinas)
+    turmas = sorted(esboco.keys.loc[grupos, COL_TURMA].dropna().unique().tolist())
+    caixas_medias = []
+    for i, turma in enumerate(turmas):
+        progress(i / len(turmas), f"boxplot da turma {turma}")
+        caixas_medias += esboco.boxplot_stats(grupos & (esboco.keys[COL_TURMA] == turma).to_numpy(),
+                                              columns=[COL_MEDIA_ALUNO], labels=[turma])
+    return caixas_notas, caixas_medias
+
+def dispersal_selection(dataset, serie_sel, ano_sel, turma_sel, limites="Seleção", quantis="Automático",
+                        progress=_no_progress):
+    """
+    Dados da aba Dispersão para uma seleção (série, ano, turma): notas da
+    seleção (uma coluna por disciplina), tabela de outliers (ou None) e
+    médias por aluno. `limites` define onde os limites do IQR são calculados
+    (na seleção inteira, por turma ou por série).
+    Com os quantis do esboço (`quantis`, ver sketches.use_sketch), notas e
+    médias vêm como estatísticas prontas de boxplot (Axes.bxp) e o último
+    item do retorno é True.
+    `progress(fração, mensagem)` é chamado entre as disciplinas e as turmas
+    (ver background_analysis). Retorna None se a seleção não tiver alunos.
+    """
+    df = dataset.df
+    core = dataset.core
+    col_serie, col_ano, col_turma = COL_SERIE, COL_ANO, COL_TURMA
+
+    # Aplicar filtros de seleção pelo índice (máscara por posição, alinhada ao core)
+    filtros = {col_serie: serie_sel, col_ano: ano_sel, col_turma: turma_sel}
+    filtros = {col: v for col, v in filtros.items() if v != "Todos"}
+    selecao = dataset.index.mask(filtros)
+    if not selecao.any():
+        return None
+    aproximado = dataset.sketch is not None and use_sketch(int(selecao.sum()), QUANTILE_OPTIONS[quantis])
+
+    # --- Identificador do aluno (coluna potencial) ---
+    id_col = student_id_column(df)
+    info = df.loc[selecao, [c for c in (id_col, col_turma, col_serie, col_ano) if c is not None]]
     if id_col is None:
-        # criar coluna de id a partir do índice
-        df = df.reset_index(drop=True)
-        df["ALUNO_ID"] = df.index.astype(str)
+        # criar id a partir da posição do aluno no DataFrame
         id_col = "ALUNO_ID"
+        info = info.assign(ALUNO_ID=np.flatnonzero(selecao).astype(str))
+
+    # notas da seleção direto da matriz (as notas já chegam como float32)
+    matriz = core.matrix[selecao]
+
+    # --- Outliers de todas as disciplinas (regra Q1/Q3) ---
+    progress(0.05, "selecionando os alunos")
+    if aproximado:
+        # limites e boxplots a partir do esboço montado na leitura
+        limites_iqr, notas, caixas_medias = sketch_selection(
+            dataset, filtros, selecao, limites, lambda f, msg: progress(0.1 + 0.6 * f, msg))
+        codigos = None
+    else:
+        limites_iqr = None
+        notas = pd.DataFrame(matriz, columns=core.subjects)
+        grupos = {"Por turma": col_turma, "Por série": col_serie}.get(limites)
+        codigos = core.codes[grupos][selecao] if grupos else None
+    # em segundo plano, limites disciplina a disciplina (pontos de cancelamento); senão, de uma vez
+    progresso_limites = None
+    if progress is not _no_progress:
+        def progresso_limites(fracao, mensagem):
+            progress(0.7 + 0.2 * fracao, mensagem)
+    df_outliers = find_outliers(info, matriz, core.subjects,
+                                [id_col, col_turma, col_serie, col_ano], group_codes=codigos,
+                                fences=limites_iqr, progress=progresso_limites)
+    progress(0.9, "montando a tabela de outliers")
+    if df_outliers.empty:
+        df_outliers = None
+    else:
+        df_outliers = df_outliers.sort_values([col_turma, col_serie, col_ano])
+
+    if aproximado:
+        return notas, df_outliers, caixas_medias, True
+    # média por aluno (calculada uma vez na leitura)
+    df_medias = pd.DataFrame({col_turma: info[col_turma], "MÉDIA_GERAL_ALUNO": core.means[selecao]})
+    return notas, df_outliers, df_medias, False
+
+def dispersal(dataset):
+    st.subheader("Dispersão de Notas e Outliers")
 
-    # --- Conversão das notas para numérico ---
-    df_notas = df.copy()
-    for c in col_notas:
-        df_notas[c] = pd.to_numeric(df_notas[c], errors="coerce")
+    df = dataset.df
+    core = dataset.core
+
+    # --- Colunas de notas (apenas as existentes) ---
+    col_notas = core.columns
+    if not col_notas:
+        st.error("Nenhuma das colunas de NOTAS foi encontrada no DataFrame. Verifique os nomes das colunas.")
+        return
 
     # Seletores (defensivos: verificar existência das colunas de agrupamento)
-    col_serie = "DADOS GERAIS - SERIE_ANO"
-    col_ano = "DADOS GERAIS - ANO"
-    col_turma = "DADOS GERAIS - TURMA"
+    col_serie = COL_SERIE
+    col_ano = COL_ANO
+    col_turma = COL_TURMA
 
     for col in (col_serie, col_ano, col_turma):
-        if col not in df_notas.columns:
+        if col not in df.columns:
             st.error(f"Coluna obrigatória ausente: {col}. Não é possível gerar dispersão.")
             return
 
     # Opcional: permitir seleção (ou usar todos)
-    serie_sel = st.selectbox("Selecione a série (ou Todos)",
-                             ["Todos"] + sorted(df_notas[col_serie].dropna().unique().tolist()))
-    ano_sel = st.selectbox("Selecione o ano (ou Todos)",
-                           ["Todos"] + sorted(df_notas[col_ano].dropna().unique().tolist()))
-    turma_sel = st.selectbox("Selecione a turma (ou Todos)",
-                             ["Todos"] + sorted(df_notas[col_turma].dropna().unique().tolist()))
-
-    # Aplicar filtros de seleção
-    df_filtro = df_notas.copy()
-    if serie_sel != "Todos":
-        df_filtro = df_filtro[df_filtro[col_serie] == serie_sel]
-    if ano_sel != "Todos":
-        df_filtro = df_filtro[df_filtro[col_ano] == ano_sel]
-    if turma_sel != "Todos":
-        df_filtro = df_filtro[df_filtro[col_turma] == turma_sel]
-
-    if df_filtro.empty:
+    serie_sel = st.selectbox("Selecione a série (ou Todos)", ["Todos"] + dataset.index.values(col_serie))
+    ano_sel = st.selectbox("Selecione o ano (ou Todos)", ["Todos"] + dataset.index.values(col_ano))
+    turma_sel = st.selectbox("Selecione a turma (ou Todos)", ["Todos"] + dataset.index.values(col_turma))
+    limites = st.selectbox("Limites do IQR calculados", ["Seleção", "Por turma", "Por série"],
+                           help="Onde Q1/Q3 são calculados: na seleção inteira ou separadamente em cada grupo.")
+    quantis = st.selectbox("Quantis", list(QUANTILE_OPTIONS),
+                           help=f"Automático: exatos abaixo de {SKETCH_MIN_ROWS} alunos na seleção; a partir "
+                                "disso, do esboço montado na leitura (erro menor que 0,01 ponto nos quartis).")
+
+    resultado = background_analysis(dataset, "dispersao", (serie_sel, ano_sel, turma_sel, limites, quantis),
+                                    lambda progress: dispersal_selection(dataset, serie_sel, ano_sel, turma_sel,
+                                                                         limites, quantis, progress),
+                                    "Dispersão")
+    if resultado is JOB_PENDING:
+        return
+    if resultado is None:
         st.warning("Nenhum dado encontrado para os filtros selecionados.")
         return
+    notas, df_outliers, df_medias, aproximado = resultado
+    if aproximado:
+        st.caption("Quartis, limites do IQR e boxplots calculados pelo esboço de quantis "
+                   "(erro menor que 0,01 ponto nos quartis).")
 
     # --- Boxplot por disciplina (mostra outliers) ---
     st.markdown("### 📘 Boxplots por Disciplina (outliers mostrados)")
 
-    # melt para long format
-    melted = df_filtro.melt(
-        id_vars=[id_col, col_turma, col_serie, col_ano],
-        value_vars=col_notas,
-        var_name="Disciplina",
-        value_name="Nota"
-    )
-
-    # limpar nome da disciplina para exibir
-    melted["Disciplina"] = melted["Disciplina"].str.replace("NOTAS - ", "").str.strip()
-
     # plot: um boxplot por disciplina (horizontal)
-    fig, ax = plt.subplots(figsize=(12, max(4, len(col_notas) * 0.6)))
-    sns.boxplot(data=melted, x="Nota", y="Disciplina", orient="h", ax=ax, showfliers=True)
-    ax.set_title(f"Dispersão das Notas por Disciplina — Série: {serie_sel} | Turma: {turma_sel} | Ano: {ano_sel}")
-    ax.set_xlabel("Nota")
-    ax.set_ylabel("Disciplina")
-    st.pyplot(fig)
+    def desenhar_notas():
+        fig, ax = plt.subplots(figsize=(12, max(4, len(col_notas) * 0.6)))
+        if aproximado:
+            draw_boxplot_stats(ax, notas, palette=True)
+        else:
+            sns.boxplot(data=notas, orient="h", ax=ax, showfliers=True)
+        ax.set_title(f"Dispersão das Notas por Disciplina — Série: {serie_sel} | Turma: {turma_sel} | Ano: {ano_sel}")
+        ax.set_xlabel("Nota")
+        ax.set_ylabel("Disciplina")
+        return fig
+    show_figure(dataset, "boxplot_notas", (serie_sel, ano_sel, turma_sel, aproximado), desenhar_notas,
+                background=True)
 
     # --- Identificar outliers por disciplina (Q1/Q3 rule) ---
     st.markdown("#### 🔎 Alunos identificados como outliers (por disciplina)")
 
-    outlier_rows = []
-    for disc in melted["Disciplina"].unique():
-        sub = melted[melted["Disciplina"] == disc].dropna(subset=["Nota"])
-        if sub.empty:
-            continue
-        q1 = sub["Nota"].quantile(0.25)
-        q3 = sub["Nota"].quantile(0.75)
-        iqr = q3 - q1
-        lower = q1 - 1.5 * iqr
-        upper = q3 + 1.5 * iqr
-        out = sub[(sub["Nota"] < lower) | (sub["Nota"] > upper)]
-        if not out.empty:
-            # pegar algumas colunas úteis para identificar
-            for _, r in out.iterrows():
-                outlier_rows.append({
-                    "Disciplina": disc,
-                    id_col: r[id_col],
-                    col_turma: r[col_turma],
-                    col_serie: r[col_serie],
-                    col_ano: r[col_ano],
-                    "Nota": r["Nota"],
-                    "Tipo": "Acima" if r["Nota"] > upper else "Abaixo"
-                })
-
-    if outlier_rows:
-        df_outliers = pd.DataFrame(outlier_rows).sort_values([col_turma, col_serie, col_ano])
-        st.dataframe(df_outliers, use_container_width=True)
+    if df_outliers is not None:
+        st.dataframe(df_outliers, width="stretch")
     else:
         st.info("Nenhum outlier detectado nas disciplinas com base na regra IQR (1.5 * IQR).")
 
     # --- Boxplot final: médias por aluno (por turma) ---
     st.markdown("### 📗 Boxplot das Médias por Aluno (por Turma)")
 
-    # calcular média por aluno usando as colunas de nota
-    df_filtro["MÉDIA_GERAL_ALUNO"] = df_filtro[col_notas].mean(axis=1)
-
     # boxplot das médias, agrupado por turma (horizontal)
-    fig2, ax2 = plt.subplots(figsize=(12, max(4, len(df_filtro[col_turma].unique()) * 0.6)))
-    sns.boxplot(data=df_filtro, x="MÉDIA_GERAL_ALUNO", y=col_turma, orient="h", ax=ax2, showfliers=True)
-    ax2.set_title(f"Dispersão das Médias por Turma — Série: {serie_sel} | Ano: {ano_sel}")
-    ax2.set_xlabel("Média Geral do Aluno")
-    ax2.set_ylabel("Turma")
-    st.pyplot(fig2)
+    # (só as turmas presentes no filtro; a coluna é categórica)
+    def desenhar_medias():
+        if aproximado:
+            fig2, ax2 = plt.subplots(figsize=(12, max(4, len(df_medias) * 0.6)))
+            draw_boxplot_stats(ax2, df_medias)
+        else:
+            turmas = sorted(df_medias[col_turma].dropna().unique().tolist())
+            fig2, ax2 = plt.subplots(figsize=(12, max(4, len(turmas) * 0.6)))
+            sns.boxplot(data=df_medias, x="MÉDIA_GERAL_ALUNO", y=col_turma, order=turmas, orient="h", ax=ax2,
+                        showfliers=True)
+        ax2.set_title(f"Dispersão das Médias por Turma — Série: {serie_sel} | Ano: {ano_sel}")
+        ax2.set_xlabel("Média Geral do Aluno")
+        ax2.set_ylabel("Turma")
+        return fig2
+    show_figure(dataset, "boxplot_medias", (serie_sel, ano_sel, turma_sel, aproximado), desenhar_medias,
+                background=True)
 
     st.markdown("""
         **Interpretação**:
@@ -381,50 +786,230 @@ def dispersal(df):
         - Use a tabela de outliers para identificar os alunos e verificar se há problemas/erros de entrada.
         """)
 
-def cluster_analysis(df):
-    st.subheader("Análise em Cluster")
+def streamed_dispersal(dataset):
+    """
+    Dispersão de um CSV lido em blocos: quartis e boxplots das notas e da
+    média do aluno na seleção, a partir dos esboços de quantis (erro < 0,01
+    na nota).
+    """
+    st.subheader("Dispersão de Notas")
+    chaves = dataset.sketch.keys
+    filtros = {}
+    for col, rotulo in ((COL_SERIE, "Selecione a série (ou Todos)"), (COL_ANO, "Selecione o ano (ou Todos)"),
+                        (COL_TURMA, "Selecione a turma (ou Todos)")):
+        valores = sorted(chaves[col].dropna().unique().tolist())
+        filtros[col] = st.selectbox(rotulo, ["Todos"] + valores)
+
+    selecao = {col: v for col, v in filtros.items() if v != "Todos"}
+
+    def quartis():
+        grupos = dataset.sketch.groups(selecao)
+        tabela = dataset.sketch.quantiles([0, 0.25, 0.5, 0.75, 1], grupos)
+        tabela.columns = ["Mínimo", "Q1", "Mediana", "Q3", "Máximo"]
+        tabela.insert(0, "Alunos", dataset.sketch.count(grupos))
+        tabela = tabela.rename_axis("Disciplina").rename(index={COL_MEDIA_ALUNO: "MÉDIA GERAL DO ALUNO"})
+        return (tabela,) + sketch_boxplots(dataset.sketch, grupos)
+
+    tabela, caixas_notas, caixas_medias = cached_analysis(dataset, "dispersao_quartis",
+                                                          tuple(filtros.values()), quartis)
+    if not tabela["Alunos"].any():
+        st.warning("Nenhum dado encontrado para os filtros selecionados.")
+        return
+    st.caption("Arquivo lido em blocos: quartis aproximados (erro menor que 0,01 ponto); "
+               "a lista de alunos outliers não está disponível.")
+    st.dataframe(tabela, width="stretch")
+
+    st.markdown("### 📘 Boxplots por Disciplina (outliers mostrados)")
+
+    def desenhar_notas():
+        fig, ax = plt.subplots(figsize=(12, max(4, len(caixas_notas) * 0.6)))
+        draw_boxplot_stats(ax, caixas_notas, palette=True)
+        ax.set_title("Dispersão das Notas por Disciplina — Série: {} | Turma: {} | Ano: {}".format(
+            filtros[COL_SERIE], filtros[COL_TURMA], filtros[COL_ANO]))
+        ax.set_xlabel("Nota")
+        ax.set_ylabel("Disciplina")
+        return fig
+    show_figure(dataset, "boxplot_notas", tuple(filtros.values()), desenhar_notas)
 
+    st.markdown("### 📗 Boxplot das Médias por Aluno (por Turma)")
+
+    def desenhar_medias():
+        fig, ax = plt.subplots(figsize=(12, max(4, len(caixas_medias) * 0.6)))
+        draw_boxplot_stats(ax, caixas_medias)
+        ax.set_title(f"Dispersão das Médias por Turma — Série: {filtros[COL_SERIE]} | Ano: {filtros[COL_ANO]}")
+        ax.set_xlabel("Média Geral do Aluno")
+        ax.set_ylabel("Turma")
+        return fig
+    show_figure(dataset, "boxplot_medias", tuple(filtros.values()), desenhar_medias)
+
+@st.cache_resource
+def get_cluster_engine():
+    """Motor de clusterização compartilhado (modelos em memória e em disco)."""
+    return ClusterEngine()
+
+def cluster_features(dataset, features):
+    """Matriz (linhas válidas x colunas escolhidas) usada na clusterização."""
+    core = dataset.core
+    if list(features) == core.columns:
+        return core.matrix[core.valid]
+    colunas = []
+    for col in features:
+        if col in core.columns:
+            colunas.append(core.matrix[core.valid, core.columns.index(col)])
+        else:
+            colunas.append(dataset.df[col].to_numpy(dtype=np.float32)[core.valid])
+    return np.column_stack(colunas)
+
+def cluster_model(dataset, features, k, seed, chave_salva=None, progress=None):
+    """
+    Clusteriza os alunos; retorna (df_proc com 'Cluster', componentes, modelo).
+    Com `chave_salva`, atribui os alunos a um modelo salvo (predict) sem reajustar.
+    `progress(fração, mensagem)` acompanha o ajuste (ver background_analysis).
+    """
+    progress = progress or _no_progress
     # =========================================
     # 1. Preparação dos dados
     # =========================================
-    df_proc = df.copy()
+    df = dataset.df
+    core = dataset.core
 
     coluna_idade = "DADOS GERAIS - IDADE"
-    colunas_notas = [
-        'NOTAS - LP', 'NOTAS - LI', 'NOTAS - BIO', 'NOTAS - FÍS',
-        'NOTAS - QUÍ', 'NOTAS - MAT', 'NOTAS - GEO', 'NOTAS - HIS', 'NOTAS - FIL', 'NOTAS - SOC'
-    ]
+    colunas_notas = core.columns
 
-    df_numerico = df_proc[colunas_notas].dropna()
+    dados = cluster_features(dataset, features)
 
-    # =========================================
-    # 2. Padronização
-    # =========================================
-    scaler = StandardScaler()
-    dados_padronizados = scaler.fit_transform(df_numerico)
+    # apenas as colunas usadas nos gráficos, alinhadas às linhas válidas
+    df_proc = pd.DataFrame(core.matrix[core.valid], columns=colunas_notas)
+    for col in (coluna_idade, "DADOS GERAIS - PERIODO"):
+        if col in df.columns:
+            df_proc[col] = df[col].to_numpy()[core.valid]
 
     # =========================================
-    # 3. Escolha automática do número de clusters (k=3 por enquanto)
+    # 2-4. Padronização, KMeans e PCA (memorizados por dataset + parâmetros)
     # =========================================
-    k = 3
-    modelo = KMeans(n_clusters=k, random_state=42)
-    df_proc['Cluster'] = modelo.fit_predict(dados_padronizados)
+    engine = get_cluster_engine()
+    progress(0.0, "ajustando o modelo")
+    modelo = engine.load(chave_salva) if chave_salva else None
+    if modelo is None:
+        modelo = engine.get_model(dados, dataset.fingerprint, features, k, seed, progress=progress)
+    progress(0.9, "atribuindo os alunos aos clusters")
+
+    if modelo.fingerprint == dataset.fingerprint:
+        # mesmo dataset do ajuste: rótulos do próprio ajuste (= fit_predict)
+        df_proc['Cluster'] = modelo.fit_labels(dados)
+        componentes = modelo.project(dados)
+    else:
+        df_proc['Cluster'], componentes = assign_clusters(modelo, dados)
+    return df_proc, componentes, modelo
+
+# Maior k oferecido, no k manual e na faixa da varredura (o k escolhido vai para o mesmo campo)
+K_MAX = 15
+
+def cluster_analysis(dataset):
+    st.subheader("Análise em Cluster")
+
+    coluna_idade = "DADOS GERAIS - IDADE"
+    core = dataset.core
+    colunas_notas = core.columns
+    engine = get_cluster_engine()
+
+    # --- Parâmetros do modelo ---
+    opcoes_features = colunas_notas + [c for c in (coluna_idade,) if c in dataset.df.columns]
+    features = st.multiselect("Colunas usadas na clusterização", opcoes_features, default=colunas_notas,
+                              key="cluster_features")
+    if not features:
+        st.warning("Selecione ao menos uma coluna para a clusterização.")
+        return
+    # modelos salvos de outros datasets com as mesmas colunas
+    salvos = [m for m in engine.list_models(features) if m["fingerprint"] != dataset.fingerprint]
+    rotulos = {None: "Ajustar neste dataset"}
+    rotulos.update({m["key"]: f"Modelo salvo {m['key'][:8]} — k={m['k']}, {m['n_samples']} alunos"
+                    for m in salvos})
+    chave_salva = st.selectbox("Modelo", list(rotulos), format_func=rotulos.get, key="cluster_modelo",
+                               help="Um modelo salvo atribui os alunos aos clusters existentes, sem reajuste.")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        modo_k = st.radio("Escolha de k", ["Automática", "Manual"], horizontal=True, key="cluster_modo_k",
+                          disabled=chave_salva is not None)
+    with col2:
+        k = st.number_input("Número de clusters (k)", min_value=2, max_value=K_MAX, value=3, key="cluster_k",
+                            disabled=modo_k == "Automática" or chave_salva is not None)
+    with col3:
+        seed = st.number_input("Semente", min_value=0, value=42, step=1, key="cluster_seed")
 
     # =========================================
-    # 4. PCA para visualização 2D
+    # 3. Escolha automática do número de clusters (varredura de k em paralelo)
     # =========================================
-    st.markdown("### Visualização dos Clusters (PCA)")
-    pca = PCA(n_components=2)
-    componentes = pca.fit_transform(dados_padronizados)
+    if modo_k == "Automática" and chave_salva is None:
+        k_min, k_max = st.slider("Faixa de k avaliada", min_value=1, max_value=K_MAX, value=(1, 9),
+                                 key="cluster_faixa_k")
+        varredura = background_analysis(
+            dataset, "k_sweep", (tuple(features), int(seed), k_min, k_max),
+            lambda progress: sweep_k(cluster_features(dataset, features), range(k_min, k_max + 1),
+                                     seed=int(seed), standardize=True, progress=progress),
+            "Varredura de k",
+            # varredura cortada pelo tempo limite não fica em cache como definitiva
+            keep=lambda v: v.complete)
+        if varredura is JOB_PENDING:
+            return
+        if varredura.best_k is not None:
+            k = varredura.best_k
+        else:
+            st.warning(f"Nenhum k terminou dentro do tempo limite; usando k = {k} (ajuste manual).")
+        with st.expander(f"Curva de escolha de k — escolhido: {k} ({varredura.criterion})"):
+            if not varredura.complete:
+                st.warning(f"Tempo limite atingido; k não avaliados: {varredura.skipped}")
+            if varredura.sample_rows is not None:
+                st.caption(f"Varredura numa amostra de {varredura.sample_rows} alunos.")
+            curva = varredura.to_frame()
+            st.line_chart(curva["Inércia"])
+            st.line_chart(curva[["Silhouette"]])
+            st.dataframe(curva, width="stretch")
+
+    resultado = background_analysis(
+        dataset, "clusters", (tuple(features), int(k), int(seed), chave_salva),
+        lambda progress: cluster_model(dataset, features, int(k), int(seed), chave_salva, progress),
+        "Clusterização")
+    if resultado is JOB_PENDING:
+        return
+    df_proc, componentes, modelo = resultado
+    st.caption(f"Modelo {modelo.key[:8]} ({modelo.method}, k={modelo.k}, semente={modelo.seed}, "
+               f"ajustado com {modelo.n_samples} alunos) — ajustes: {engine.fits}, "
+               f"carregados do disco: {engine.disk_loads}")
 
-    fig1, ax1 = plt.subplots(figsize=(8, 6))
-    scatter = ax1.scatter(componentes[:, 0], componentes[:, 1], c=df_proc['Cluster'], cmap='viridis')
-    ax1.set_title('Clusters de Alunos (PCA - 2D)')
-    ax1.set_xlabel('Componente Principal 1')
-    ax1.set_ylabel('Componente Principal 2')
-    plt.colorbar(scatter, label='Cluster')
+    st.markdown("### Visualização dos Clusters (PCA)")
 
-    st.pyplot(fig1)
+    # gráficos do mesmo modelo (colunas, k, semente e modelo salvo) reaproveitam as imagens
+    parametros = (tuple(features), int(k), int(seed), chave_salva)
+
+    # muitos alunos: gráfico interativo (no navegador) com os pontos reduzidos
+    col_backend, col_reducao = st.columns(2)
+    with col_backend:
+        backend = st.selectbox("Gráfico", ["Automático", "Interativo", "Imagem"], key="cluster_backend",
+                               help=f"Automático: interativo acima de {SCATTER_MAX_POINTS} alunos.")
+    with col_reducao:
+        reducao = st.selectbox("Redução de pontos", ["amostra", "grade"], key="cluster_reducao",
+                               format_func={"amostra": "Amostra estratificada",
+                                            "grade": "Grade (contagem por célula)"}.get,
+                               help="Aplicada acima do limite de pontos; mantém as proporções de cada cluster.")
+    interativo = backend == "Interativo" or (backend == "Automático" and len(componentes) > SCATTER_MAX_POINTS)
+
+    if interativo:
+        grafico, descricao = cluster_scatter(componentes, df_proc['Cluster'].to_numpy(), reduction=reducao,
+                                             seed=int(seed))
+        st.altair_chart(grafico, width="stretch")
+        st.caption(f"Exibindo {descricao}.")
+    else:
+        def desenhar_pca():
+            fig1, ax1 = plt.subplots(figsize=(8, 6))
+            scatter = ax1.scatter(componentes[:, 0], componentes[:, 1], c=df_proc['Cluster'], cmap='viridis')
+            ax1.set_title('Clusters de Alunos (PCA - 2D)')
+            ax1.set_xlabel('Componente Principal 1')
+            ax1.set_ylabel('Componente Principal 2')
+            fig1.colorbar(scatter, ax=ax1, label='Cluster')
+            return fig1
+        show_figure(dataset, "clusters_pca", parametros, desenhar_pca)
 
     st.markdown("---")
 
@@ -436,14 +1021,16 @@ def cluster_analysis(df):
 
 
     st.markdown("### Média das disciplinas por cluster")
-    fig2, ax2 = plt.subplots(figsize=(10, 6))
-    media_disciplinas_clusters.T.plot(kind='bar', ax=ax2)
-    ax2.set_title('Média das Notas das Disciplinas por Cluster')
-    ax2.set_xlabel('Disciplinas')
-    ax2.set_ylabel('Média das notas')
-    ax2.legend(title='Cluster', bbox_to_anchor=(1, 1))
-    plt.tight_layout()
-    st.pyplot(fig2)
+    def desenhar_disciplinas():
+        fig2, ax2 = plt.subplots(figsize=(10, 6))
+        media_disciplinas_clusters.T.plot(kind='bar', ax=ax2)
+        ax2.set_title('Média das Notas das Disciplinas por Cluster')
+        ax2.set_xlabel('Disciplinas')
+        ax2.set_ylabel('Média das notas')
+        ax2.legend(title='Cluster', bbox_to_anchor=(1, 1))
+        fig2.tight_layout()
+        return fig2
+    show_figure(dataset, "clusters_disciplinas", parametros, desenhar_disciplinas)
 
     st.markdown("---")
 
@@ -454,18 +1041,20 @@ def cluster_analysis(df):
     st.dataframe(media_idade_cluster)
 
     st.markdown("### Média de idade por cluster")
-    fig3, ax3 = plt.subplots(figsize=(10, 6))
+    def desenhar_idade():
+        fig3, ax3 = plt.subplots(figsize=(10, 6))
 
-    # Aplicar cores diferentes para cada cluster
-    colors = plt.cm.viridis(np.linspace(0, 1, len(media_idade_cluster)))
+        # Aplicar cores diferentes para cada cluster
+        colors = plt.cm.viridis(np.linspace(0, 1, len(media_idade_cluster)))
 
-    media_idade_cluster.plot(kind='bar', ax=ax3, color=colors)
+        media_idade_cluster.plot(kind='bar', ax=ax3, color=colors)
 
-    ax3.set_title('Média da Idade por Cluster')
-    ax3.set_xlabel('Cluster')
-    ax3.set_ylabel('Idade (anos)')
-    plt.tight_layout()
-    st.pyplot(fig3)
+        ax3.set_title('Média da Idade por Cluster')
+        ax3.set_xlabel('Cluster')
+        ax3.set_ylabel('Idade (anos)')
+        fig3.tight_layout()
+        return fig3
+    show_figure(dataset, "clusters_idade", parametros, desenhar_idade)
 
     st.markdown("---")
 
@@ -479,35 +1068,33 @@ def cluster_analysis(df):
         dist_periodo = pd.crosstab(df_proc['DADOS GERAIS - PERIODO'], df_proc['Cluster'])
         st.dataframe(dist_periodo)
 
-        fig3, ax3 = plt.subplots(figsize=(8, 6))
-        dist_periodo.plot(kind='bar', ax=ax3)
-        ax3.set_title('Número de Alunos por Período em Cada Cluster')
-        ax3.set_xlabel('Período')
-        ax3.set_ylabel('Quantidade de Alunos')
-        ax3.legend(title='Cluster')
-        plt.tight_layout()
-
-        st.pyplot(fig3)
+        def desenhar_periodo():
+            fig4, ax4 = plt.subplots(figsize=(8, 6))
+            dist_periodo.plot(kind='bar', ax=ax4)
+            ax4.set_title('Número de Alunos por Período em Cada Cluster')
+            ax4.set_xlabel('Período')
+            ax4.set_ylabel('Quantidade de Alunos')
+            ax4.legend(title='Cluster')
+            fig4.tight_layout()
+            return fig4
+        show_figure(dataset, "clusters_periodo", parametros, desenhar_periodo)
     else:
         st.warning("⚠️ Coluna 'DADOS GERAIS - PERIODO' não encontrada no arquivo.")
 
-def manual_filter(df):
+def manual_filter(dataset):
     st.subheader("Filtragem Manual de Dados")
 
+    df = dataset.df if dataset is not None else None
     if df is None or df.empty:
         st.warning("Nenhum dado carregado.")
         return
 
-        # --- Preparação: calcular MÉDIA_GERAL se necessário ---
-    col_notas = [c for c in df.columns if c.startswith("NOTAS - ")]
-    if "MÉDIA_GERAL" not in df.columns:
-        df["MÉDIA_GERAL"] = df[col_notas].mean(axis=1, skipna=True)
-
     # Colunas fixas internas (não aparecem na lista de seleção)
-    col_turma = "DADOS GERAIS - TURMA"
-    col_serie = "DADOS GERAIS - SERIE_ANO"
-    col_ano = "DADOS GERAIS - ANO"
-    col_media = "MÉDIA_GERAL"
+    # (MÉDIA_GERAL vem das médias calculadas na leitura se não existir no arquivo)
+    col_turma = COL_TURMA
+    col_serie = COL_SERIE
+    col_ano = COL_ANO
+    col_media = COL_MEDIA
 
     # --- Construir mapeamento para exibição (display name) ---
     def display_name(col):
@@ -532,13 +1119,13 @@ def manual_filter(df):
     col1, col2, col3 = st.columns(3)
 
     with col1:
-        turma_vals = sorted(df[col_turma].dropna().unique().tolist()) if col_turma in df.columns else []
+        turma_vals = dataset.index.values(col_turma)
         filter_turma = st.multiselect("Turma", options=turma_vals)
     with col2:
-        serie_vals = sorted(df[col_serie].dropna().unique().tolist()) if col_serie in df.columns else []
+        serie_vals = dataset.index.values(col_serie)
         filter_serie = st.multiselect("Série", options=serie_vals)
     with col3:
-        ano_vals = sorted(df[col_ano].dropna().unique().tolist()) if col_ano in df.columns else []
+        ano_vals = dataset.index.values(col_ano)
         filter_ano = st.multiselect("Ano", options=ano_vals)
 
     # --- Filtros por matéria (lista de matérias mostrada sem prefixo) ---
@@ -572,43 +1159,6 @@ def manual_filter(df):
         val_media = st.number_input("Valor da média", step=0.1, key="val_media")
         media_cond = (op_media, val_media)
 
-    # --- Aplicar filtros ---
-    df_f = df.copy()
-    if filter_turma:
-        df_f = df_f[df_f[col_turma].isin(filter_turma)]
-    if filter_serie:
-        df_f = df_f[df_f[col_serie].isin(filter_serie)]
-    if filter_ano:
-        df_f = df_f[df_f[col_ano].isin(filter_ano)]
-
-    for real_col, (op, val) in condicoes_materia.items():
-        # garantir coluna numérica
-        df_f[real_col] = pd.to_numeric(df_f[real_col], errors="coerce")
-        if op == "<":
-            df_f = df_f[df_f[real_col] < val]
-        elif op == "≤":
-            df_f = df_f[df_f[real_col] <= val]
-        elif op == ">":
-            df_f = df_f[df_f[real_col] > val]
-        elif op == "≥":
-            df_f = df_f[df_f[real_col] >= val]
-        elif op == "=":
-            df_f = df_f[df_f[real_col] == val]
-
-    if media_cond:
-        op, val = media_cond
-        df_f[col_media] = pd.to_numeric(df_f[col_media], errors="coerce")
-        if op == "<":
-            df_f = df_f[df_f[col_media] < val]
-        elif op == "≤":
-            df_f = df_f[df_f[col_media] <= val]
-        elif op == ">":
-            df_f = df_f[df_f[col_media] > val]
-        elif op == "≥":
-            df_f = df_f[df_f[col_media] >= val]
-        elif op == "=":
-            df_f = df_f[df_f[col_media] == val]
-
     # --- Seleção de colunas para exibição ---
     st.markdown("### Colunas a exibir")
     st.caption(
@@ -640,21 +1190,31 @@ def manual_filter(df):
     final_cols.append(col_media)
 
     # garantir que colunas existam (defensivo)
-    final_cols = [c for c in final_cols if c in df_f.columns]
-
-    # ordenar sempre por TURMA, SÉRIE, ANO
-    if col_turma in df_f.columns and col_serie in df_f.columns and col_ano in df_f.columns:
-        df_f = df_f.sort_values(by=[col_turma, col_serie, col_ano])
+    final_cols = [c for c in final_cols if c in df.columns or c == col_media]
 
-    df_result = df_f[final_cols]
+    # --- Aplicar filtros ---
+    # todas as condições viram uma única máscara; o resultado (ordenado por
+    # TURMA, SÉRIE, ANO) é memoizado por filtro
+    condicoes = [(col, op, val) for col, (op, val) in condicoes_materia.items()]
+    if media_cond:
+        condicoes.append((col_media,) + media_cond)
+    spec = FilterSpec(turmas=tuple(filter_turma), series=tuple(filter_serie), anos=tuple(filter_ano),
+                      conditions=tuple(condicoes), columns=tuple(final_cols))
+    df_result = cached_analysis(dataset, "filtragem_manual", spec, lambda: apply_filter(dataset, spec))
 
     # --- Exibir resultado ---
     st.markdown("### Resultado")
-    st.dataframe(df_result, use_container_width=True)
-
-    # --- Download CSV ---
-    csv = df_result.to_csv(index=False).encode("utf-8-sig")
-    st.download_button("⬇️ Baixar CSV da filtragem", csv, file_name="filtragem_manual.csv", mime="text/csv")
+    st.dataframe(df_result, width="stretch")
+
+    # --- Download (gerado só no clique, por blocos, e reaproveitado por filtro) ---
+    formato = st.selectbox("Formato do download", available_formats(), key="filtragem_formato")
+    extensao, mime = EXPORT_FORMATS[formato]
+    chave_exportacao = (dataset.fingerprint, spec, formato)
+    st.download_button(f"⬇️ Baixar {formato} da filtragem",
+                       lambda: get_export_cache().read(chave_exportacao, df_result, formato),
+                       file_name=f"filtragem_manual{extensao}", mime=mime, on_click="ignore")
+    st.caption("O arquivo é gerado em disco, por blocos, só no clique; a entrega do download pelo "
+               "Streamlit, porém, mantém o arquivo inteiro na memória do servidor enquanto é baixado.")
 
     # --- Rodapé com informações resumidas ---
     st.markdown("---")
@@ -664,66 +1224,126 @@ def manual_filter(df):
     # contagem por turma (na amostra filtrada)
     if col_turma in df_result.columns:
         st.write("- Contagem por turma (filtrada):")
-        contagem_turma = df_result[col_turma].value_counts().rename_axis("Turma").reset_index(name="Quantidade")
-        st.dataframe(contagem_turma, use_container_width=True)
+        contagem_turma = df_result[col_turma].value_counts()
+        contagem_turma = contagem_turma[contagem_turma > 0].rename_axis("Turma").reset_index(name="Quantidade")
+        st.dataframe(contagem_turma, width="stretch")
+
+def stage_counters():
+    """Contadores do processo registrados (como variação) em cada etapa do diagnóstico."""
+    resultados = get_results_cache()
+    figuras = get_figure_cache()
+    return {
+        "cache: acertos": resultados.hits,
+        "cache: falhas": resultados.misses,
+        "imagens: acertos": figuras.images.hits,
+        "renderizações": figuras.renders,
+        "renderização (s)": figuras.render_seconds,
+    }
+
+def stages_frame(trace):
+    """Tabela das etapas de um rerun (nome recuado pela profundidade)."""
+    linhas = []
+    for etapa in trace.stages:
+        linhas.append({
+            "Etapa": "\u2003" * etapa.depth + etapa.name,
+            "Tempo (ms)": etapa.seconds * 1000,
+            "Pico (MB)": etapa.peak_mb,
+            "Linhas": etapa.rows,
+            "Cache (acertos/falhas)": f"{etapa.counters.get('cache: acertos', 0)}/"
+                                      f"{etapa.counters.get('cache: falhas', 0)}",
+            "Renderizações": etapa.counters.get("renderizações", 0),
+            "Renderização (ms)": etapa.counters.get("renderização (s)", 0.0) * 1000,
+        })
+    return pd.DataFrame(linhas)
+
+def diagnostics_panel(historico):
+    """Painel lateral com as etapas do último rerun e a exportação dos reruns da sessão."""
+    if not historico:
+        return
+    ultimo = historico[-1]
+    with st.sidebar.expander("Diagnóstico de desempenho", expanded=True):
+        st.write(f"- Último rerun: **{ultimo.seconds * 1000:.0f} ms** ({len(ultimo.stages)} etapas)")
+        st.dataframe(stages_frame(ultimo), hide_index=True, width="stretch")
+        if len(historico) > 1:
+            st.caption("Tempo dos últimos reruns (ms)")
+            st.bar_chart(pd.Series([t.seconds * 1000 for t in historico], name="Tempo (ms)"))
+        st.download_button("Exportar (JSON lines)", to_json_lines(historico), file_name="diagnostico.jsonl",
+                           mime="application/x-ndjson", key="diagnostico_jsonl")
+        st.download_button("Exportar (trace do Chrome)", to_chrome_trace(historico),
+                           file_name="diagnostico.trace.json", mime="application/json", key="diagnostico_trace",
+                           help="Abra em chrome://tracing ou ui.perfetto.dev.")
 
 def main():
     st.title("Visualizador Didático")
 
+    diagnostico = st.sidebar.toggle(
+        "Diagnóstico de desempenho", value=bool(PROFILE_LOG), key="diagnostico",
+        help="Mede tempo, linhas, acertos do cache e renderizações de cada etapa dos reruns.")
+    if not diagnostico:
+        run_dashboard()
+        return
+    memoria = st.sidebar.checkbox("Medir memória (tracemalloc)", key="diagnostico_memoria",
+                                  help="Pico de memória por etapa; deixa os reruns mais lentos.")
+    sessao = st.session_state.setdefault("diagnostico_sessao", uuid.uuid4().hex[:8])
+    with trace_rerun("rerun", session=sessao, memory=memoria, counters=stage_counters) as trace:
+        run_dashboard()
+    historico = st.session_state.setdefault("diagnostico_historico", deque(maxlen=PROFILE_HISTORY))
+    historico.append(trace)
+    append_log(trace)
+    diagnostics_panel(historico)
+
+def run_dashboard():
     uploaded_file = st.file_uploader("Carregue sua planilha", type=["csv", "xlsx"])
     if uploaded_file is None:
+        # arquivo removido: a sessão deixa de segurar o dataset
+        release_session_dataset()
         st.info("Por favor, carregue uma planilha para começar.")
         return
 
-    df = read_uploaded_file(uploaded_file)
-
-    # Criação das abas principais
-    (tab_general_review, tab_general_performance,
-     tab_subject_performance, tab_dispersal, tab_cluster, tab_filter) = st.tabs(
-        ["Visão Geral", "Desempenho Geral", "Desempenho por Disciplina",
-         "Dispersão", "Análise em Cluster", "Filtragem Manual"])
-
-    # ======================================================
-    # Aba 1: Visão Geral
-    # ======================================================
-    with tab_general_review:
-        general_review(df)
-
-    # ======================================================
-    # Aba 2: Desempenho Geral
-    # ======================================================
-
-    with tab_general_performance:
-        general_performance(df)
-
-    # ======================================================
-    # Aba 3: Desempenho por Disciplina
-    # ======================================================
-
-    with tab_subject_performance:
-        subject_performance(df)
-
-    # ======================================================
-    # Aba 4: Dispersão
-    # ======================================================
-
-    with tab_dispersal:
-        dispersal(df)
-
-    # ======================================================
-    # Aba 5: Análise em Cluster
-    # ======================================================
-
-    with tab_cluster:
-        cluster_analysis(df)
-
-    # ======================================================
-    # Aba 6: Filtragem Manual
-    # ======================================================
-
-    with tab_filter:
-        manual_filter(df)
+    with stage("leitura") as etapa:
+        dataset = load_uploaded_dataset(uploaded_file)
+        etapa.rows = dataset_rows(dataset)
+    dataset_store_panel()
+    job_panel()
+
+    # Abas principais (nome exibido -> função da aba)
+    if isinstance(dataset, StreamedDataset):
+        # CSV lido em blocos: só as abas que trabalham com resumos por grupo
+        abas = {
+            "Visão Geral": streamed_review,
+            "Desempenho Geral": general_performance,
+            "Desempenho por Disciplina": subject_performance,
+            "Dispersão": streamed_dispersal,
+        }
+    else:
+        abas = {
+            "Visão Geral": general_review,
+            "Desempenho Geral": general_performance,
+            "Desempenho por Disciplina": subject_performance,
+            "Dispersão": dispersal,
+            "Análise em Cluster": cluster_analysis,
+            "Filtragem Manual": manual_filter,
+        }
+
+    apenas_ativa = st.sidebar.toggle(
+        "Executar apenas a aba ativa", value=True, key="lazy_tabs",
+        help="Com st.tabs todas as abas rodam a cada interação; neste modo só a "
+             "análise selecionada é executada (as demais ficam em cache).")
+
+    if apenas_ativa:
+        # navegação com estado: só a análise escolhida roda neste rerun
+        aba_ativa = st.radio("Análise", list(abas), horizontal=True, key="aba_ativa",
+                             label_visibility="collapsed")
+        with stage(f"aba {aba_ativa}", rows=dataset_rows(dataset)):
+            abas[aba_ativa](dataset)
+    else:
+        # criação das abas principais (todas executam a cada rerun)
+        for tab, (nome, funcao) in zip(st.tabs(list(abas)), abas.items()):
+            with tab, stage(f"aba {nome}", rows=dataset_rows(dataset)):
+                funcao(dataset)
 
+    # depois das abas: mostra as figuras/imagens deste rerun
+    figure_cache_panel()
 
 if __name__ == "__main__":
     main()
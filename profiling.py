@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentação das etapas de cada rerun (diagnóstico de desempenho).
+
+Um rerun instrumentado (trace_rerun) registra cada etapa aberta com
+`stage(nome)` na mesma thread: tempo de parede, pico de memória (com
+tracemalloc, opcional), quantidade de linhas e a variação de contadores
+informados pelo app (ex.: acertos do cache, renderizações). Etapas podem
+ser aninhadas (leitura > parse, aba > análise > gráfico). Fora de um rerun
+instrumentado, `stage()` não mede nada e custa só a criação do registro.
+
+Os reruns podem ser exportados como JSON lines (um registro por etapa) ou
+no formato de trace do Chrome (chrome://tracing, Perfetto). Com
+PI_PROFILE_LOG, cada rerun instrumentado também é acrescentado ao arquivo.
+
+Memória e contadores são do processo inteiro: com várias sessões
+simultâneas, os números de uma etapa incluem o que as outras fizeram no
+mesmo intervalo.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+
+# Arquivo JSON lines onde os reruns instrumentados são acrescentados (vazio: não grava)
+PROFILE_LOG = os.environ.get("PI_PROFILE_LOG", "")
+# Reruns guardados por sessão para o painel e a exportação
+PROFILE_HISTORY = int(os.environ.get("PI_PROFILE_HISTORY", "20"))
+
+_MB = 1024 ** 2
+
+
+@dataclass
+class StageRecord:
+    """Uma etapa medida; `rows` pode ser preenchido dentro do bloco."""
+    name: str
+    depth: int = 0
+    start: float = 0.0         # segundos desde o início do rerun
+    seconds: float = 0.0
+    peak_mb: float = None      # só com medição de memória
+    rows: int = None
+    counters: dict = field(default_factory=dict)
+    error: str = None
+
+
+class RerunTrace:
+    """Etapas de um rerun, na ordem em que começaram."""
+
+    def __init__(self, label, session=None, memory=False, counters=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.label = label
+        self.session = session
+        self.memory = memory
+        self.started_at = time.time()
+        self.stages = []
+        self._counters = counters
+        self._t0 = time.perf_counter()
+        self._stack = []        # [início em bytes, maior pico em bytes] das etapas abertas
+
+    @property
+    def seconds(self):
+        return self.stages[0].seconds if self.stages else 0.0
+
+    def _read_counters(self):
+        return dict(self._counters()) if self._counters is not None else {}
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        registro = StageRecord(name=name, depth=len(self._stack), start=time.perf_counter() - self._t0,
+                               rows=rows)
+        self.stages.append(registro)
+        antes = self._read_counters()
+        if self.memory:
+            atual, pico = tracemalloc.get_traced_memory()
+            if self._stack:
+                # o pico até aqui pertence à etapa de fora
+                self._stack[-1][1] = max(self._stack[-1][1], pico)
+            tracemalloc.reset_peak()
+            self._stack.append([atual, atual])
+        else:
+            self._stack.append(None)
+        inicio = time.perf_counter()
+        try:
+            yield registro
+        except BaseException as erro:
+            registro.error = type(erro).__name__
+            raise
+        finally:
+            registro.seconds = time.perf_counter() - inicio
+            depois = self._read_counters()
+            registro.counters = {k: v - antes.get(k, 0) for k, v in depois.items()}
+            memoria = self._stack.pop()
+            if memoria is not None:
+                memoria[1] = max(memoria[1], tracemalloc.get_traced_memory()[1])
+                registro.peak_mb = (memoria[1] - memoria[0]) / _MB
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], memoria[1])
+
+    def to_records(self):
+        """Um dict por etapa, com a identificação do rerun (para JSON lines)."""
+        return [dict(asdict(s), rerun=self.id, session=self.session, started_at=self.started_at)
+                for s in self.stages]
+
+    def chrome_events(self, tid=0):
+        """Eventos completos ("ph": "X") do formato de trace do Chrome, em microssegundos."""
+        base = self.started_at * 1e6
+        eventos = []
+        for s in self.stages:
+            args = {"linhas": s.rows, "pico (MB)": s.peak_mb, "erro": s.error, **s.counters}
+            eventos.append({
+                "name": s.name, "cat": self.label, "ph": "X", "pid": os.getpid(), "tid": tid,
+                "ts": base + s.start * 1e6, "dur": s.seconds * 1e6,
+                "args": {k: v for k, v in args.items() if v is not None},
+            })
+        return eventos
+
+
+_local = threading.local()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+@contextmanager
+def trace_rerun(label="rerun", session=None, memory=False, counters=None):
+    """
+    Instrumenta o bloco (um rerun) nesta thread: as etapas abertas com
+    `stage()` dentro dele ficam no RerunTrace devolvido. `counters()` devolve
+    um dict de contadores do app, registrados como variação por etapa.
+    """
+    trace = RerunTrace(label, session, memory, counters)
+    if memory:
+        _start_tracemalloc()
+    _local.trace = trace
+    try:
+        with trace.stage(label):
+            yield trace
+    finally:
+        _local.trace = None
+        if memory:
+            _stop_tracemalloc()
+
+
+def stage(name, rows=None):
+    """Etapa do rerun instrumentado desta thread (sem rerun instrumentado, não mede)."""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return nullcontext(StageRecord(name, rows=rows))
+    return trace.stage(name, rows)
+
+
+def to_json_lines(traces):
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for t in traces for r in t.to_records())
+
+
+def to_chrome_trace(traces):
+    """JSON para chrome://tracing / Perfetto: uma linha (tid) por sessão."""
+    sessoes = {}
+    eventos = []
+    for t in traces:
+        tid = sessoes.setdefault(t.session, len(sessoes))
+        eventos.extend(t.chrome_events(tid))
+    nomes = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+              "args": {"name": f"sessão {sessao}"}} for sessao, tid in sessoes.items()]
+    return json.dumps({"traceEvents": nomes + eventos, "displayTimeUnit": "ms"}, ensure_ascii=False)
+
+
+def append_log(trace, path=None):
+    """Acrescenta o rerun ao arquivo JSON lines (PI_PROFILE_LOG); ignora falhas de gravação."""
+    path = path or PROFILE_LOG
+    if not path:
+        return
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(to_json_lines([trace]))
+    except OSError:
+        pass
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Esquema declarado das colunas da planilha, aplicado uma única vez na leitura.
+
+As notas/porcentagens viram float32 e as chaves de agrupamento viram
+categóricas; assim as abas não precisam mais converter (pd.to_numeric)
+as mesmas colunas a cada rerun e o DataFrame residente fica bem menor.
+"""
+from fnmatch import fnmatchcase
+
+import numpy as np
+import pandas as pd
+
+# (padrão do nome da coluna, tipo); vale a primeira regra que casar
+SCHEMA = [
+    ("NOTAS - *", "float32"),
+    ("ACERTOS - *", "float32"),
+    ("PORCENTAGENS DE ACERTO* - *", "float32"),
+    ("DADOS GERAIS - ANO", "int16"),
+    ("DADOS GERAIS - SERIE_ANO", "category"),
+    ("DADOS GERAIS - TURMA", "category"),
+    ("DADOS GERAIS - PERIODO", "category"),
+    ("DADOS GERAIS - SEXO", "category"),
+    ("DADOS GERAIS - IDADE", "int8"),
+    ("DADOS GERAIS - N*CHAMADA", "int16"),
+    ("DADOS GERAIS - validade", "int8"),
+    ("PLANILHA", "category"),
+]
+
+
+def declared_dtype(col):
+    """Tipo declarado para a coluna, ou None se ela não estiver no esquema."""
+    for padrao, dtype in SCHEMA:
+        if fnmatchcase(str(col), padrao):
+            return dtype
+    return None
+
+
+def _to_numeric(serie, dtype):
+    # mesma regra de antes para valores ausentes/inválidos: viram 0
+    valores = pd.to_numeric(serie, errors="coerce").fillna(0)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        info = np.iinfo(dtype)
+        inteiros = (valores % 1 == 0).all()
+        if not inteiros or valores.min() < info.min or valores.max() > info.max:
+            # não cabe no inteiro declarado: mantém como float compacto
+            dtype = "float32"
+    return valores.astype(dtype)
+
+
+def normalize_frame(df):
+    """
+    Deixa o DataFrame representável em formato colunar: colunas de texto
+    que ficaram com tipos misturados (ex.: texto e o 0 do fillna) viram str.
+    """
+    for col in df.columns:
+        if df[col].dtype == object and df[col].map(type).nunique() > 1:
+            df[col] = df[col].astype(str)
+    return df
+
+
+def apply_schema(df):
+    """
+    Converte as colunas do esquema para os tipos declarados. Numéricas
+    ausentes viram 0 (como no fillna(0) anterior); categóricas mantêm o
+    ausente como NaN. Colunas fora do esquema seguem com fillna(0).
+    """
+    convertidas = {}
+    for col in df.columns:
+        dtype = declared_dtype(col)
+        if dtype == "category":
+            convertidas[col] = df[col].astype("category")
+        elif dtype is not None:
+            convertidas[col] = _to_numeric(df[col], dtype)
+        else:
+            convertidas[col] = df[col].fillna(0)
+    return normalize_frame(pd.DataFrame(convertidas, index=df.index))
+
+
+def memory_report(df):
+    """
+    Memória por coluna no formato compacto (atual) e no formato sem esquema
+    (float64/int64 para números, object para texto), em KB.
+    """
+    linhas = []
+    for col in df.columns:
+        serie = df[col]
+        depois = serie.memory_usage(deep=True, index=False)
+        if pd.api.types.is_numeric_dtype(serie.dtype):
+            antes = len(serie) * 8
+        else:
+            antes = serie.astype(object).memory_usage(deep=True, index=False)
+        linhas.append({"Coluna": col, "Tipo": str(serie.dtype),
+                       "Antes (KB)": antes / 1024, "Depois (KB)": depois / 1024})
+    relatorio = pd.DataFrame(linhas)
+    relatorio["Redução (x)"] = relatorio["Antes (KB)"] / relatorio["Depois (KB)"].where(
+        relatorio["Depois (KB)"] > 0)
+    return relatorio
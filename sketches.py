@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Esboços (sketches) de quantis combináveis por grupo.
+
+Cada (grupo, coluna) guarda um histograma de SKETCH_BINS faixas iguais em
+SKETCH_RANGE (notas de 0 a 10: faixas de 0,01), com a contagem e a soma dos
+valores de cada faixa (mais uma faixa para os valores abaixo e outra para
+os acima do intervalo), além do mínimo e do máximo exatos. Só as faixas
+ocupadas são guardadas (as notas assumem poucos valores distintos), e dois
+esboços se combinam somando as faixas: por bloco de linhas, por aba ou por
+grupos selecionados.
+
+Cada quantil é estimado pelo valor médio da faixa em que cai a estatística
+de ordem correspondente, então o erro é menor que a largura de uma faixa
+(0,01) para valores dentro do intervalo, e nulo quando todos os valores da
+faixa são iguais (caso das notas com até duas casas decimais). O mínimo e o
+máximo (quantis 0 e 1) são sempre exatos. Os limites do IQR herdam o erro
+dos quartis (até 4 faixas: Q ± 1,5·IQR), e os bigodes/outliers dos boxplots
+são os valores médios das faixas ocupadas fora/dentro dos limites.
+
+O Dataset guarda um esboço das notas e da média do aluno por TURMA / SÉRIE /
+ANO, montado na leitura (grades_sketch); qualquer seleção dessas chaves é
+uma soma de faixas, sem rever os alunos. QUANTILE_MODE escolhe entre os
+quantis exatos e os do esboço ("auto": esboço a partir de SKETCH_MIN_ROWS
+alunos na seleção).
+"""
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from aggregates import combine_keys, group_ids
+from grades_core import GROUP_COLUMNS
+from outliers import WHISKER
+
+SKETCH_RANGE = (0.0, 10.0)
+SKETCH_BINS = 1000
+# Quantis dos boxplots/limites do IQR: "auto", "exato" ou "esboço"
+QUANTILE_MODE = os.environ.get("PI_QUANTILES", "auto")
+SKETCH_MIN_ROWS = int(os.environ.get("PI_SKETCH_MIN_ROWS", "100000"))
+# coluna do esboço com a média geral de cada aluno
+COL_MEDIA_ALUNO = "MÉDIA"
+
+
+# faixas por coluna: abaixo do intervalo, SKETCH_BINS faixas, acima do intervalo
+_SLOTS = SKETCH_BINS + 2
+
+
+def sketch_bins(values):
+    """Faixa de cada valor (1..SKETCH_BINS; 0 abaixo e SKETCH_BINS + 1 acima do intervalo)."""
+    lo, hi = SKETCH_RANGE
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        faixas = np.floor((values - lo) * (SKETCH_BINS / (hi - lo))).clip(0, SKETCH_BINS - 1) + 1
+        faixas = np.where(values < lo, 0, np.where(values > hi, SKETCH_BINS + 1, faixas))
+    return np.nan_to_num(faixas).astype(np.int64)
+
+
+@dataclass(frozen=True)
+class QuantileSketch:
+    """Histogramas esparsos por (grupo, coluna), identificados pelos valores das chaves."""
+    keys: pd.DataFrame     # uma linha por grupo (valores das chaves)
+    columns: tuple         # nome de cada coluna de valores
+    cells: np.ndarray      # (grupo * colunas + coluna) * (SKETCH_BINS + 2) + faixa, ordenado
+    counts: np.ndarray     # valores em cada célula
+    sums: np.ndarray       # soma dos valores em cada célula
+    minimum: np.ndarray    # (grupos x colunas)
+    maximum: np.ndarray
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.cells, self.counts, self.sums, self.minimum, self.maximum))
+
+    def _split(self):
+        """(grupo, coluna, faixa) de cada célula."""
+        return np.unravel_index(self.cells, (len(self.keys), len(self.columns), _SLOTS))
+
+    def groups(self, selection=None):
+        """Máscara dos grupos cujas chaves atendem {coluna: valor ou lista}."""
+        mascara = np.ones(len(self.keys), dtype=bool)
+        for col, valores in (selection or {}).items():
+            if not isinstance(valores, (list, tuple, set, frozenset)):
+                valores = [valores]
+            if valores:
+                mascara &= self.keys[col].isin(list(valores)).to_numpy()
+        return mascara
+
+    def histogram(self, groups=None):
+        """Contagens e somas (colunas x faixas) dos grupos selecionados (máscara)."""
+        grupo, coluna, faixa = self._split()
+        manter = np.ones(len(grupo), dtype=bool) if groups is None else groups[grupo]
+        posicao = coluna[manter] * _SLOTS + faixa[manter]
+        forma = (len(self.columns), _SLOTS)
+        contagem = np.bincount(posicao, weights=self.counts[manter], minlength=forma[0] * forma[1])
+        soma = np.bincount(posicao, weights=self.sums[manter], minlength=forma[0] * forma[1])
+        return contagem.reshape(forma).astype(np.int64), soma.reshape(forma)
+
+    def extremes(self, groups=None):
+        """Mínimo e máximo exatos de cada coluna nos grupos selecionados."""
+        sel = slice(None) if groups is None else groups
+        return (np.min(self.minimum[sel], axis=0, initial=np.inf),
+                np.max(self.maximum[sel], axis=0, initial=-np.inf))
+
+    def quantiles(self, qs, groups=None):
+        """
+        Quantis `qs` de cada coluna nos grupos selecionados, como um
+        DataFrame (colunas x quantis); interpolação linear como no pandas.
+        """
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        contagem, soma = self.histogram(groups)
+        minimo, maximo = self.extremes(groups)
+        resultado = np.full((len(self.columns), len(qs)), np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            representante = soma / contagem
+        for j in range(len(self.columns)):
+            n = contagem[j].sum()
+            if n == 0:
+                continue
+            acumulado = np.cumsum(contagem[j])
+            posicao = qs * (n - 1)
+            baixo, alto = np.floor(posicao).astype(np.int64), np.ceil(posicao).astype(np.int64)
+            vb, va = (np.select([r == 0, r == n - 1],
+                                [minimo[j], maximo[j]],
+                                representante[j][np.searchsorted(acumulado, r, side="right")])
+                      for r in (baixo, alto))
+            resultado[j] = np.clip(vb + (posicao - baixo) * (va - vb), minimo[j], maximo[j])
+        return pd.DataFrame(resultado, index=list(self.columns), columns=qs)
+
+    def count(self, groups=None):
+        """Quantidade de valores de cada coluna nos grupos selecionados."""
+        return self.histogram(groups)[0].sum(axis=1)
+
+    def fences(self, groups=None, whisker=WHISKER):
+        """Q1, Q3 e limites inferior/superior de cada coluna (como outliers.iqr_fences)."""
+        q1, q3 = self.quantiles([0.25, 0.75], groups).to_numpy().T
+        iqr = q3 - q1
+        return q1, q3, q1 - whisker * iqr, q3 + whisker * iqr
+
+    def fences_by(self, col, groups=None, whisker=WHISKER):
+        """
+        Limites de cada valor da chave `col` dentro dos grupos selecionados:
+        (valores, lower, upper), com uma linha (colunas) por valor.
+        """
+        groups = np.ones(len(self.keys), dtype=bool) if groups is None else groups
+        valores = sorted(self.keys.loc[groups, col].dropna().unique().tolist())
+        limites = [self.fences(groups & (self.keys[col] == v).to_numpy(), whisker)[2:] for v in valores]
+        forma = (len(valores), len(self.columns))
+        lower = np.array([lo for lo, _ in limites]).reshape(forma)
+        upper = np.array([hi for _, hi in limites]).reshape(forma)
+        return valores, lower, upper
+
+    def boxplot_stats(self, groups=None, whisker=WHISKER, columns=None, labels=None):
+        """
+        Estatísticas de boxplot (formato de Axes.bxp) das colunas `columns`
+        (padrão: todas) nos grupos selecionados; colunas sem valores ficam de fora.
+        """
+        columns = list(self.columns) if columns is None else list(columns)
+        labels = columns if labels is None else list(labels)
+        contagem, soma = self.histogram(groups)
+        minimo, maximo = self.extremes(groups)
+        quartis = self.quantiles([0.25, 0.5, 0.75], groups)
+        estatisticas = []
+        for col, rotulo in zip(columns, labels):
+            j = self.columns.index(col)
+            n = contagem[j].sum()
+            if n == 0:
+                continue
+            q1, med, q3 = quartis.loc[col].to_numpy()
+            ocupadas = np.flatnonzero(contagem[j])
+            valores = np.clip(soma[j][ocupadas] / contagem[j][ocupadas], minimo[j], maximo[j])
+            valores[0], valores[-1] = minimo[j], maximo[j]
+            lower, upper = q1 - whisker * (q3 - q1), q3 + whisker * (q3 - q1)
+            dentro = (valores >= lower) & (valores <= upper)
+            estatisticas.append({
+                "label": rotulo, "mean": soma[j].sum() / n, "med": med, "q1": q1, "q3": q3,
+                "whislo": valores[dentro].min() if dentro.any() else q1,
+                "whishi": valores[dentro].max() if dentro.any() else q3,
+                "fliers": valores[~dentro],
+            })
+        return estatisticas
+
+
+def use_sketch(n_rows, mode=None):
+    """Se os quantis de uma seleção com `n_rows` alunos vêm do esboço."""
+    mode = mode or QUANTILE_MODE
+    if mode == "auto":
+        return n_rows >= SKETCH_MIN_ROWS
+    return mode == "esboço"
+
+
+def sketch_stats(index, cols, values, columns, mask=None):
+    """
+    Esboço de `values` (linhas x colunas) por combinação das chaves `cols`,
+    nas linhas de `mask`. Valores ausentes (NaN) são ignorados.
+    """
+    cols = list(cols)
+    values = np.asarray(values)
+    if values.ndim == 1:
+        values = values[:, None]
+    n_cols = values.shape[1]
+    tamanhos = [len(index.labels[col]) for col in cols]
+    gid = group_ids([index.codes[col] for col in cols], tamanhos, mask)
+    # linhas ordenadas pelo grupo; ids 0..grupos-1 na ordem dos grupos presentes
+    linhas = np.flatnonzero(gid >= 0)
+    linhas = linhas[np.argsort(gid[linhas], kind="stable")]
+    g = gid[linhas]
+    inicios = np.flatnonzero(np.r_[True, g[1:] != g[:-1]]) if len(g) else np.empty(0, dtype=np.int64)
+    presentes = g[inicios]
+    grupo = np.repeat(np.arange(len(inicios)), np.diff(np.r_[inicios, len(g)]))
+    # uma linha por coluna de valores: cada coluna contígua
+    v = np.ascontiguousarray(values[linhas].T, dtype=np.float64)
+    if len(linhas):
+        minimo, maximo = np.fmin.reduceat(v, inicios, axis=1).T, np.fmax.reduceat(v, inicios, axis=1).T
+    else:
+        minimo = maximo = np.empty((0, n_cols))
+    faixas = sketch_bins(v)
+    presente = ~np.isnan(v)
+    if len(presentes) * _SLOTS <= len(linhas):
+        # poucos grupos: histograma denso por coluna (bincount), sem ordenar as linhas
+        celulas, contagens, somas = [], [], []
+        for j in range(n_cols):
+            ok = slice(None) if presente[j].all() else presente[j]
+            posicao = grupo[ok] * _SLOTS + faixas[j][ok]
+            contagem = np.bincount(posicao, minlength=len(presentes) * _SLOTS)
+            ocupadas = np.flatnonzero(contagem)
+            celulas.append((ocupadas // _SLOTS * n_cols + j) * _SLOTS + ocupadas % _SLOTS)
+            contagens.append(contagem[ocupadas])
+            somas.append(np.bincount(posicao, weights=v[j][ok], minlength=len(contagem))[ocupadas])
+        celulas = np.concatenate(celulas)
+        ordem = np.argsort(celulas, kind="stable")
+        cells, counts, sums = celulas[ordem], np.concatenate(contagens)[ordem], np.concatenate(somas)[ordem]
+    else:
+        celula = (grupo * n_cols + np.arange(n_cols)[:, None]) * _SLOTS + faixas
+        cells, inverso = np.unique(celula[presente], return_inverse=True)
+        counts = np.bincount(inverso, minlength=len(cells))
+        sums = np.bincount(inverso, weights=v[presente], minlength=len(cells))
+    return QuantileSketch(
+        keys=index.keys_frame(cols, presentes), columns=tuple(columns), cells=cells,
+        counts=counts.astype(np.int64), sums=sums,
+        # grupo/coluna só com NaN: sem valores (não afeta mínimo/máximo combinados)
+        minimum=np.where(np.isnan(minimo), np.inf, minimo), maximum=np.where(np.isnan(maximo), -np.inf, maximo),
+    )
+
+
+def grades_sketch(index, core):
+    """
+    Esboço das notas e da média do aluno por TURMA / SÉRIE / ANO (as chaves
+    presentes), montado na leitura; None sem chaves ou sem notas.
+    """
+    chaves = [col for col in GROUP_COLUMNS if col in index]
+    if not chaves or not core.columns:
+        return None
+    return sketch_stats(index, chaves, np.column_stack([core.matrix, core.means]),
+                        core.subjects + [COL_MEDIA_ALUNO])
+
+
+def merge_sketches(sketches, dtypes=None):
+    """Combina esboços com as mesmas colunas (faixas somadas), com os grupos ordenados pelas chaves."""
+    sketches = list(sketches)
+    gid, keys = combine_keys([s.keys for s in sketches], dtypes)
+    n_cols = len(sketches[0].columns)
+    celulas, contagens, somas = [], [], []
+    inicio = 0
+    for s in sketches:
+        grupo, coluna, faixa = s._split()
+        novo = gid[inicio:inicio + len(s.keys)]
+        celulas.append((novo[grupo] * n_cols + coluna) * _SLOTS + faixa)
+        contagens.append(s.counts)
+        somas.append(s.sums)
+        inicio += len(s.keys)
+    cells, inverso = np.unique(np.concatenate(celulas), return_inverse=True)
+    minimo = np.full((len(keys), n_cols), np.inf)
+    maximo = np.full((len(keys), n_cols), -np.inf)
+    np.minimum.at(minimo, gid, np.concatenate([s.minimum for s in sketches]))
+    np.maximum.at(maximo, gid, np.concatenate([s.maximum for s in sketches]))
+    return QuantileSketch(
+        keys=keys, columns=sketches[0].columns, cells=cells,
+        counts=np.bincount(inverso, weights=np.concatenate(contagens), minlength=len(cells)).astype(np.int64),
+        sums=np.bincount(inverso, weights=np.concatenate(somas), minlength=len(cells)),
+        minimum=minimo, maximum=maximo,
+    )
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Datasets compartilhados pelo processo, com contagem de referências.
+
+Cada conteúdo (hash) é lido uma única vez e fica residente enquanto alguma
+sessão o referenciar: a sessão recebe um DatasetHandle, que aponta para o
+mesmo Dataset de todas as outras sessões e abas (sem cópia), e o devolve ao
+trocar de arquivo ou quando a sessão termina (weakref.finalize no handle).
+Sem nenhuma referência, o dataset vai para um LRU limitado em bytes
+(`max_bytes`): reenviar o mesmo arquivo logo depois o reaproveita sem ler de
+novo; descartado do LRU, uma nova leitura volta a usar o snapshot em disco.
+
+Os arrays do Dataset (notas, índice, esboços) ficam somente leitura e o
+DataFrame segue o copy-on-write do pandas (padrão a partir do pandas 3):
+quem alterar recebe uma cópia própria, sem tocar na versão compartilhada.
+"""
+import dataclasses
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from cache import estimate_nbytes
+
+
+def freeze_arrays(value):
+    """Marca como somente leitura os arrays NumPy de um dataclass (e dos aninhados)."""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        for campo in dataclasses.fields(value):
+            freeze_arrays(getattr(value, campo.name))
+    elif isinstance(value, dict):
+        for item in value.values():
+            freeze_arrays(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            freeze_arrays(item)
+    return value
+
+
+class DatasetHandle:
+    """Referência de uma sessão a um dataset residente; `release()` a devolve (uma vez só)."""
+
+    def __init__(self, store, key, dataset, source=None):
+        self.key = key
+        self.dataset = dataset
+        self.source = source   # identificador do envio (ex.: file_id do Streamlit)
+        self._finalizer = weakref.finalize(self, store._release, key)
+
+    @property
+    def alive(self):
+        return self._finalizer.alive
+
+    def release(self):
+        self._finalizer()
+
+
+class DatasetStore:
+    """
+    Um Dataset por chave (hash do conteúdo), enquanto houver handles vivos;
+    os sem handles ficam num LRU de até `max_bytes` bytes.
+    Seguro para uso entre sessões do Streamlit: leituras simultâneas do mesmo
+    conteúdo esperam a primeira em vez de ler de novo.
+    """
+
+    def __init__(self, max_bytes=0, sizeof=estimate_nbytes):
+        self.max_bytes = int(max_bytes)
+        self._sizeof = sizeof
+        self._entries = {}         # chave -> [dataset, referências, bytes]
+        self._idle = OrderedDict()  # chave -> (dataset, bytes), sem referências, LRU
+        self._idle_bytes = 0
+        self._loading = {}         # chave -> lock da leitura em andamento
+        # reentrante: um handle pode ser coletado (finalize) com o lock já tomado
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._idle
+
+    def acquire(self, key, load, source=None):
+        """Handle para o dataset `key`; lê com `load()` se não estiver residente nem no LRU."""
+        with self._lock:
+            if self._revive(key):
+                return self._new_handle(key, source, reused=True)
+            carregando = self._loading.setdefault(key, threading.Lock())
+        with carregando:
+            with self._lock:
+                if self._revive(key):
+                    # lido por outra sessão enquanto esta esperava
+                    return self._new_handle(key, source, reused=True)
+            try:
+                dataset = freeze_arrays(load())
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                self._entries[key] = [dataset, 0, self._sizeof(dataset)]
+                self._loading.pop(key, None)
+                self.misses += 1
+                return self._new_handle(key, source, reused=False)
+
+    def _revive(self, key):
+        # chamado com o lock: True se `key` está residente (volta do LRU se preciso)
+        if key in self._entries:
+            return True
+        if key not in self._idle:
+            return False
+        dataset, nbytes = self._idle.pop(key)
+        self._idle_bytes -= nbytes
+        self._entries[key] = [dataset, 0, nbytes]
+        return True
+
+    def _new_handle(self, key, source, reused):
+        # chamado com o lock
+        entrada = self._entries[key]
+        entrada[1] += 1
+        self.hits += reused
+        return DatasetHandle(self, key, entrada[0], source)
+
+    def _release(self, key):
+        with self._lock:
+            entrada = self._entries.get(key)
+            if entrada is None:
+                return
+            entrada[1] -= 1
+            if entrada[1] <= 0:
+                dataset, _, nbytes = self._entries.pop(key)
+                # maiores que o limite não entram no LRU
+                if nbytes <= self.max_bytes:
+                    self._idle[key] = (dataset, nbytes)
+                    self._idle_bytes += nbytes
+                else:
+                    self.evictions += 1
+                self._evict()
+
+    def _evict(self):
+        # chamado com o lock
+        while self._idle_bytes > self.max_bytes and self._idle:
+            _, (_, nbytes) = self._idle.popitem(last=False)
+            self._idle_bytes -= nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def clear(self):
+        """Descarta os datasets sem referências (os em uso ficam)."""
+        with self._lock:
+            self.evictions += len(self._idle)
+            self._idle.clear()
+            self._idle_bytes = 0
+
+    def references(self, key):
+        with self._lock:
+            entrada = self._entries.get(key)
+            return entrada[1] if entrada else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "residentes": len(self._entries),
+                "memória (MB)": sum(e[2] for e in self._entries.values()) / 1024 ** 2,
+                "referências": sum(e[1] for e in self._entries.values()),
+                "sem referências": len(self._idle),
+                "sem referências (MB)": self._idle_bytes / 1024 ** 2,
+                "limite (MB)": self.max_bytes / 1024 ** 2,
+                "acertos": self.hits,
+                "falhas": self.misses,
+                "descartes": self.evictions,
+                "taxa de acerto (%)": 100 * self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Leitura em blocos de CSVs grandes (modo streaming).
+
+Acima de STREAM_MIN_MB, o CSV enviado não é carregado inteiro: é lido em
+blocos de STREAM_CHUNK_ROWS linhas, só com as colunas que as abas de resumo
+usam (chaves de agrupamento e notas) e com os tipos declarados no esquema.
+Cada bloco vira parciais combináveis (contagens, somas, mínimos e máximos
+por grupo, aprovação por série e esboços de quantis), que são somadas às
+do bloco anterior e descartadas; a memória depende da quantidade de grupos,
+não de alunos. Uma segunda passada conta os alunos acima da média global,
+que só é conhecida no fim da primeira.
+
+As abas que precisam dos alunos (Filtragem Manual, Cluster) não ficam
+disponíveis nesse modo.
+"""
+import io
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from aggregates import GroupPartial, merge_partials, partial_stats
+from grades_core import COL_ANO, COL_SERIE, COL_TURMA, GRADE_PREFIX, build_grades_core
+from key_index import COL_PLANILHA, INDEXED_COLUMNS, build_key_index
+from profiling import stage
+from schema import apply_schema, declared_dtype
+from sketches import QuantileSketch, grades_sketch, merge_sketches
+
+# CSVs a partir deste tamanho (MB) são lidos em blocos (abaixo do limite de
+# envio do Streamlit, server.maxUploadSize em .streamlit/config.toml)
+STREAM_MIN_MB = int(os.environ.get("PI_STREAM_MIN_MB", "128"))
+# Linhas por bloco
+STREAM_CHUNK_ROWS = int(os.environ.get("PI_STREAM_CHUNK_ROWS", "100000"))
+
+GENERAL_KEYS = [COL_TURMA, COL_SERIE, COL_ANO]
+
+
+@dataclass(frozen=True)
+class StreamedDataset:
+    """Resumo de um CSV lido em blocos, no lugar do Dataset para as abas de resumo."""
+    fingerprint: str
+    n_rows: int
+    columns: list               # colunas do arquivo (cabeçalho)
+    subjects: list              # disciplinas, na ordem de GRADE_COLUMNS
+    counts: pd.DataFrame        # alunos por (PLANILHA,) SÉRIE e TURMA
+    general: GroupPartial       # média do aluno por TURMA / SÉRIE / ANO (alunos válidos)
+    global_mean: float          # média geral de todos os alunos válidos (sem agrupar)
+    above: pd.DataFrame         # alunos acima da média global, por TURMA / SÉRIE / ANO
+    by_series: GroupPartial     # notas e aprovação (nota >= 5) por série (alunos válidos)
+    sketch: QuantileSketch      # notas e média do aluno por TURMA / SÉRIE / ANO
+    chunks: int
+
+    @property
+    def nbytes(self):
+        partes = [self.general.count, self.general.sum, self.general.min, self.general.max,
+                  self.by_series.count, self.by_series.sum, self.by_series.min, self.by_series.max]
+        quadros = [self.counts, self.above, self.general.keys, self.by_series.keys]
+        return (sum(a.nbytes for a in partes) + self.sketch.nbytes
+                + sum(int(q.memory_usage(deep=True).sum()) for q in quadros))
+
+
+def use_streaming(n_bytes, ext):
+    return ext == ".csv" and n_bytes >= STREAM_MIN_MB * 1024 ** 2
+
+
+def _open(source):
+    """Bytes viram um buffer; arquivos abertos voltam ao início (cada passada relê)."""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def stream_columns(header):
+    """
+    Projeção lida do CSV: chaves indexadas e notas, na ordem do arquivo;
+    None se faltar alguma chave de agrupamento ou não houver notas.
+    """
+    colunas = [c for c in header if c in INDEXED_COLUMNS or str(c).startswith(GRADE_PREFIX)]
+    if not all(c in colunas for c in GENERAL_KEYS) or not any(
+            str(c).startswith(GRADE_PREFIX) for c in colunas):
+        return None
+    return colunas
+
+
+def csv_dtypes(columns, numeric=True):
+    """
+    Tipos declarados para o read_csv: categóricas do esquema e, com `numeric`,
+    float32 para as numéricas (o esquema converte para o tipo final depois).
+    """
+    tipos = {}
+    for col in columns:
+        dtype = declared_dtype(col)
+        if dtype == "category":
+            tipos[col] = "category"
+        elif dtype is not None and numeric:
+            tipos[col] = "float32"
+    return tipos
+
+
+def _stream_pass(source, columns, chunk_rows, reduce, combine):
+    """
+    Uma passada pelo CSV: `reduce(bloco tipado)` em cada bloco, combinado ao
+    acumulado com `combine(acumulado, parte)`. Se alguma coluna numérica tiver
+    texto, refaz a passada lendo as numéricas sem tipo declarado (o esquema
+    converte, como na leitura completa).
+    """
+    for numeric in (True, False):
+        acumulado = None
+        try:
+            with pd.read_csv(_open(source), usecols=columns, dtype=csv_dtypes(columns, numeric),
+                             chunksize=chunk_rows) as leitor:
+                for bloco in leitor:
+                    parte = reduce(apply_schema(bloco))
+                    acumulado = parte if acumulado is None else combine(acumulado, parte)
+            return acumulado
+        except ValueError:
+            if not numeric:
+                raise
+    return None
+
+
+def _key_dtypes(df):
+    """Tipo final das chaves: categóricas são refeitas com os valores de todos os blocos."""
+    return {col: "category" if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].dtype
+            for col in df.columns if col in INDEXED_COLUMNS}
+
+
+def _sum_counts(frames, cols, name):
+    """Soma contagens por chave de vários blocos."""
+    total = pd.concat([f.astype({c: object for c in cols}) for f in frames], ignore_index=True)
+    return total.groupby(cols, sort=True)[name].sum().reset_index()
+
+
+def _reduce_chunk(df):
+    core = build_grades_core(df)
+    index = build_key_index(df, core)
+    colunas_contagem = [c for c in (COL_PLANILHA, COL_SERIE, COL_TURMA) if c in index]
+    return {
+        "linhas": len(df),
+        "blocos": 1,
+        "tipos": _key_dtypes(df),
+        "subjects": core.subjects,
+        "counts": index.group_counts(colunas_contagem, name="Quantidade de alunos"),
+        "general": partial_stats(index, GENERAL_KEYS, core.means, core.valid),
+        # soma/contagem sem agrupar: inclui os alunos sem TURMA/SÉRIE/ANO
+        "soma_medias": float(core.means[core.valid].sum(dtype=np.float64)),
+        "validos": int(core.valid.sum()),
+        "by_series": partial_stats(index, [COL_SERIE], np.hstack([core.matrix, core.pass_mask]),
+                                   core.valid),
+        "sketch": grades_sketch(index, core),
+    }
+
+
+def _combine_chunks(a, b):
+    colunas_contagem = [c for c in a["counts"].columns if c != "Quantidade de alunos"]
+    return {
+        "linhas": a["linhas"] + b["linhas"],
+        "blocos": a["blocos"] + b["blocos"],
+        "tipos": {**b["tipos"], **a["tipos"]},
+        "subjects": a["subjects"],
+        "counts": _sum_counts([a["counts"], b["counts"]], colunas_contagem, "Quantidade de alunos"),
+        "general": merge_partials([a["general"], b["general"]]),
+        "soma_medias": a["soma_medias"] + b["soma_medias"],
+        "validos": a["validos"] + b["validos"],
+        "by_series": merge_partials([a["by_series"], b["by_series"]]),
+        "sketch": merge_sketches([a["sketch"], b["sketch"]]),
+    }
+
+
+def _with_dtypes(df, dtypes):
+    return df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+
+
+def stream_csv(source, fingerprint, chunk_rows=None):
+    """
+    Lê o CSV (caminho, bytes ou arquivo aberto em modo binário) em blocos e devolve o StreamedDataset; None
+    se o arquivo não tiver as chaves de agrupamento e as notas, ou nenhuma linha.
+    """
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    header = list(pd.read_csv(_open(source), nrows=0).columns)
+    colunas = stream_columns(header)
+    if colunas is None:
+        return None
+    with stage("streaming: resumos por bloco") as etapa:
+        total = _stream_pass(source, colunas, chunk_rows, _reduce_chunk, _combine_chunks)
+        etapa.rows = total["linhas"] if total is not None else 0
+    if total is None or total["linhas"] == 0:
+        return None
+    tipos = total["tipos"]
+    general = total["general"]
+    media_global = total["soma_medias"] / total["validos"] if total["validos"] else np.nan
+
+    # segunda passada: acima da média global, que só agora é conhecida
+    def acima(df):
+        core = build_grades_core(df)
+        index = build_key_index(df, core)
+        return index.group_counts(GENERAL_KEYS, core.valid & (core.means > media_global), name="above")
+
+    with stage("streaming: acima da média", rows=total["linhas"]):
+        above = _stream_pass(source, colunas, chunk_rows, acima,
+                             lambda a, b: _sum_counts([a, b], GENERAL_KEYS, "above"))
+
+    return StreamedDataset(
+        fingerprint=fingerprint,
+        n_rows=total["linhas"],
+        columns=header,
+        subjects=total["subjects"],
+        counts=_with_dtypes(total["counts"], tipos),
+        general=merge_partials([general], tipos),
+        global_mean=media_global,
+        above=_with_dtypes(above, tipos),
+        by_series=merge_partials([total["by_series"]], tipos),
+        sketch=merge_sketches([total["sketch"]], tipos),
+        chunks=total["blocos"],
+    )
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Geração de planilhas sintéticas com o mesmo esquema de cabeçalho de duas
+linhas usado pelo app (DADOS GERAIS / NOTAS / ACERTOS / PORCENTAGENS DE
+ACERTOS). Serve para benchmarks sem expor dados reais de alunos.
+
+Os alunos são divididos em várias abas (uma por escola/ano). Em .xlsx cada
+aba mantém o cabeçalho de duas linhas; em .csv as abas são gravadas uma
+após a outra com os nomes já achatados (“DADOS GERAIS - TURMA”) e a coluna
+PLANILHA, como o app recebe um CSV.
+
+    python synthetic.py dados.xlsx --alunos 100000 --abas 20
+    python synthetic.py dados.csv --alunos 1000000 --abas 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from ingest import flatten_multilevel_columns
+from key_index import COL_PLANILHA
+
+DISCIPLINAS = ["LP", "LI", "BIO", "FÍS", "QUÍ", "MAT", "GEO", "HIS", "FIL", "SOC"]
+# quantidade de questões por disciplina (nota = 10 * acertos / questões)
+QUESTOES = [20, 4, 8, 8, 8, 20, 7, 7, 4, 4]
+SERIES = ["EM-1ª série", "EM-2ª série", "EM-3ª série"]
+TURMAS = list("ABCDEFGH")
+PERIODOS = ["MANHÃ", "TARDE", "NOITE"]
+
+
+def make_school_frame(n_alunos, ano=2024, seed=0):
+    """DataFrame com colunas em MultiIndex (topo, sub), como na planilha real."""
+    rng = np.random.default_rng(seed)
+    # habilidade latente do aluno + variação por disciplina
+    habilidade = rng.beta(2.2, 3.0, size=n_alunos)
+    colunas = {
+        ("DADOS GERAIS", "ANO"): np.full(n_alunos, ano),
+        ("DADOS GERAIS", "SERIE_ANO"): rng.choice(SERIES, size=n_alunos),
+        ("DADOS GERAIS", "TURMA"): rng.choice(TURMAS, size=n_alunos),
+        ("DADOS GERAIS", "Nº\nCHAMADA"): rng.integers(1, 46, size=n_alunos),
+        ("DADOS GERAIS", "CD_ALUNO_ANONIMIZADO"): [f"{v:030X}" for v in rng.integers(0, 2 ** 62, size=n_alunos)],
+        ("DADOS GERAIS", "SEXO"): rng.choice(["F", "M"], size=n_alunos),
+        ("DADOS GERAIS", "IDADE"): rng.integers(14, 20, size=n_alunos),
+        ("DADOS GERAIS", "PERIODO"): rng.choice(PERIODOS, size=n_alunos, p=[0.5, 0.3, 0.2]),
+        ("DADOS GERAIS", "validade"): np.ones(n_alunos, dtype=int),
+    }
+    acertos = {}
+    for disc, questoes in zip(DISCIPLINAS, QUESTOES):
+        p = np.clip(habilidade + rng.normal(0, 0.12, size=n_alunos), 0, 1)
+        acertos[disc] = rng.binomial(questoes, p)
+    for disc, questoes in zip(DISCIPLINAS, QUESTOES):
+        colunas[("NOTAS", disc)] = np.round(10 * acertos[disc] / questoes, 2)
+    for disc in DISCIPLINAS:
+        colunas[("ACERTOS", disc)] = acertos[disc].astype(float)
+    for disc, questoes in zip(DISCIPLINAS, QUESTOES):
+        colunas[("PORCENTAGENS DE ACERTOS", disc)] = np.round(100 * acertos[disc] / questoes, 1)
+    return pd.DataFrame(colunas)
+
+
+def sheet_name(i):
+    """Nome da i-ésima aba: cinco anos (2020 a 2024) por escola."""
+    return f"Escola {i // 5 + 1}-{2020 + i % 5}"
+
+
+def make_sheets(n_alunos, n_sheets, seed=0):
+    """Gera (nome da aba, DataFrame) dividindo `n_alunos` entre `n_sheets` abas."""
+    n_sheets = max(1, min(n_sheets, n_alunos))
+    tamanhos = np.full(n_sheets, n_alunos // n_sheets)
+    tamanhos[:n_alunos % n_sheets] += 1
+    for i, tamanho in enumerate(tamanhos):
+        yield sheet_name(i), make_school_frame(int(tamanho), ano=2020 + i % 5, seed=seed + i)
+
+
+def _write_sheets(path, sheets):
+    wb = Workbook(write_only=True)
+    for nome, df in sheets:
+        ws = wb.create_sheet(title=nome)
+        ws.append([top for top, _ in df.columns])
+        ws.append([sub for _, sub in df.columns])
+        for linha in df.itertuples(index=False):
+            ws.append([v.item() if isinstance(v, np.generic) else v for v in linha])
+    wb.save(path)
+    return path
+
+
+def write_workbook(path, n_sheets, alunos_por_planilha, seed=0):
+    """Grava uma planilha .xlsx com `n_sheets` abas (uma por escola/período)."""
+    return _write_sheets(path, make_sheets(n_sheets * alunos_por_planilha, n_sheets, seed))
+
+
+def write_csv(path, n_alunos, n_sheets=10, seed=0):
+    """Grava um .csv com as abas em sequência (uma aba na memória por vez)."""
+    for i, (nome, df) in enumerate(make_sheets(n_alunos, n_sheets, seed)):
+        df = flatten_multilevel_columns(df)
+        df[COL_PLANILHA] = nome
+        df.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
+def write_students(path, n_alunos, n_sheets=10, seed=0):
+    """Grava `n_alunos` em `n_sheets` abas, no formato da extensão (.xlsx ou .csv)."""
+    _, ext = os.path.splitext(path.lower())
+    if ext == ".csv":
+        return write_csv(path, n_alunos, n_sheets, seed)
+    if ext == ".xlsx":
+        return _write_sheets(path, make_sheets(n_alunos, n_sheets, seed))
+    raise ValueError(f"Formato de arquivo não suportado: {ext}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera uma planilha sintética (.xlsx ou .csv) de alunos.")
+    parser.add_argument("saida", help="arquivo gerado (.xlsx ou .csv)")
+    parser.add_argument("--alunos", type=int, default=10000, help="total de alunos (ex.: 1000 a 1000000)")
+    parser.add_argument("--abas", type=int, default=10, help="quantidade de abas (escolas/anos)")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    try:
+        write_students(args.saida, args.alunos, args.abas, args.semente)
+    except ValueError as erro:
+        print(erro, file=sys.stderr)
+        return 1
+    tamanho = os.path.getsize(args.saida) / 1024 ** 2
+    print(f"{args.saida}: {args.alunos} alunos, {tamanho:.1f} MB em {time.perf_counter() - inicio:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())